@@ -26,3 +26,7 @@ from theano.compile.pfunc import pfunc, Param, rebuild_collect_shared
 from theano.compile.builders import *
 
 from theano.compile.function import function, function_dump
+
+from theano.compile.stream import stream_function
+
+from theano.compile.prefetch import SharedPrefetcher
@@ -9,13 +9,15 @@ import logging
 import traceback as tb
 import re
 
-from six import string_types
+from six import string_types, iteritems
 from theano.compile.io import In
-from theano.compile.function_module import orig_function
+from theano.compile.function_module import (orig_function,
+                                            ShapeSpecializedFunction)
 from theano.compile.pfunc import pfunc
 import numpy as np
 import warnings
 from theano import compat
+from theano.compat import izip
 
 __docformat__ = "restructuredtext en"
 _logger = logging.getLogger('theano.compile.function')
@@ -76,7 +78,7 @@ def function_dump(filename, inputs, outputs=None, mode=None, updates=None,
 def function(inputs, outputs=None, mode=None, updates=None, givens=None,
              no_default_updates=False, accept_inplace=False, name=None,
              rebuild_strict=True, allow_input_downcast=None, profile=None,
-             on_unused_input=None):
+             on_unused_input=None, specialize_shapes=False):
     """
     Return a :class:`callable object <theano.compile.function_module.Function>`
     that will calculate `outputs` from `inputs`.
@@ -133,12 +135,21 @@ def function(inputs, outputs=None, mode=None, updates=None, givens=None,
     on_unused_input
         What to do if a variable in the 'inputs' list is not used in the graph.
         Possible values are 'raise', 'warn', 'ignore' and None.
+    specialize_shapes : bool or int
+        If True or a positive int, also compile versions of the function
+        specialized to the shapes of the tensor inputs it is called with
+        repeatedly. An int is the maximum number of versions kept, True
+        means 8. See
+        :class:`theano.compile.function_module.ShapeSpecializedFunction`.
 
     Returns
     -------
     :class:`theano.compile.function_module.Function` instance
         A callable object that will compute the outputs (given the inputs) and
         update the implicit function arguments according to the `updates`.
+        With `specialize_shapes`, a
+        :class:`theano.compile.function_module.ShapeSpecializedFunction`
+        instance.
 
     Notes
     -----
@@ -260,6 +271,27 @@ def function(inputs, outputs=None, mode=None, updates=None, givens=None,
                 func_frame = stack[idx - 1]
             name = func_frame[0] + ':' + str(func_frame[1])
 
+    if specialize_shapes:
+        if output_keys is not None:
+            outputs = dict(izip(output_keys, outputs))
+
+        def build(inputs, extra_givens):
+            all_givens = list(iteritems(givens)
+                              if isinstance(givens, dict)
+                              else givens or [])
+            return function(inputs, outputs, mode=mode, updates=updates,
+                            givens=all_givens + extra_givens,
+                            no_default_updates=no_default_updates,
+                            accept_inplace=accept_inplace, name=name,
+                            rebuild_strict=rebuild_strict,
+                            allow_input_downcast=allow_input_downcast,
+                            profile=profile,
+                            on_unused_input=on_unused_input)
+        if specialize_shapes is True:
+            return ShapeSpecializedFunction(build, inputs)
+        return ShapeSpecializedFunction(build, inputs,
+                                        max_versions=specialize_shapes)
+
     if updates is None:
         updates = []
 
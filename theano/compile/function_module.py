@@ -5,6 +5,7 @@ Driver of graph construction, optimization, and linking.
 from __future__ import absolute_import, print_function, division
 
 import copy
+import multiprocessing
 from six import string_types, iteritems, iterkeys
 from six.moves import xrange
 import six.moves.copyreg as copyreg
@@ -16,14 +17,13 @@ import numpy as np
 
 import theano
 from theano import config, gof
-from theano.compat import izip
+from theano.compat import izip, OrderedDict
 from theano.gof import graph
 import theano.compile.mode
 import theano.compile.profiling
 from theano.compile.io import (
     In, SymbolicInput, SymbolicOutput)
 from theano.compile.ops import deep_copy_op, view_op
-from theano.gof.graph import is_same_graph
 from theano.gof.op import ops_with_inner_function
 
 import logging
@@ -375,6 +375,10 @@ class Function(object):
         self.name = None
         self.nodes_with_inner_function = []
         self.output_keys = output_keys
+        # Computed by the first call to fast_call()
+        self._fast_call_info = None
+        # Computed by the first call with out=...
+        self._output_shapes_info = None
 
         # We will be popping stuff off this `containers` object.  It is a copy.
         containers = list(self.input_storage)
@@ -502,6 +506,150 @@ class Function(object):
             if node.op in ops_with_inner_function:
                 self.nodes_with_inner_function.append(node.op)
 
+    def _output_shapes(self):
+        """
+        Return a function computing the shapes of the outputs from the
+        inputs of this function, and the slice of its outputs that are
+        the shape of each output of this function.
+
+        Only the outputs whose shape can be computed without doing the
+        computation of the function have a slice, the others have None.
+
+        """
+        if self._output_shapes_info is not None:
+            return self._output_shapes_info
+        from theano.tensor.opt import ShapeFeature
+        fgraph = self.maker.fgraph.clone_get_equiv(attach_feature=False)[0]
+        fgraph.attach_feature(ShapeFeature())
+        computed = set(v for v in fgraph.variables if v.owner is not None)
+        inputs = [i.type() for i in fgraph.inputs]
+        shapes = []
+        slices = []
+        for var in fgraph.outputs:
+            shape = fgraph.shape_feature.shape_of.get(var)
+            if (var.owner is None or shape is None or
+                    computed.intersection(graph.ancestors(shape))):
+                slices.append(None)
+                continue
+            slices.append(slice(len(shapes), len(shapes) + len(shape)))
+            shapes.extend(shape)
+        fn = None
+        if shapes:
+            # Fresh inputs, as some inputs of fgraph are shared variables.
+            equiv = graph.clone_get_equiv(
+                fgraph.inputs, shapes,
+                memo=dict(zip(fgraph.inputs, inputs)))
+            fn = theano.function(inputs, [equiv[s] for s in shapes],
+                                 mode=self.maker.mode,
+                                 on_unused_input='ignore')
+        self._output_shapes_info = fn, slices
+        return self._output_shapes_info
+
+    def _set_output_buffers(self, out):
+        """
+        Check the `out` argument of __call__ and put its buffers in the
+        output storage.
+
+        The storage of those outputs is removed from the storage that the
+        VM clears before each call, so that the Ops computing them can
+        reuse the buffers.
+
+        Returns
+        -------
+        out : list
+            One buffer or None per returned output.
+        pre_call_clear : list or None
+            The storage the VM cleared before the call, to give to
+            _release_output_buffers.
+
+        """
+        if isinstance(out, dict):
+            if self.output_keys is None:
+                raise TypeError("out can only be a dict when the outputs "
+                                "of the function are a dict.")
+            out = [out.get(key) for key in self.output_keys]
+        out = list(out)
+        if len(out) != self.n_returned_outputs:
+            raise ValueError("out must have one buffer or None per output, "
+                             "expected %d, got %d." % (
+                                 self.n_returned_outputs, len(out)))
+        inputs = [c.storage[0] for c in self.input_storage]
+        for i, buf in enumerate(out):
+            if buf is None:
+                continue
+            var = self.maker.fgraph.outputs[i]
+            if not isinstance(buf, np.ndarray):
+                raise TypeError("The buffers in out must be ndarrays, got "
+                                "%s for output %d." % (type(buf), i))
+            if (getattr(var.type, 'dtype', None) != str(buf.dtype) or
+                    getattr(var.type, 'ndim', None) != buf.ndim):
+                raise TypeError(
+                    "The buffer given in out for output %d has dtype %s and "
+                    "%d dimensions, but the output type is %s." % (
+                        i, buf.dtype, buf.ndim, var.type))
+            if not (buf.flags.c_contiguous and buf.flags.writeable and
+                    buf.flags.aligned):
+                raise ValueError("The buffer given in out for output %d "
+                                 "must be C-contiguous, aligned and "
+                                 "writeable." % i)
+            for other in inputs + out[:i]:
+                if (isinstance(other, np.ndarray) and
+                        np.may_share_memory(buf, other)):
+                    raise ValueError("The buffer given in out for output %d"
+                                     " shares memory with an input or "
+                                     "another buffer." % i)
+
+        # The buffers are only put in the output storage when we know
+        # their shape is the one of the output, as the Ops would otherwise
+        # resize them. The value of the other outputs is copied in their
+        # buffer after the call. The storage of an output that is not
+        # computed is also the one of an input, so it is never used.
+        computed = [False] * len(out)
+        shape_fn, slices = self._output_shapes()
+        if shape_fn is not None and any(
+                buf is not None and slices[i] is not None
+                for i, buf in enumerate(out)):
+            try:
+                shapes = shape_fn(*inputs)
+            except Exception:
+                # The call will raise a better error.
+                shapes = None
+            for i, buf in enumerate(out):
+                if buf is None or slices[i] is None or shapes is None:
+                    continue
+                shape = tuple(int(d) for d in shapes[slices[i]])
+                if buf.shape != shape:
+                    raise ValueError(
+                        "The buffer given in out for output %d has shape "
+                        "%s, but the output has shape %s." % (
+                            i, buf.shape, shape))
+                computed[i] = True
+        pre_call_clear = getattr(self.fn, 'pre_call_clear', None)
+        cells = [self.output_storage[i].storage
+                 for i, c in enumerate(computed) if c]
+        if pre_call_clear is not None:
+            saved = list(pre_call_clear)
+            pre_call_clear[:] = [c for c in saved
+                                 if not any(c is cell for cell in cells)]
+            pre_call_clear = (pre_call_clear, saved)
+        for i, c in enumerate(computed):
+            if c:
+                self.output_storage[i].storage[0] = out[i]
+        return out, pre_call_clear
+
+    def _release_output_buffers(self, out, pre_call_clear):
+        """
+        Undo _set_output_buffers, so that the next calls do not write in
+        the buffers given in `out`.
+
+        """
+        if pre_call_clear is not None:
+            pre_call_clear[0][:] = pre_call_clear[1]
+        for i, buf in enumerate(out):
+            if (buf is not None and
+                    self.output_storage[i].storage[0] is buf):
+                self.output_storage[i].storage[0] = None
+
     def __contains__(self, item):
         return self.value.__contains__(item)
 
@@ -744,6 +892,16 @@ class Function(object):
             and processed. To disable the updates, you should use the ``copy``
             method with ``delete_updates=True``.
 
+            Keyword argument ``out`` is a list (or a dict, if the outputs are
+            a dict) of ndarrays, one per output or None, in which to write
+            the outputs. The linkers that honor preallocated outputs (e.g.
+            the C implementations) write directly in those buffers, the
+            others write in new arrays that are copied in them. The buffers
+            are returned instead of new arrays. They must be C-contiguous,
+            writeable, have the dtype and number of dimensions of their
+            output and not share memory with the inputs. It is not used if
+            an input is named ``out``.
+
         Returns
         -------
         list
@@ -764,6 +922,13 @@ class Function(object):
             output_subset =\
                 [self.output_keys.index(key) for key in output_subset]
 
+        out = None
+        if 'out' in kwargs and 'out' not in self.finder:
+            out = kwargs.pop('out')
+            if output_subset is not None:
+                raise ValueError("out and output_subset can not be used "
+                                 "together.")
+
         # Reinitialize each container's 'provided' counter
         if self.trust_input:
             i = 0
@@ -877,6 +1042,13 @@ class Function(object):
                         % getattr(self.inv_finder[c], 'variable',
                                   self.inv_finder[c]))
 
+        if out is not None:
+            try:
+                out, pre_call_clear = self._set_output_buffers(out)
+            except Exception:
+                restore_defaults()
+                raise
+
         # Do the actual work
         t0_fn = time.time()
         try:
@@ -885,20 +1057,9 @@ class Function(object):
                 self.fn(output_subset=output_subset)
         except Exception:
             restore_defaults()
-            if hasattr(self.fn, 'position_of_error'):
-                # this is a new vm-provided function or c linker
-                # they need this because the exception manipulation
-                # done by raise_with_op is not implemented in C.
-                thunk = None
-                if hasattr(self.fn, 'thunks'):
-                    thunk = self.fn.thunks[self.fn.position_of_error]
-                gof.link.raise_with_op(
-                    node=self.fn.nodes[self.fn.position_of_error],
-                    thunk=thunk,
-                    storage_map=getattr(self.fn, 'storage_map', None))
-            else:
-                # old-style linkers raise their own exceptions
-                raise
+            if out is not None:
+                self._release_output_buffers(out, pre_call_clear)
+            self._reraise_fn_error()
 
         dt_fn = time.time() - t0_fn
         self.maker.mode.fn_time += dt_fn
@@ -910,6 +1071,21 @@ class Function(object):
             outputs = [x.data for x in self.output_storage]
         assert len(outputs) == len(self.output_storage)
 
+        if out is not None:
+            self._release_output_buffers(out, pre_call_clear)
+            outputs = list(outputs)
+            for i, buf in enumerate(out):
+                if buf is None or outputs[i] is buf:
+                    continue
+                if outputs[i].shape != buf.shape:
+                    restore_defaults()
+                    raise ValueError(
+                        "The buffer given in out for output %d has shape %s,"
+                        " but the output has shape %s." % (
+                            i, buf.shape, outputs[i].shape))
+                buf[...] = outputs[i]
+                outputs[i] = buf
+
         # Remove internal references to required inputs.
         # These cannot be re-used anyway.
         for c in self.input_storage:
@@ -977,6 +1153,185 @@ class Function(object):
             else:
                 return [outputs[i] for i in output_subset]
 
+    def _reraise_fn_error(self):
+        # Reraise the exception raised by self.fn, with information on the
+        # node that failed.
+        if hasattr(self.fn, 'position_of_error'):
+            # this is a new vm-provided function or c linker
+            # they need this because the exception manipulation
+            # done by raise_with_op is not implemented in C.
+            thunk = None
+            if hasattr(self.fn, 'thunks'):
+                thunk = self.fn.thunks[self.fn.position_of_error]
+            gof.link.raise_with_op(
+                node=self.fn.nodes[self.fn.position_of_error],
+                thunk=thunk,
+                storage_map=getattr(self.fn, 'storage_map', None))
+        else:
+            # old-style linkers raise their own exceptions
+            raise
+
+    def _prepare_fast_call(self):
+        """
+        Return what `fast_call` precomputes, or False if the function must
+        be called through `__call__`.
+
+        """
+        if any(refeed for required, refeed, value in self.defaults):
+            # The default values would have to be restored after each call.
+            return False
+        if any(getattr(inp, 'mutable', False) for inp in self.maker.inputs):
+            # Aliased inputs would have to be copied before each call.
+            return False
+        explicit = [c for c in self.input_storage if not c.implicit]
+        if self.input_storage[:len(explicit)] != explicit:
+            return False
+        checks = []
+        for c in explicit:
+            if isinstance(c.type, theano.tensor.TensorType):
+                bcast_dims = tuple(i for i, b in enumerate(c.type.broadcastable)
+                                   if b)
+                checks.append((np.dtype(c.type.dtype), c.type.ndim,
+                               bcast_dims))
+            else:
+                checks.append(None)
+        # The storage of the required inputs is cleared after each call.
+        required = [c.storage for c in self.input_storage if c.required]
+        if getattr(self.fn, 'allow_gc', False):
+            cleared = [c.storage for c, o in zip(self.output_storage,
+                                                 self.maker.fgraph.outputs)
+                       if o.owner is not None]
+        else:
+            cleared = []
+        if getattr(self.fn, 'need_update_inputs', True):
+            updated = [c for inp, c in reversed(list(zip(
+                self.maker.expanded_inputs, self.input_storage)))
+                if inp.update is not None]
+        else:
+            updated = None
+        return (explicit, checks, required, cleared, updated)
+
+    def fast_call(self, *args):
+        """
+        Evaluate the function on positional arguments, with less overhead
+        than `__call__`.
+
+        All the inputs that are not shared variables must be given, in
+        order. Keyword arguments and `output_subset` are not supported.
+
+        If `trust_input` is False, the ndarray arguments of tensor inputs
+        are only checked for their dtype, number of dimensions and
+        broadcastable dimensions. They are not converted nor copied, and
+        they are not checked for aliasing. Other arguments go through the
+        `filter` of their type as in `__call__`.
+
+        Returns
+        -------
+        The same as `__call__`. The call is not included in the `call_time`
+        and `fn_time` of the mode.
+
+        """
+        info = self._fast_call_info
+        if info is None:
+            info = self._fast_call_info = self._prepare_fast_call()
+        if not info or self.profile:
+            return self(*args)
+        explicit, checks, required, cleared, updated = info
+
+        if len(args) != len(explicit):
+            raise TypeError("fast_call expects %d arguments, got %d" % (
+                len(explicit), len(args)))
+        if self.trust_input:
+            for c, arg in izip(explicit, args):
+                c.storage[0] = arg
+        else:
+            for i, (c, check, arg) in enumerate(izip(explicit, checks, args)):
+                if (check is not None and type(arg) is np.ndarray and
+                        arg.dtype == check[0] and arg.ndim == check[1]):
+                    for d in check[2]:
+                        if arg.shape[d] != 1:
+                            raise TypeError(
+                                "Bad input argument to theano function at "
+                                "index %d (0-based): dimension %d is "
+                                "broadcastable but has length %d" % (
+                                    i, d, arg.shape[d]))
+                    c.storage[0] = arg
+                elif arg is None:
+                    c.storage[0] = arg
+                else:
+                    c.storage[0] = c.type.filter(
+                        arg, strict=c.strict, allow_downcast=c.allow_downcast)
+
+        try:
+            outputs = self.fn()
+        except Exception:
+            self._reraise_fn_error()
+        if outputs is None:
+            outputs = [x.data for x in self.output_storage]
+        for storage in required:
+            storage[0] = None
+        for storage in cleared:
+            storage[0] = None
+        if updated is not None:
+            for c in updated:
+                c.data = outputs.pop()
+        else:
+            outputs = outputs[:self.n_returned_outputs]
+
+        if self.return_none:
+            return None
+        elif self.unpack_single and len(outputs) == 1:
+            return outputs[0]
+        elif self.output_keys is not None:
+            return dict(izip(self.output_keys, outputs))
+        return outputs
+
+    def map(self, inputs, processes=None, chunksize=1):
+        """
+        Evaluate the function on many sets of arguments.
+
+        The calls go through `fast_call`, so the input and output storage
+        stays bound between them.
+
+        Parameters
+        ----------
+        inputs : iterable
+            Each element is the tuple of positional arguments of one call.
+        processes : int, optional
+            If provided, the calls are done by that many worker processes.
+            Each one unpickles a copy of the function, which reuses the C
+            modules already in the compiledir. The function must not have
+            updates, as they would only change the copies.
+        chunksize : int
+            Number of calls sent at once to a worker process.
+
+        Returns
+        -------
+        generator
+            The results of the calls, in the order of `inputs`. Without
+            `processes`, a result may be overwritten by the next call if an
+            output is borrowed (see `Out`).
+
+        """
+        if processes is None:
+            return (self.fast_call(*args) for args in inputs)
+        if any(inp.update is not None for inp in self.maker.expanded_inputs):
+            raise ValueError("Function.map can't use worker processes for "
+                             "a function with updates")
+        return self._map_processes(inputs, processes, chunksize)
+
+    def _map_processes(self, inputs, processes, chunksize):
+        pool = multiprocessing.Pool(
+            processes, _map_worker_init,
+            (pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL),))
+        try:
+            for result in pool.imap(_map_worker_call, inputs, chunksize):
+                yield result
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
     value = property(
         lambda self: self._value,
         None,  # this property itself is not settable
@@ -1057,6 +1412,136 @@ def _constructor_Function(maker, input_storage, inputs_data):
 copyreg.pickle(Function, _pickle_Function)
 
 
+# The copy of the function used by a worker process of Function.map
+_map_worker_function = None
+
+
+def _map_worker_init(pickled_function):
+    global _map_worker_function
+    _map_worker_function = pickle.loads(pickled_function)
+
+
+def _map_worker_call(args):
+    return _map_worker_function.fast_call(*args)
+
+
+class ShapeSpecializedFunction(object):
+    """
+    A function that compiles versions specialized to the shapes of its
+    inputs.
+
+    Once the same shapes of the tensor inputs have been seen `min_calls`
+    times, a version of the function where those inputs go through
+    `specify_shape` is compiled. The optimizations that need constant
+    shapes can then apply to it. At most `max_versions` specialized
+    versions are kept, the least recently used one is dropped first. The
+    generic version is used for the other calls, the calls with keyword
+    arguments or with inputs whose shape cannot be read.
+
+    The other attributes are the ones of the generic version. All the
+    versions share the same shared variables and updates.
+
+    Parameters
+    ----------
+    build : callable
+        `build(inputs, givens)` compiles a Function with those inputs and
+        those extra givens.
+    inputs : list of Variable or In instances
+        The inputs of the function.
+    max_versions : int
+        The maximum number of specialized versions kept.
+
+    """
+
+    # Number of calls with the same shapes before they are specialized.
+    min_calls = 2
+    # Number of shapes seen less than min_calls times that are remembered.
+    max_counts = 64
+
+    def __init__(self, build, inputs, max_versions=8):
+        from theano.tensor import TensorType
+        self.build = build
+        self.inputs = list(inputs)
+        self.specialized = [
+            isinstance(getattr(i, 'variable', i).type, TensorType) and
+            getattr(i, 'variable', i).ndim > 0
+            for i in self.inputs]
+        self.max_versions = max_versions
+        self.generic = build(self.inputs, [])
+        self.versions = OrderedDict()
+        self.call_counts = OrderedDict()
+
+    def __getattr__(self, attr):
+        # Only called when attr is not found on the wrapper.
+        if attr == 'generic':
+            raise AttributeError(attr)
+        return getattr(self.generic, attr)
+
+    def signature(self, args):
+        """
+        Return the shapes of the tensor inputs in `args`, or None if the
+        generic version must be used.
+
+        """
+        if len(args) != len(self.inputs):
+            return None
+        sig = []
+        for inp, specialized, arg in izip(self.inputs, self.specialized,
+                                          args):
+            if not specialized:
+                sig.append(None)
+                continue
+            shape = getattr(arg, 'shape', None)
+            if shape is None or len(shape) != getattr(inp, 'variable',
+                                                      inp).ndim:
+                return None
+            sig.append(tuple(int(d) for d in shape))
+        return tuple(sig)
+
+    def specialize(self, sig):
+        """
+        Compile the version of the function specialized to `sig`.
+
+        """
+        from theano.tensor import specify_shape
+        inputs = []
+        givens = []
+        for inp, shape in izip(self.inputs, sig):
+            if shape is None:
+                inputs.append(inp)
+                continue
+            variable = getattr(inp, 'variable', inp)
+            new_variable = variable.type(name=variable.name)
+            givens.append((variable, specify_shape(new_variable, shape)))
+            if isinstance(inp, In):
+                inp = copy.copy(inp)
+                inp.variable = new_variable
+            else:
+                inp = new_variable
+            inputs.append(inp)
+        return self.build(inputs, givens)
+
+    def __call__(self, *args, **kwargs):
+        sig = None
+        if not kwargs:
+            sig = self.signature(args)
+        if sig is None:
+            return self.generic(*args, **kwargs)
+        fn = self.versions.pop(sig, None)
+        if fn is None:
+            count = self.call_counts.pop(sig, 0) + 1
+            if count < self.min_calls:
+                self.call_counts[sig] = count
+                if len(self.call_counts) > self.max_counts:
+                    self.call_counts.popitem(last=False)
+                return self.generic(*args)
+            fn = self.specialize(sig)
+        self.versions[sig] = fn
+        if len(self.versions) > self.max_versions:
+            self.versions.popitem(last=False)
+        return fn(*args)
+
+
 ###
 # FunctionMaker
 ###
@@ -1222,171 +1707,38 @@ class FunctionMaker(object):
             raise TypeError("Unknown output type: %s (%s)", type(output),
                             output)
 
-    def optimize_graph_with_cache(self, optimizer, inputs, outputs):
-        # This function is not finished
-        from theano.gof.compilelock import get_lock, release_lock
-        import os.path
-
-        graph_db_file = os.path.join(theano.config.compiledir,
-                                     'optimized_graphs.pkl')
-
-        # the inputs, outputs, and size of the graph to be optimized
-        inputs_new = [inp.variable for inp in inputs]
-        outputs_new = [out.variable for out in outputs]
-        size_new = len(self.fgraph.apply_nodes)
-        get_lock()
-        # Beginning of cache optimizations.
-        # Could be refactored in different functions.
-
-        def load_graph_db():
-            if os.path.isfile(graph_db_file):
-                print('graph_db already exists')
-            else:
-                # create graph_db
-                with open(graph_db_file, 'wb') as f:
-                    print('create new graph_db in %s' % graph_db_file)
-            # load the graph_db dictionary
+    def optimize_graph_with_cache(self, optimizer, query, inputs, fgraph):
+        """
+        Optimize `fgraph`, or fetch its optimized version from the cache of
+        optimized graphs.
+
+        Returns
+        -------
+        tuple
+            The optimized FunctionGraph, which is `fgraph` unless it was
+            found in the cache, and the profile of the optimizer (None on a
+            cache hit).
+
+        """
+        from theano.compile.graphcache import get_optimized_graph_cache
+        cache = get_optimized_graph_cache()
+        key = cache.key(fgraph, inputs, query)
+        if key is not None:
+            optimized = cache.load(key, fgraph)
+            if optimized is not None:
+                _logger.debug('Optimized graph found in the cache')
+                optimized.profile = fgraph.profile
+                return optimized, None
+        optimizer_profile = optimizer(fgraph)
+        # A graph whose optimization was cut short by the time budget would
+        # be served by every later hit, which costs no optimization time.
+        if key is not None and not getattr(fgraph, 'skipped_optimizers', []):
             try:
-                with open(graph_db_file, 'rb') as f:
-                    # Temporary hack to allow
-                    # theano.scan_module.tests.test_scan.T_Scan to
-                    # finish. Should be changed in definitive version.
-                    tmp = theano.config.unpickle_function
-                    theano.config.unpickle_function = False
-                    graph_db = pickle.load(f)
-                print('graph_db loaded and it is not empty')
-            except EOFError as e:
-                # the file has nothing in it
-                print(e)
-                print('graph_db loaded and it is empty')
-                graph_db = {}
-            finally:
-                theano.config.unpickle_function = tmp
-
-            return graph_db
-
-        def find_same_graph_in_db(graph_db):
-            # If found_graph_in_db is None, then need to optimize.
-            # Otherwise, return the graph found.
-            found_graph_in_db = None
-            # The sole purpose of this loop is to set 'need_optimize' by
-            # going through graph_db, looking for graph that has the same
-            # computation performed.
-            for graph_old, graph_optimized in iteritems(graph_db):
-                inputs_old = graph_old.inputs
-                outputs_old = graph_old.outputs
-                size_old = len(graph_old.apply_nodes)
-                # Some heuristics to check is the same graphs have
-                # already been optimized before.
-                if len(inputs_new) != len(inputs_old):
-                    # If the inputs are of different size,
-                    # two graphs are for sure different
-                    print('need to optimize, because input size is different')
-                    continue
-                elif len(outputs_new) != len(outputs_old):
-                    # If the inputs are of different size,
-                    # two graphs are for sure different
-                    print('need to optimize, because output size is different')
-                    continue
-                elif not all(input_new.type == input_old.type
-                             for input_new, input_old in
-                             zip(inputs_new, inputs_old)):
-                    print('need to optimize, because inputs are of different '
-                          'types')
-                    continue
-                elif not all(output_new.type == output_old.type
-                             for output_new, output_old in
-                             zip(outputs_new, outputs_old)):
-                    print('need to optimize, because outputs are of different '
-                          'types')
-                    continue
-                elif not size_old == size_new:
-                    print('need to optimize, because numbers of nodes in graph'
-                          ' are different')
-                    continue
-                else:
-                    flags = []
-                    for i, (output_new, output_old) in enumerate(
-                            zip(outputs_new, outputs_old)):
-                        print('loop through outputs node for both graphs')
-                        graph_old.variables = set(gof.graph.variables(
-                            graph_old.inputs, graph_old.outputs))
-
-                        # using clone allowed to avoid a lot of errors
-                        # deep copy seemed to had.
-                        f2 = graph_old.clone(check_integrity=False)
-                        t1 = output_new
-                        t2 = f2.outputs[i]
-
-                        # Used to remove "already used by another graph error
-                        def removeAllFgraph(remove):
-                            if hasattr(remove, 'fgraph'):
-                                del remove.fgraph
-                            if hasattr(remove, 'owner'):
-                                if remove.owner is None:
-                                    pass
-                                else:
-                                    if hasattr(remove.owner, 'fgraph'):
-                                        del remove.owner.fgraph
-                                    if hasattr(remove.owner, 'inputs'):
-                                        remove.owner.inputs = [removeAllFgraph(
-                                            i) for i in remove.owner.inputs]
-                                        for o in remove.owner.outputs:
-                                            if hasattr(o, 'fgraph'):
-                                                del o.fgraph
-                            return remove
-
-                        t2 = removeAllFgraph(t2)
-
-                        givens = dict(izip(gof.graph.inputs([t1]),
-                                           gof.graph.inputs([t2])))
-
-                        temp = dict(izip(gof.graph.inputs([t1]),
-                                         gof.graph.inputs([t2])))
-
-                        # hack to remove inconstent entry in givens
-                        # seems to work that but source of inconsistency
-                        # could be worth investigating.
-                        for key, value in iteritems(temp):
-                            if key.type != value.type:
-                                del givens[key]
-
-                        flag = is_same_graph(t1, t2, givens=givens)
-
-                        flags.append(flag)
-
-                    is_same = all(flags)
-                    if is_same:
-                        # found the match
-                        print('found a match, no need to optimize')
-                        found_graph_in_db = graph_optimized
-                        break
-            return found_graph_in_db
-
-        graph_db = load_graph_db()
-        print('loaded graph_db from %s, size=%d' % (graph_db_file,
-                                                    len(graph_db)))
-        found_graph = find_same_graph_in_db(graph_db)
-        if found_graph:
-            self.fgraph = found_graph
-            optimizer_profile = None
-        else:
-            # this is a brand new graph, optimize it, save it to graph_db
-            print('graph not found in graph_db, optimizing the graph')
-            self.fgraph.variables = set(gof.graph.variables(
-                self.fgraph.inputs, self.fgraph.outputs))
-            # check_integrity parameters was added to ignore
-            # "excess cached variables" errors. Works that way
-            # but once again the error couldbe worth
-            # investigating.
-            before_opt = self.fgraph.clone(check_integrity=False)
-            optimizer_profile = optimizer(self.fgraph)
-            graph_db.update({before_opt: self.fgraph})
-            with open(graph_db_file, 'wb') as f:
-                pickle.dump(graph_db, f, -1)
-            print('new graph saved into graph_db')
-        release_lock()
-        return optimizer_profile
+                cache.store(key, fgraph, fgraph)
+            except (IOError, OSError):
+                _logger.warning('Could not save the optimized graph in %s',
+                                cache.dirname, exc_info=True)
+        return fgraph, optimizer_profile
 
     def __init__(self, inputs, outputs,
                  mode=None, accept_inplace=False, function_builder=Function,
@@ -1472,8 +1824,10 @@ class FunctionMaker(object):
 
                 # now optimize the graph
                 if theano.config.cache_optimizations:
-                    optimizer_profile = self.optimize_graph_with_cache(
-                        optimizer, inputs, outputs)
+                    fgraph, optimizer_profile = self.optimize_graph_with_cache(
+                        optimizer, getattr(mode, '_optimizer', None),
+                        inputs, fgraph)
+                    self.fgraph = fgraph
                 else:
                     optimizer_profile = optimizer(fgraph)
 
@@ -1497,6 +1851,9 @@ class FunctionMaker(object):
                             hasattr(optimizer, 'pre_profile')):
                         optimizer_profile = optimizer.pre_profile
                     profile.optimizer_time += opt_time
+                    profile.optimizer_skipped = (
+                        list(profile.optimizer_skipped) +
+                        getattr(fgraph, 'skipped_optimizers', []))
                     if theano.config.profile_optimizer:
                         profile.optimizer_profile = (optimizer,
                                                      optimizer_profile)
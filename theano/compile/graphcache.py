@@ -0,0 +1,318 @@
+"""
+On-disk cache of optimized graphs.
+
+When the Theano flag `cache_optimizations` is True, `FunctionMaker` looks up
+the graph it is about to optimize in this cache and, on a hit, uses the
+stored optimized graph instead of running the optimizer.
+
+Entries are keyed by the fingerprint of the graph (see
+`FunctionGraph.fingerprint`), the optimizer query, the registered
+optimizations and the Theano config. Each entry is a separate file, in a
+subdirectory named after the first characters of its key, under
+`<compiledir>/optimized_graphs`.
+Entries are written to a temporary file and renamed, so that processes can
+share the cache without taking the compilation lock. Entries not used for
+`optimization_cache.age_thresh_use` seconds are deleted, as well as the least
+recently used ones when the cache grows above `optimization_cache.max_size`.
+
+"""
+from __future__ import absolute_import, print_function, division
+
+import logging
+import os
+import tempfile
+import time
+
+import six.moves.cPickle as pickle
+from six import BytesIO
+
+import theano
+from theano import config, gof
+from theano.gof.utils import hash_from_code
+
+_logger = logging.getLogger('theano.compile.graphcache')
+
+
+def _optdb_signature(db):
+    """
+    Return the names of the optimizations registered in `db`, recursively.
+
+    """
+    names = []
+    for name in sorted(db._names):
+        names.append(name)
+        for obj in db.__db__[name]:
+            if isinstance(obj, gof.optdb.DB):
+                names.append(_optdb_signature(obj))
+    return names
+
+
+class OptimizedGraphCache(object):
+    """
+    Cache of optimized FunctionGraphs stored in a directory.
+
+    Parameters
+    ----------
+    dirname
+        Directory where the entries are stored. It is created if needed.
+
+    Attributes
+    ----------
+    hits
+        Number of lookups that returned a graph.
+    misses
+        Number of lookups that did not.
+    stores
+        Number of graphs added to the cache.
+    evictions
+        Number of entries deleted by `cleanup`.
+
+    """
+
+    # Run cleanup() after that many stores.
+    cleanup_every = 100
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def key(self, fgraph, input_specs, query):
+        """
+        Return the key of `fgraph` optimized by `query`, or None if the
+        result of the optimization can't be cached.
+
+        Parameters
+        ----------
+        fgraph
+            The FunctionGraph before optimization.
+        input_specs
+            The SymbolicInput of the function, in the order of
+            `fgraph.inputs`.
+        query
+            The `gof.Query` used to get the optimizer from optdb. Only graphs
+            optimized by a query can be cached, as an arbitrary optimizer has
+            no identity that is stable across processes.
+
+        """
+        if (not isinstance(query, gof.Query) or
+                query.extra_optimizations):
+            return None
+        try:
+            graph_hash = gof.graph.graph_fingerprint(fgraph.inputs,
+                                                     fgraph.outputs,
+                                                     strict=True)
+        except Exception:
+            # E.g. an Op without __props__ whose state can't be pickled, as
+            # it would have the same hash as other Ops of its class.
+            _logger.debug('Could not hash the graph', exc_info=True)
+            return None
+        conf = '\n'.join(
+            '%s = %s' % (cv.fullname, cv.__get__(True, None))
+            for cv in sorted(theano.configparser._config_var_list,
+                             key=lambda cv: cv.fullname))
+        updates = getattr(fgraph, 'update_mapping', None) or {}
+        return hash_from_code('\n'.join([
+            graph_hash,
+            str([bool(getattr(spec, 'mutable', False))
+                 for spec in input_specs]),
+            str(sorted(updates.items())),
+            str(hasattr(fgraph, 'destroyers')),
+            str(query),
+            str(_optdb_signature(theano.compile.mode.optdb)),
+            theano.__version__,
+            conf]))
+
+    def _path(self, key):
+        return os.path.join(self.dirname, key[:2], key + '.pkl')
+
+    def _persistent_ids(self, fgraph):
+        # The containers of the shared variables hold their values. They
+        # are replaced by references to the containers of the fgraph that
+        # looks up the entry.
+        return dict((id(inp.container), 'container%d' % i)
+                    for i, inp in enumerate(fgraph.inputs)
+                    if hasattr(inp, 'container'))
+
+    def load(self, key, fgraph):
+        """
+        Return the optimized graph stored under `key`, or None.
+
+        Parameters
+        ----------
+        key
+            A key returned by `self.key`.
+        fgraph
+            The FunctionGraph before optimization. The returned graph uses
+            the containers of its shared variables.
+
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                unpickler = pickle.Unpickler(f)
+                containers = dict(
+                    ('container%d' % i, inp.container)
+                    for i, inp in enumerate(fgraph.inputs)
+                    if hasattr(inp, 'container'))
+                unpickler.persistent_load = containers.__getitem__
+                unpickle_function = config.unpickle_function
+                try:
+                    config.unpickle_function = False
+                    optimized = unpickler.load()
+                finally:
+                    config.unpickle_function = unpickle_function
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        except Exception:
+            # An entry written by an older version, or an Op that can't be
+            # unpickled any more.
+            _logger.info('Deleting unreadable optimized graph %s', path,
+                         exc_info=True)
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        if (len(optimized.inputs) != len(fgraph.inputs) or
+                len(optimized.outputs) != len(fgraph.outputs) or
+                any(a.type != b.type for a, b in zip(optimized.inputs,
+                                                     fgraph.inputs)) or
+                any(a.type != b.type for a, b in zip(optimized.outputs,
+                                                     fgraph.outputs))):
+            _logger.warning('Optimized graph %s does not match the graph '
+                            'it was looked up for, ignoring it.', path)
+            self.misses += 1
+            return None
+        try:
+            # Record the use for the eviction.
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return optimized
+
+    def store(self, key, fgraph, optimized):
+        """
+        Add `optimized`, the optimized version of `fgraph`, under `key`.
+
+        """
+        ids = self._persistent_ids(fgraph)
+        buf = BytesIO()
+        pickler = pickle.Pickler(buf, protocol=-1)
+        pickler.persistent_id = lambda obj: ids.get(id(obj))
+        profile = optimized.profile
+        try:
+            optimized.profile = None
+            pickler.dump(optimized)
+        except Exception:
+            _logger.debug('Could not pickle the optimized graph',
+                          exc_info=True)
+            return
+        finally:
+            optimized.profile = profile
+
+        path = self._path(key)
+        dirname = os.path.dirname(path)
+        try:
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+        except OSError:
+            # Another process may have created it.
+            if not os.path.isdir(dirname):
+                raise
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(buf.getvalue())
+            if os.name == 'nt' and os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp_path, path)
+        except OSError:
+            self._remove(tmp_path)
+            raise
+        self.stores += 1
+        if self.stores % self.cleanup_every == 1:
+            self.cleanup()
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            # Already removed by another process.
+            return False
+
+    def cleanup(self, age_thresh_use=None, max_size=None):
+        """
+        Delete old entries, then the least recently used ones until the
+        cache is smaller than `max_size` bytes.
+
+        Parameters
+        ----------
+        age_thresh_use
+            Entries not used for that many seconds are deleted. Defaults to
+            the Theano flag optimization_cache.age_thresh_use.
+        max_size
+            Maximum total size of the entries, in bytes. Defaults to the
+            Theano flag optimization_cache.max_size (in MB).
+
+        """
+        if age_thresh_use is None:
+            age_thresh_use = config.optimization_cache.age_thresh_use
+        if max_size is None:
+            max_size = config.optimization_cache.max_size * 2 ** 20
+        now = time.time()
+        entries = []
+        if not os.path.isdir(self.dirname):
+            return
+        for subdir in os.listdir(self.dirname):
+            subdir = os.path.join(self.dirname, subdir)
+            if not os.path.isdir(subdir):
+                continue
+            for name in os.listdir(subdir):
+                path = os.path.join(subdir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if name.endswith('.tmp'):
+                    # Left over by a process that died while writing it.
+                    if now - st.st_mtime > 3600:
+                        self._remove(path)
+                    continue
+                if now - st.st_mtime > age_thresh_use:
+                    self.evictions += self._remove(path)
+                else:
+                    entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= max_size:
+                break
+            self.evictions += self._remove(path)
+            total -= size
+
+    def clear(self):
+        """
+        Delete all the entries.
+
+        """
+        self.cleanup(age_thresh_use=-1)
+
+
+_optimized_graph_cache = None
+
+
+def get_optimized_graph_cache():
+    """
+    Return the cache of optimized graphs of the current compiledir.
+
+    """
+    global _optimized_graph_cache
+    dirname = os.path.join(config.compiledir, 'optimized_graphs')
+    if (_optimized_graph_cache is None or
+            _optimized_graph_cache.dirname != dirname):
+        _optimized_graph_cache = OptimizedGraphCache(dirname)
+    return _optimized_graph_cache
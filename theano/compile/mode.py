@@ -346,6 +346,26 @@ class Mode(object):
                                               self.provided_optimizer)
         return self.clone(optimizer=opt.requiring(*tags))
 
+    def with_time_budget(self, time_budget):
+        """Limits the time spent optimizing the graph of each function.
+
+        Parameters
+        ----------
+        time_budget : float
+            Wall-clock time in seconds. When it is exhausted, the optional
+            optimizations are skipped and the EquilibriumOptimizers stop
+            iterating. The skipped optimizations are recorded in the
+            `optimizer_skipped` attribute of the ProfileStats.
+
+        Returns
+        -------
+        Mode
+            Copy of the current Mode with this time budget.
+        """
+        link, opt = self.get_linker_optimizer(self.provided_linker,
+                                              self.provided_optimizer)
+        return self.clone(optimizer=opt.with_time_budget(time_budget))
+
     def clone(self, link_kwargs=None, optimizer="", **kwargs):
         """
         Create a new instance of this Mode.
@@ -473,7 +473,11 @@ def pfunc(params, outputs=None, mode=None, updates=None, givens=None,
         # list but since the value of shared variables never needs to
         # be refed, it is not needed
         if sv in update_d:
-            si = In(variable=sv, value=sv.container, mutable=True,
+            # A read-only value (e.g. a memory-mapped file) must not be
+            # overwritten in place, the update replaces it instead.
+            flags = getattr(sv.container.storage[0], 'flags', None)
+            si = In(variable=sv, value=sv.container,
+                    mutable=getattr(flags, 'writeable', True),
                     borrow=True, update=update_d[sv], shared=True)
         else:
             si = In(variable=sv, value=sv.container,
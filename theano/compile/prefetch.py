@@ -0,0 +1,159 @@
+"""
+Feed shared variables from a background producer.
+
+"""
+from __future__ import absolute_import, print_function, division
+
+import threading
+import time
+
+import numpy as np
+from six.moves import queue, xrange
+
+__docformat__ = "restructuredtext en"
+
+
+class _Done(object):
+    """
+    Put in the ready queue by the producer when the source is exhausted.
+
+    """
+    def __init__(self, error=None):
+        self.error = error
+
+
+class SharedPrefetcher(object):
+    """
+    Fill the values of shared variables in the background, one batch ahead.
+
+    A producer thread takes the values from `source` and copies them in a
+    ring of host buffers, while the functions using the shared variables
+    run. `next` then swaps the next ready buffers in the shared variables
+    with `set_value(borrow=True)`, so that nothing is copied between two
+    calls of the functions (except to transfer them to the GPU). The ring
+    has `depth + 1` buffers per variable: `depth` that can be filled in
+    advance, and the one currently in the variables.
+
+    Parameters
+    ----------
+    variables : list of SharedVariable
+        The tensor shared variables to feed.
+    source : iterable
+        Gives the successive values of the variables, as a tuple with one
+        array per variable (or one array if there is only one variable).
+        It is iterated in the producer thread.
+    depth : int
+        Number of values prepared in advance.
+    profile : ProfileStats, optional
+        Where to count the swaps, the time spent waiting for the producer,
+        the stalls (swaps that had to wait) and the number of ready
+        buffers at each swap. Typically the `profile` of the function
+        using the variables.
+
+    Examples
+    --------
+    >>> feeder = SharedPrefetcher([x, y], batches, depth=2,
+    ...                           profile=train.profile)  # doctest: +SKIP
+    >>> while feeder.next():  # doctest: +SKIP
+    ...     train()
+
+    """
+
+    def __init__(self, variables, source, depth=2, profile=None):
+        if depth < 1:
+            raise ValueError("depth must be at least 1, got %s." % depth)
+        self.variables = list(variables)
+        self.dtypes = [v.type.dtype for v in self.variables]
+        self.depth = depth
+        self.profile = profile
+        self.buffers = [[None] * len(self.variables)
+                        for i in xrange(depth + 1)]
+        self.free = queue.Queue()
+        for i in xrange(depth + 1):
+            self.free.put(i)
+        self.ready = queue.Queue()
+        self.current = None
+        self.finished = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._produce, args=(source,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _fill(self, index, values):
+        if len(self.variables) == 1 and not isinstance(values, (tuple, list)):
+            values = [values]
+        if len(values) != len(self.variables):
+            raise ValueError("The source must give %d values at a time, got"
+                             " %d." % (len(self.variables), len(values)))
+        bufs = self.buffers[index]
+        for j, (value, dtype) in enumerate(zip(values, self.dtypes)):
+            value = np.asarray(value)
+            if (bufs[j] is None or bufs[j].shape != value.shape):
+                bufs[j] = np.empty(value.shape, dtype=dtype)
+            bufs[j][...] = value
+
+    def _produce(self, source):
+        try:
+            for values in source:
+                # Wait for a free buffer, unless we are closed.
+                while True:
+                    if self.stopped.is_set():
+                        return
+                    try:
+                        index = self.free.get(timeout=0.1)
+                        break
+                    except queue.Empty:
+                        pass
+                self._fill(index, values)
+                self.ready.put(index)
+            self.ready.put(_Done())
+        except Exception as e:
+            self.ready.put(_Done(e))
+
+    def next(self):
+        """
+        Put the next values in the shared variables.
+
+        Returns
+        -------
+        bool
+            False when the source is exhausted, the variables then keep
+            their last values.
+
+        """
+        if self.finished:
+            return False
+        depth = self.ready.qsize()
+        t0 = time.time()
+        index = self.ready.get()
+        wait = time.time() - t0
+        if self.profile is not None:
+            self.profile.prefetch_swaps += 1
+            self.profile.prefetch_wait_time += wait
+            self.profile.prefetch_queue_depth += depth
+            if depth == 0:
+                self.profile.prefetch_stalls += 1
+        if isinstance(index, _Done):
+            self.finished = True
+            if index.error is not None:
+                raise index.error
+            return False
+        for var, buf in zip(self.variables, self.buffers[index]):
+            var.set_value(buf, borrow=True)
+        if self.current is not None:
+            self.free.put(self.current)
+        self.current = index
+        return True
+
+    def __iter__(self):
+        while self.next():
+            yield self
+
+    def close(self):
+        """
+        Stop the producer. The variables keep their current values.
+
+        """
+        self.finished = True
+        self.stopped.set()
+        self.thread.join()
@@ -83,7 +83,9 @@ def _atexit_print_fn():
                 for attr in ["compile_time", "fct_call_time", "fct_callcount",
                              "vm_call_time", "optimizer_time", "linker_time",
                              "validate_time", "import_time",
-                             "linker_node_make_thunks"]:
+                             "linker_node_make_thunks", "prefetch_swaps",
+                             "prefetch_wait_time", "prefetch_stalls",
+                             "prefetch_queue_depth"]:
                     setattr(cum, attr, getattr(cum, attr) + getattr(ps, attr))
 
                 # merge dictonary
@@ -96,6 +98,9 @@ def _atexit_print_fn():
                         assert key not in cum_attr, (key, cum_attr)
                         cum_attr[key] = val
 
+                cum.optimizer_skipped = (list(cum.optimizer_skipped) +
+                                         list(ps.optimizer_skipped))
+
                 if cum.optimizer_profile and ps.optimizer_profile:
                     try:
                         merge = cum.optimizer_profile[0].merge_profile(
@@ -125,6 +130,7 @@ def print_global_stats():
       -- Time spent in compiling Theano functions
            -- on graph optimization
            -- on linker
+      -- Hits and misses of the optimized graph cache, if it is used
     """
 
     if config.profiling.destination == 'stderr':
@@ -145,6 +151,13 @@ def print_global_stats():
            total_graph_opt_time,
            total_time_linker),
           file=destination_file)
+    if config.cache_optimizations:
+        from theano.compile.graphcache import get_optimized_graph_cache
+        cache = get_optimized_graph_cache()
+        print('Optimized graph cache: %d hits, %d misses, %d stored, '
+              '%d evicted' % (cache.hits, cache.misses, cache.stores,
+                              cache.evictions),
+              file=destination_file)
     print('=' * 50, file=destination_file)
 
 
@@ -262,6 +275,26 @@ class ProfileStats(object):
     optimizer_profile = None
     # None or tuple (the optimizer, the profile it returned)
 
+    optimizer_skipped = ()
+    # Names of the optimizations skipped because the optimizer time budget
+    # was exhausted (see Mode.with_time_budget)
+
+    prefetch_swaps = 0
+    # Number of values swapped in shared variables by a SharedPrefetcher
+    #
+
+    prefetch_wait_time = 0.0
+    # Total time spent waiting for the SharedPrefetcher producer
+    #
+
+    prefetch_stalls = 0
+    # Number of swaps that found no value ready
+    #
+
+    prefetch_queue_depth = 0
+    # Sum over the swaps of the number of values ready
+    #
+
     # param is called flag_time_thunks because most other attributes with time
     # in the name are times *of* something, rather than configuration flags.
     def __init__(self, atexit_print=True, flag_time_thunks=None,
@@ -739,10 +772,20 @@ class ProfileStats(object):
                 print('  Time in thunks: %es (%.3f%%)' %
                       (local_time, 100 * local_time / self.fct_call_time),
                       file=file)
+        if self.prefetch_swaps:
+            print('  Prefetched inputs: %i swaps, %es waiting, %i stalls, '
+                  '%.2f values ready on average' % (
+                      self.prefetch_swaps, self.prefetch_wait_time,
+                      self.prefetch_stalls,
+                      self.prefetch_queue_depth / float(self.prefetch_swaps)),
+                  file=file)
         print('  Total compile time: %es' % self.compile_time, file=file)
         print('    Number of Apply nodes: %d' % self.nb_nodes, file=file)
         print('    Theano Optimizer time: %es' % self.optimizer_time,
               file=file)
+        if self.optimizer_skipped:
+            print('       Skipped by the time budget: %s' %
+                  ', '.join(self.optimizer_skipped), file=file)
         print('       Theano validate time: %es' % self.validate_time,
               file=file)
         print('    Theano Linker time (includes C, CUDA code '
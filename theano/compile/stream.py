@@ -0,0 +1,357 @@
+"""
+Evaluate a compiled function over chunks of arrays too large for memory.
+
+"""
+from __future__ import absolute_import, print_function, division
+
+import threading
+
+import numpy as np
+from six.moves import queue, xrange
+
+from theano import gof
+from theano.compile.ops import (DeepCopyOp, Rebroadcast, Shape_i,
+                                SpecifyShape, ViewOp)
+
+__docformat__ = "restructuredtext en"
+
+
+def _chunk_axes(node, axes):
+    """
+    Return the chunked axis of each output of `node`, given the chunked axis
+    of each of its inputs, or raise ValueError if the node mixes the values
+    of different positions along the chunked axis.
+
+    An axis is None for a value that does not depend on the chunk, and
+    'len' for a scalar equal to the length of the chunk.
+
+    """
+    from theano.tensor import basic as tensor, blas
+    from theano.tensor.elemwise import CAReduce, DimShuffle, Elemwise
+    from theano.tensor.nnet import nnet
+
+    op = node.op
+    n_out = len(node.outputs)
+    if all(a is None for a in axes):
+        return [None] * n_out
+
+    def fail():
+        raise ValueError("Can not chunk along this axis: %s mixes values of"
+                         " different positions along it." % node)
+
+    if isinstance(op, (DeepCopyOp, ViewOp, Rebroadcast, SpecifyShape)):
+        if any(a is not None for a in axes[1:]):
+            fail()
+        return [axes[0]] * n_out
+    if isinstance(op, Shape_i):
+        return ['len' if op.i == axes[0] else None]
+    if isinstance(op, (tensor.Alloc, tensor.AllocEmpty)):
+        shape = axes[1:] if isinstance(op, tensor.Alloc) else axes
+        if isinstance(op, tensor.Alloc) and axes[0] is not None:
+            fail()
+        if shape.count('len') != 1 or any(a not in (None, 'len')
+                                          for a in shape):
+            fail()
+        return [shape.index('len') + node.outputs[0].ndim - len(shape)]
+    if 'len' in axes:
+        fail()
+    if isinstance(op, Elemwise):
+        chunked = set(a for a in axes if a is not None)
+        if len(chunked) != 1:
+            fail()
+        axis = chunked.pop()
+        for inp, a in zip(node.inputs, axes):
+            if a is None and not inp.type.broadcastable[axis]:
+                fail()
+        return [axis] * n_out
+    if isinstance(op, DimShuffle):
+        if axes[0] not in op.new_order:
+            fail()
+        return [op.new_order.index(axes[0])]
+    if isinstance(op, CAReduce):
+        reduced = op.axis
+        if reduced is None or axes[0] in reduced:
+            fail()
+        return [axes[0] - len([r for r in reduced if r < axes[0]])]
+    # Ops computing the rows of their output from the rows of one input.
+    row_input = None
+    if isinstance(op, (blas.Dot22, blas.Dot22Scalar, tensor.Dot)):
+        if node.inputs[0].ndim == 2:
+            row_input = [0]
+    elif isinstance(op, blas.Gemm):
+        row_input = [0, 2]
+    elif isinstance(op, blas.Gemv):
+        row_input = [0, 2]
+    elif isinstance(op, (nnet.Softmax, nnet.SoftmaxWithBias,
+                         nnet.LogSoftmax)):
+        row_input = [0]
+    if row_input is not None:
+        if all(axes[i] == 0 for i in row_input) and all(
+                a is None for i, a in enumerate(axes) if i not in row_input):
+            return [0] * n_out
+    fail()
+
+
+def check_chunkable(fgraph, in_axes, out_axes):
+    """
+    Check that computing `fgraph` chunk by chunk is the same as computing it
+    at once.
+
+    Parameters
+    ----------
+    fgraph : FunctionGraph
+        The graph of the function.
+    in_axes : list of int or None
+        The axis of each input of `fgraph` that is chunked, or None.
+    out_axes : list of int or None
+        The axis of each checked output of `fgraph` along which the chunks
+        are concatenated, or None for outputs that do not depend on the
+        chunks.
+
+    Raises
+    ------
+    ValueError
+        If a node of the graph mixes the values of different positions along
+        the chunked axis, or if the axis of an output is not the declared
+        one.
+
+    """
+    outputs = fgraph.outputs[:len(out_axes)]
+    pattern = gof.graph.io_connection_pattern(fgraph.inputs, outputs)
+    for i, axis in enumerate(out_axes):
+        if axis is None and any(pattern[j][i] for j, a in enumerate(in_axes)
+                                if a is not None):
+            raise ValueError("Output %d depends on a chunked input, it needs "
+                             "an axis." % i)
+
+    axes = dict(zip(fgraph.inputs, in_axes))
+    for node in fgraph.toposort():
+        in_node = [axes.get(inp) for inp in node.inputs]
+        axes.update(zip(node.outputs, _chunk_axes(node, in_node)))
+    for i, (out, axis) in enumerate(zip(outputs, out_axes)):
+        if axes.get(out) != axis:
+            raise ValueError("Output %d is chunked along axis %s, not %s." %
+                             (i, axes.get(out), axis))
+
+
+def _take(value, axis, start, stop):
+    return value[(slice(None),) * axis + (slice(start, stop),)]
+
+
+def stream_function(fn, inputs, chunk_size=None, in_axes=0, out_axes=0,
+                    outputs=None, prefetch=2, check=True):
+    """
+    Evaluate a compiled function over chunks of its inputs.
+
+    The inputs are cut in chunks along their axis, the function is called
+    on each chunk and the chunks of its outputs are written in `outputs`.
+    A background thread reads the next chunks of the inputs (copying the
+    chunks of `numpy.memmap` inputs in memory) and another one writes the
+    chunks of the outputs that the function does not write directly, while
+    the function runs.
+
+    Parameters
+    ----------
+    fn : Function
+        The compiled function. It must only have positional inputs.
+    inputs : list
+        One value per input of `fn`. Arrays (e.g. `numpy.memmap`) are cut
+        along their axis in chunks of `chunk_size`. Iterables give the
+        successive chunks of an input, all of them at the same pace, and
+        then set the length of the chunks. Inputs whose axis is None are
+        given as is to each call.
+    chunk_size : int
+        Length of the chunks of the array inputs, when no input is an
+        iterable.
+    in_axes : int, None or list of them
+        Axis along which each input is chunked.
+    out_axes : int, None or list of them
+        Axis along which the chunks of each output are concatenated. An
+        output with an axis of None must not depend on the chunks, its
+        value of the last call is returned.
+    outputs : list of arrays, optional
+        Where to write each output, e.g. a `numpy.memmap` opened in 'w+'
+        mode. Outputs with an axis of None are ignored. If not given, they
+        are allocated in memory.
+    prefetch : int
+        Number of chunks read in advance.
+    check : bool
+        Check that chunking the graph along those axes is valid, see
+        `check_chunkable`. It only knows the usual elementwise, reduction
+        and row-wise Ops, set it to False to skip the check.
+
+    Returns
+    -------
+    list of arrays
+        The outputs, or the only output if `fn` has one.
+
+    """
+    if fn.output_keys is not None or fn.return_none:
+        raise TypeError("stream_function needs a function returning a list "
+                        "of outputs.")
+    # The shared variables are implicit inputs, given as is to each call.
+    explicit = [not i.implicit for i in fn.maker.inputs]
+    n_in = sum(explicit)
+    n_out = fn.n_returned_outputs
+    if len(inputs) != n_in:
+        raise TypeError("Expected %d inputs, got %d." % (n_in, len(inputs)))
+    if not isinstance(in_axes, (list, tuple)):
+        in_axes = [in_axes] * n_in
+    if not isinstance(out_axes, (list, tuple)):
+        out_axes = [out_axes] * n_out
+    in_axes = list(in_axes)
+    out_axes = list(out_axes)
+
+    iterables = [axis is not None and not hasattr(value, 'shape')
+                 for value, axis in zip(inputs, in_axes)]
+    if any(iterables):
+        iterators = [iter(value) if it else None
+                     for value, it in zip(inputs, iterables)]
+        length = None
+    else:
+        lengths = set(value.shape[axis]
+                      for value, axis in zip(inputs, in_axes)
+                      if axis is not None)
+        if len(lengths) != 1:
+            raise ValueError("The chunked inputs must have one length along "
+                             "their axis, got %s." % sorted(lengths))
+        length = lengths.pop()
+        if chunk_size is None:
+            raise TypeError("chunk_size is needed when no input is an "
+                            "iterable.")
+
+    if check:
+        fgraph = fn.maker.fgraph
+        axes = iter(in_axes)
+        fgraph_axes = [next(axes) if e else None for e in explicit]
+        fgraph_axes += [None] * (len(fgraph.inputs) - len(fgraph_axes))
+        check_chunkable(fgraph, fgraph_axes, out_axes)
+
+    def read_chunks():
+        # Yields (start, stop, args) for each chunk.
+        start = 0
+        while length is None or start < length:
+            if length is None:
+                try:
+                    chunks = [next(it) if it is not None else None
+                              for it in iterators]
+                except StopIteration:
+                    return
+                stop = start + [np.shape(c)[a] for c, a in zip(chunks, in_axes)
+                                if c is not None][0]
+            else:
+                stop = min(start + chunk_size, length)
+                chunks = [None] * n_in
+            args = []
+            for value, axis, chunk in zip(inputs, in_axes, chunks):
+                if axis is None:
+                    args.append(value)
+                elif chunk is not None:
+                    args.append(chunk)
+                else:
+                    chunk = _take(value, axis, start, stop)
+                    if isinstance(chunk, np.memmap):
+                        # Read it from disk now, in this thread.
+                        chunk = np.array(chunk)
+                    args.append(chunk)
+            yield start, stop, args
+            start = stop
+
+    def run_thread(target, q):
+        # Run target, then put None (or the error) on q.
+        def run():
+            try:
+                target()
+                q.put(None)
+            except Exception as e:
+                q.put(e)
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    read_q = queue.Queue(maxsize=max(prefetch, 1))
+
+    def reader():
+        for item in read_chunks():
+            read_q.put(item)
+
+    write_q = queue.Queue(maxsize=max(prefetch, 1))
+
+    def writer():
+        error = None
+        while True:
+            item = write_q.get()
+            if item is None:
+                break
+            if error is None:
+                # Keep emptying the queue after an error, so that the main
+                # thread never blocks on it.
+                try:
+                    target, axis, start, stop, value = item
+                    _take(target, axis, start, stop)[...] = value
+                except Exception as e:
+                    error = e
+        if error is not None:
+            raise error
+
+    results = list(outputs) if outputs is not None else [None] * n_out
+    pieces = [[] for i in xrange(n_out)]
+    last = [None] * n_out
+    run_thread(reader, read_q)
+    write_done = queue.Queue()
+    run_thread(writer, write_done)
+    try:
+        while True:
+            item = read_q.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            start, stop, args = item
+            # Write directly in the contiguous chunks of the outputs.
+            out = []
+            for i, axis in enumerate(out_axes):
+                view = None
+                if axis is not None and results[i] is not None:
+                    view = _take(results[i], axis, start, stop)
+                    if not (view.flags.c_contiguous and
+                            view.flags.writeable and view.flags.aligned and
+                            view.dtype == fn.maker.fgraph.outputs[i].dtype):
+                        view = None
+                out.append(view)
+            if any(v is not None for v in out):
+                values = fn(*args, out=out)
+            else:
+                values = fn(*args)
+            if n_out == 1 and fn.unpack_single:
+                values = [values]
+            for i, (axis, value) in enumerate(zip(out_axes, values)):
+                last[i] = value
+                if axis is None or value is out[i]:
+                    continue
+                if results[i] is None and length is not None:
+                    shape = list(value.shape)
+                    shape[axis] = length
+                    results[i] = np.empty(shape, dtype=value.dtype)
+                if fn.maker.outputs[i].borrow:
+                    # The next call may overwrite it.
+                    value = value.copy()
+                if results[i] is None:
+                    pieces[i].append(value)
+                else:
+                    write_q.put((results[i], axis, start, stop, value))
+    finally:
+        write_q.put(None)
+    error = write_done.get()
+    if error is not None:
+        raise error
+
+    for i, axis in enumerate(out_axes):
+        if axis is None:
+            results[i] = last[i]
+        elif results[i] is None:
+            results[i] = np.concatenate(pieces[i], axis=axis)
+    if n_out == 1 and fn.unpack_single:
+        return results[0]
+    return results
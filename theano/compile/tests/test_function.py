@@ -30,6 +30,40 @@ def test_function_dump():
     assert np.allclose(fct1(x), fct2(x))
 
 
+def test_specialize_shapes():
+    x = theano.tensor.matrix('x')
+    y = theano.tensor.scalar('y')
+    s = theano.shared(np.asarray(0., dtype=theano.config.floatX))
+    out = x * x.shape[0] + x.shape[1] * y
+    f = theano.function([x, In(y, value=1.)], out,
+                        updates=[(s, s + 1)], specialize_shapes=2)
+    f_ref = theano.function([x, y], out)
+
+    def check(shape):
+        val = np.random.rand(*shape).astype(theano.config.floatX)
+        assert np.allclose(f(val, 2.), f_ref(val, 2.))
+
+    check((2, 3))
+    assert not f.versions
+    check((2, 3))
+    assert list(f.versions) == [((2, 3), None)]
+    # The shapes are constant in the specialized version.
+    topo = f.versions[((2, 3), None)].maker.fgraph.toposort()
+    assert not any(isinstance(node.op, (theano.tensor.Shape,
+                                        theano.compile.ops.Shape_i))
+                   for node in topo)
+    for shape in [(4, 5), (4, 5), (2, 3), (1, 1), (1, 1)]:
+        check(shape)
+    # The least recently used version was dropped.
+    assert list(f.versions) == [((2, 3), None), ((1, 1), None)]
+    # Keyword arguments and defaults use the generic version.
+    val = np.ones((2, 3), dtype=theano.config.floatX)
+    assert np.allclose(f(val), f_ref(val, 1.))
+    assert np.allclose(f(val, y=3.), f_ref(val, 3.))
+    # All the versions share the updates.
+    assert s.get_value() == 9
+
+
 class TestFunctionIn(unittest.TestCase):
 
     def test_in_strict(self):
@@ -591,6 +591,95 @@ class T_function(unittest.TestCase):
         except TypeError:
             assert(func(first=1) == x)
 
+    def test_fast_call(self):
+        x = T.dvector('x')
+        m = T.dmatrix('m')
+        s = theano.shared(np.zeros(3), 'acc')
+        f = function([x, m], [x + m.sum(), s],
+                     updates=[(s, s + x)])
+        xv = np.arange(3.)
+        mv = np.ones((2, 3))
+        r = f.fast_call(xv, mv)
+        assert isinstance(r, list) and len(r) == 2
+        assert np.allclose(r[0], xv + 6)
+        assert np.allclose(r[1], 0)
+        assert np.allclose(s.get_value(), xv)
+        # Same results as __call__
+        r2 = f(xv, mv)
+        assert np.allclose(r2[0], r[0])
+        assert np.allclose(r2[1], xv)
+
+        # Other arguments are filtered as in __call__.
+        assert np.allclose(f.fast_call([1., 2., 3.], mv)[0], [7., 8., 9.])
+        fx = T.fvector('fx')
+        self.assertRaises(TypeError, function([fx], fx * 2).fast_call, xv)
+        self.assertRaises(TypeError, f.fast_call, xv)
+
+        # Broadcastable dimensions are checked.
+        r = T.row('r', dtype='float64')
+        g = function([r], r * 2)
+        self.assertRaises(TypeError, g.fast_call, np.ones((2, 3)))
+        assert np.allclose(g.fast_call(np.ones((1, 3))), 2)
+
+        # Functions with default values use __call__.
+        a, b = T.dscalars('a', 'b')
+        h = function([a, theano.In(b, value=1)], a + b)
+        assert h.fast_call(1) == 2
+
+    def test_map(self):
+        x = T.dvector('x')
+        y = T.dscalar('y')
+        f = function([x, y], x * y)
+        args = [(np.arange(3.), i) for i in range(5)]
+        expected = [np.arange(3.) * i for i in range(5)]
+        results = f.map(args)
+        assert not isinstance(results, list)
+        for r, e in zip(results, expected):
+            assert np.allclose(r, e)
+        for r, e in zip(f.map(iter(args), processes=2), expected):
+            assert np.allclose(r, e)
+
+        s = theano.shared(0.)
+        g = function([y], y, updates=[(s, s + y)])
+        assert [float(r) for r in g.map([(1.,), (2.,)])] == [1., 2.]
+        assert s.get_value() == 3.
+        self.assertRaises(ValueError, g.map, [(1.,)], processes=2)
+
+    def test_out(self):
+        x = T.dmatrix('x')
+        f = function([x], [T.exp(x), x])
+        val = np.random.rand(2, 3)
+        buf1, buf2 = np.empty((2, 3)), np.empty((2, 3))
+        r1, r2 = f(val, out=[buf1, buf2])
+        assert r1 is buf1 and r2 is buf2
+        assert np.allclose(buf1, np.exp(val))
+        assert np.allclose(buf2, val)
+        # The buffers are not reused by the next calls.
+        r1, r2 = f(val * 2)
+        assert r1 is not buf1 and np.allclose(buf1, np.exp(val))
+        # None keeps the usual behavior for that output.
+        r1, r2 = f(val, out=[None, buf2])
+        assert r1 is not buf1 and r2 is buf2
+
+        self.assertRaises(ValueError, f, val, out=[buf1])
+        self.assertRaises(TypeError, f, val,
+                          out=[np.empty((2, 3), dtype='float32'), None])
+        bad = np.zeros((3, 2))
+        self.assertRaises(ValueError, f, val, out=[bad, None])
+        # The buffer was not resized.
+        assert bad.shape == (3, 2) and not bad.any()
+        self.assertRaises(ValueError, f, val, out=[np.empty((4, 3)), None])
+        self.assertRaises(ValueError, f, val, out=[val, None])
+        self.assertRaises(ValueError, f, val,
+                          out=[np.empty((3, 2)).T, None])
+
+        g = function([x], {'e': T.exp(x)})
+        assert g(val, out={'e': buf1})['e'] is buf1
+        # An input named out is still an input.
+        out = T.dmatrix('out')
+        h = function([out], out + 1)
+        assert np.allclose(h(out=val), val + 1)
+
 
 class T_picklefunction(unittest.TestCase):
 
@@ -0,0 +1,41 @@
+from __future__ import absolute_import, print_function, division
+
+import numpy as np
+from nose.tools import assert_raises
+
+import theano
+from theano.compile.prefetch import SharedPrefetcher
+from theano.compile.profiling import ProfileStats
+
+
+def test_shared_prefetcher():
+    floatX = theano.config.floatX
+    x = theano.shared(np.zeros((2, 3), dtype=floatX))
+    y = theano.shared(np.zeros(2, dtype=floatX))
+    profile = ProfileStats(atexit_print=False)
+    f = theano.function([], x.sum(axis=1) + y, profile=profile)
+
+    batches = [(np.full((2, 3), i), np.full(2, i)) for i in range(5)]
+    feeder = SharedPrefetcher([x, y], iter(batches), depth=2,
+                              profile=profile)
+    results = [f() for _ in feeder]
+    assert len(results) == 5
+    for i, r in enumerate(results):
+        assert np.allclose(r, 4 * i)
+    assert not feeder.next()
+    # The variables keep their last values.
+    assert np.allclose(x.get_value(), 4)
+    assert profile.prefetch_swaps == 6
+    assert 0 <= profile.prefetch_stalls <= 6
+    assert profile.prefetch_queue_depth <= 2 * 6
+
+    # At most depth + 1 buffers are used.
+    assert len(set(id(b[0]) for b in feeder.buffers)) <= 3
+
+    def failing():
+        yield np.zeros((2, 3))
+        raise KeyError('source')
+    feeder = SharedPrefetcher([x], failing())
+    assert feeder.next()
+    assert_raises(KeyError, feeder.next)
+    feeder.close()
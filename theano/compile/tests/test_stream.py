@@ -0,0 +1,67 @@
+from __future__ import absolute_import, print_function, division
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from nose.tools import assert_raises
+
+import theano
+from theano import tensor as T
+from theano.compile.stream import stream_function
+
+
+def test_stream_function():
+    x = T.matrix()
+    w = T.matrix()
+    b = T.vector()
+    y = T.nnet.softmax(T.dot(x, w) + b)
+    s = T.exp(x).sum(axis=1)
+    f = theano.function([x, w, b], [y, s])
+
+    rng = np.random.RandomState(0)
+    xv = rng.rand(23, 4).astype(theano.config.floatX)
+    wv = rng.rand(4, 3).astype(theano.config.floatX)
+    bv = rng.rand(3).astype(theano.config.floatX)
+    expected = f(xv, wv, bv)
+
+    yv, sv = stream_function(f, [xv, wv, bv], chunk_size=5,
+                             in_axes=[0, None, None])
+    assert np.allclose(yv, expected[0])
+    assert np.allclose(sv, expected[1])
+
+    # Chunks given by a generator.
+    chunks = (xv[i:i + 7] for i in range(0, 23, 7))
+    yv, sv = stream_function(f, [chunks, wv, bv], in_axes=[0, None, None])
+    assert np.allclose(yv, expected[0])
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(tmpdir, 'x.npy')
+        np.save(fname, xv)
+        xm = np.load(fname, mmap_mode='r')
+        ym = np.lib.format.open_memmap(os.path.join(tmpdir, 'y.npy'),
+                                       mode='w+', dtype=yv.dtype,
+                                       shape=yv.shape)
+        yv, sv = stream_function(f, [xm, wv, bv], chunk_size=4,
+                                 in_axes=[0, None, None], outputs=[ym, None])
+        assert yv is ym
+        assert np.allclose(ym, expected[0])
+        del xm, ym, yv
+    finally:
+        shutil.rmtree(tmpdir)
+
+    # Reducing along the chunked axis is refused.
+    g = theano.function([x], x.sum(axis=0))
+    assert_raises(ValueError, stream_function, g, [xv], chunk_size=5)
+    g = theano.function([x, w], T.dot(x, w))
+    assert_raises(ValueError, stream_function, g, [xv.T, wv.T],
+                  chunk_size=5, in_axes=[1, None], out_axes=1)
+
+    # The shared variables are not given.
+    ws = theano.shared(wv)
+    g = theano.function([x], T.dot(x, ws))
+    assert np.allclose(stream_function(g, [xv], chunk_size=5),
+                       np.dot(xv, wv))
+    g = theano.function([x], T.dot(x, ws).sum(axis=0))
+    assert_raises(ValueError, stream_function, g, [xv], chunk_size=5)
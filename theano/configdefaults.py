@@ -901,11 +901,21 @@ AddConfigVar('openmp',
 AddConfigVar('openmp_elemwise_minsize',
              "If OpenMP is enabled, this is the minimum size of vectors "
              "for which the openmp parallelization is enabled "
-             "in element wise ops.",
+             "in element wise ops and reductions.",
              IntParam(200000),
              in_c_key=False,
              )
 
+AddConfigVar('openmp_autotune',
+             "If OpenMP is enabled, time the OpenMP ops the first times they "
+             "run on inputs of a new size class with different numbers of "
+             "threads, and then use the fastest one. The choices are kept in "
+             "the compiledir. The elemwise ops then ignore "
+             "openmp_elemwise_minsize.",
+             BoolParam(False),
+             in_c_key=False,
+             )
+
 AddConfigVar(
     'check_input',
     "Specify if types should check their input in their C code. "
@@ -917,14 +927,27 @@ AddConfigVar(
 
 AddConfigVar(
     'cache_optimizations',
-    "WARNING: work in progress, does not work yet. "
-    "Specify if the optimization cache should be used. This cache will "
-    "any optimized graph and its optimization. Actually slow downs a lot "
-    "the first optimization, and could possibly still contains some bugs. "
-    "Use at your own risks.",
+    "Specify if the optimized graphs should be cached on disk. When a "
+    "function is compiled from a graph that was already optimized with the "
+    "same mode and config, the optimized graph is loaded instead of "
+    "running the optimizer again.",
     BoolParam(False),
     in_c_key=False)
 
+AddConfigVar(
+    'optimization_cache.age_thresh_use',
+    "In seconds. The time after which an unused optimized graph is "
+    "deleted from the cache.",
+    IntParam(60 * 60 * 24 * 24, lambda i: i >= 0),  # 24 days
+    in_c_key=False)
+
+AddConfigVar(
+    'optimization_cache.max_size',
+    "In MB. When the optimized graph cache grows above this size, the "
+    "least recently used graphs are deleted.",
+    IntParam(1024, lambda i: i >= 0),
+    in_c_key=False)
+
 
 def good_seed_param(seed):
     if seed == "random":
@@ -1109,6 +1132,22 @@ AddConfigVar('optdb.max_use_ratio',
              FloatParam(8),
              in_c_key=False)
 
+AddConfigVar('optdb.time_budget',
+             'Wall-clock time in seconds allowed for the optimization of a '
+             'function. When it is exhausted, the optional optimizations '
+             '(like elemwise fusion and gemm) are skipped and the '
+             'EquilibriumOptimizers stop iterating. 0 means no limit.',
+             FloatParam(0, lambda v: v >= 0),
+             in_c_key=False)
+
+AddConfigVar('optdb.worklist',
+             'If True, after its first iteration, EquilibriumOptimizer only '
+             'applies its local optimizers to the nodes changed by the '
+             'previous iteration and their neighbours, instead of to the '
+             'whole graph.',
+             BoolParam(False),
+             in_c_key=False)
+
 AddConfigVar('gcc.cxxflags',
              "Extra compiler flags for gcc",
              StrParam(""),
@@ -1132,6 +1171,21 @@ AddConfigVar('cmodule.remove_gxx_opt',
              # This can be done by handing this in compile_args()
              in_c_key=True)
 
+AddConfigVar('cmodule.compile_jobs',
+             "Maximum number of C modules compiled at the same time when a"
+             " function is linked. With 1, modules are compiled one after"
+             " the other when their thunk is made.",
+             IntParam(1, lambda i: i > 0),
+             in_c_key=False)
+
+AddConfigVar('vm.memory_planner',
+             "Useful only for the vm linkers when allow_gc is False. If True,"
+             " the intermediate results are placed in one preallocated arena"
+             " per signature of the input shapes, computed after the first"
+             " call with that signature.",
+             BoolParam(False),
+             in_c_key=False)
+
 AddConfigVar('cmodule.compilation_warning',
              "If True, will print compilation warnings.",
              BoolParam(False),
@@ -1434,6 +1488,14 @@ AddConfigVar('vm.lazy',
              ConfigParam('None', filter_vm_lazy),
              in_c_key=False)
 
+AddConfigVar('vm.n_threads',
+             "Number of threads used by the vm linkers to execute independent"
+             " nodes concurrently. With 1, nodes are executed one after the"
+             " other. Values larger than 1 select the ParallelLoop VM when"
+             " the graph does not need lazy evaluation or callbacks.",
+             IntParam(1, lambda i: i > 0),
+             in_c_key=False)
+
 AddConfigVar(
     'warn.identify_1pexp_bug',
     'Warn if Theano versions prior to 7987b51 (2011-12-18) could have '
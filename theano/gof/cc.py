@@ -17,7 +17,8 @@ import theano
 from theano import config
 from theano.compat import PY3
 from theano.compat import izip
-from six import string_types, reraise
+from six import (get_method_function, get_unbound_function, string_types,
+                 reraise)
 from six.moves import StringIO, xrange
 
 # gof imports
@@ -1517,6 +1518,34 @@ class CLinker(link.Linker):
             release_lock()
         return module
 
+    def build_cmodule(self, location):
+        """
+        Compile the source code for this linker in `location`, without
+        importing the module.
+
+        Unlike `compile_cmodule`, this does not take the compilation lock,
+        so that several modules can be built at the same time. The caller
+        must make sure that `location` is not cleaned up in the meantime
+        (see `ModuleCache.modules_from_keys`).
+
+        """
+        mod = self.get_dynamic_module()
+        try:
+            self.c_compiler().compile_str(
+                module_name=mod.code_hash,
+                src_code=mod.code(),
+                location=location,
+                include_dirs=self.header_dirs(),
+                lib_dirs=self.lib_dirs(),
+                libs=self.libraries(),
+                preargs=self.compile_args(),
+                py_module=False)
+        except Exception as e:
+            e.args += (str(self.fgraph),)
+            raise
+        # compile_str only creates this file when it imports the module.
+        open(os.path.join(location, "__init__.py"), 'w').close()
+
     def get_dynamic_module(self):
         """
         Return a cmodule.DynamicModule instance full of the code for our fgraph.
@@ -1655,6 +1684,73 @@ class CLinker(link.Linker):
         return code.getvalue()
 
 
+def precompile_cmodules(nodes, storage_map, compute_map, no_recycling,
+                        n_jobs=None):
+    """
+    Compile concurrently the C modules that `Op.make_c_thunk` will load for
+    `nodes`.
+
+    The thunks made afterwards find their module in the cache. Nodes whose
+    Op has no C implementation or does not make its thunk through
+    `Op.make_c_thunk`, and modules that can't be cached, are skipped.
+
+    Parameters
+    ----------
+    nodes
+        The Apply nodes the thunks will be made for.
+    storage_map
+        dict variable -> one-element-list, as given to make_thunk.
+    compute_map
+        dict variable -> one-element-list, as given to make_thunk.
+    no_recycling
+        The no_recycling variables given to make_thunk. They are part of
+        the module keys.
+    n_jobs
+        Maximum number of compilations running at the same time. If None,
+        use the Theano flag cmodule.compile_jobs. Nothing is done with 1.
+
+    """
+    if n_jobs is None:
+        n_jobs = config.cmodule.compile_jobs
+    if n_jobs <= 1 or not config.cxx:
+        return
+    from theano.gof.fg import FunctionGraph
+    from theano.gof.op import Op
+    make_thunk = get_unbound_function(Op.make_thunk)
+
+    keys_and_linkers = []
+    for node in nodes:
+        op = node.op
+        if (not isinstance(op, Op) or
+                get_method_function(op.make_thunk) is not make_thunk):
+            continue
+        if not getattr(op, '_f16_ok', False) and any(
+                getattr(v.type, 'dtype', '') == 'float16'
+                for v in node.inputs + node.outputs):
+            continue
+        # Build the linker exactly like Op.make_c_thunk, so that the keys
+        # are the same.
+        fgraph = FunctionGraph(node.inputs, node.outputs)
+        fgraph_no_recycling = [new_o for (new_o, old_o)
+                               in zip(fgraph.outputs, node.outputs)
+                               if old_o in no_recycling]
+        lnk = CLinker().accept(fgraph, no_recycling=fgraph_no_recycling)
+        try:
+            op.prepare_node(node, storage_map=storage_map,
+                            compute_map=compute_map, impl='c')
+            key = lnk.cmodule_key()
+            if key is None or not key[0]:
+                continue
+            for cnode in lnk.node_order:
+                cnode.op.prepare_node(cnode, None, None, 'c')
+            lnk.get_src_code()
+        except (NotImplementedError, utils.MethodNotDefined, KeyError):
+            continue
+        keys_and_linkers.append((key, lnk))
+
+    get_module_cache().modules_from_keys(keys_and_linkers, n_jobs)
+
+
 class _CThunk(object):
     """
     A thunk with a C implementation.
@@ -1808,6 +1904,8 @@ class OpWiseCLinker(link.LocalLinker):
             for k in storage_map:
                 compute_map[k] = [k.owner is None]
 
+            precompile_cmodules(order, storage_map, compute_map,
+                                no_recycling)
             thunks = []
             for node in order:
                 # make_thunk will try by default C code, otherwise
@@ -15,6 +15,7 @@ import stat
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 import platform
 import distutils.sysconfig
@@ -23,9 +24,9 @@ import warnings
 import numpy.distutils
 
 import theano
-from theano.compat import PY3, decode, decode_iter
-from six import b, BytesIO, StringIO, string_types, iteritems
-from six.moves import xrange
+from theano.compat import OrderedDict, PY3, decode, decode_iter
+from six import b, BytesIO, StringIO, string_types, iteritems, itervalues
+from six.moves import queue, xrange
 from theano.gof.utils import flatten
 from theano.configparser import config
 from theano.gof.utils import hash_from_code
@@ -1101,7 +1102,7 @@ class ModuleCache(object):
         self._update_mappings(key, key_data, module.__file__, not key_broken)
         return key_data
 
-    def module_from_key(self, key, lnk=None, keep_lock=False):
+    def module_from_key(self, key, lnk=None, keep_lock=False, location=None):
         """
         Return a module from the cache, compiling it if necessary.
 
@@ -1117,18 +1118,25 @@ class ModuleCache(object):
             the second performs the actual compilation.
         keep_lock : bool
             If True, the compilation lock will not be released if taken.
+        location
+            A cache directory where the module was already compiled, but not
+            imported, by `lnk.build_cmodule(location)`. The module is imported
+            from there instead of being compiled. The directory is deleted if
+            the cache already contains the module.
 
         """
         # Is the module in the cache?
         module = self._get_from_key(key)
+        if module is None:
+            src_code = lnk.get_src_code()
+            # Is the source code already in the cache?
+            module_hash = get_module_hash(src_code, key)
+            module = self._get_from_hash(module_hash, key,
+                                         keep_lock=keep_lock)
         if module is not None:
-            return module
-
-        src_code = lnk.get_src_code()
-        # Is the source code already in the cache?
-        module_hash = get_module_hash(src_code, key)
-        module = self._get_from_hash(module_hash, key, keep_lock=keep_lock)
-        if module is not None:
+            if location is not None:
+                _rmtree(location, ignore_if_missing=True,
+                        msg='module already in cache')
             return module
 
         with compilelock.lock_ctx(keep_lock=keep_lock):
@@ -1149,19 +1157,23 @@ class ModuleCache(object):
             self.refresh(cleanup=False)
 
             module = self._get_from_key(key)
+            if module is None:
+                module = self._get_from_hash(module_hash, key)
             if module is not None:
-                return module
-
-            module = self._get_from_hash(module_hash, key)
-            if module is not None:
+                if location is not None:
+                    _rmtree(location, ignore_if_missing=True,
+                            msg='module already in cache')
                 return module
 
             hash_key = hash(key)
 
             nocleanup = False
             try:
-                location = dlimport_workdir(self.dirname)
-                module = lnk.compile_cmodule(location)
+                if location is None:
+                    location = dlimport_workdir(self.dirname)
+                    module = lnk.compile_cmodule(location)
+                else:
+                    module = dlimport(module_name_from_dir(location))
                 name = module.__file__
                 assert name.startswith(location)
                 assert name not in self.module_from_name
@@ -1189,6 +1201,85 @@ class ModuleCache(object):
         self.stats[2] += 1
         return module
 
+    def modules_from_keys(self, keys_and_linkers, n_jobs):
+        """
+        Make sure the cache holds the modules of several keys, compiling the
+        missing ones concurrently.
+
+        Parameters
+        ----------
+        keys_and_linkers
+            List of (key, lnk) pairs as given to `module_from_key`. Besides
+            `get_src_code()`, `lnk` must define `build_cmodule(location)`,
+            which compiles the module in `location` without importing it.
+        n_jobs
+            Maximum number of compilations running at the same time.
+
+        Notes
+        -----
+        The compilations run in separate compiler processes, driven by a
+        pool of threads. The compilation lock is only held while the work
+        directories are created and while each module is registered with
+        `module_from_key`, so other processes can use the cache between two
+        registrations.
+
+        Modules that fail to compile are left out. They are compiled again,
+        and the error reported, when their thunk is made.
+
+        """
+        to_build = OrderedDict()
+        for key, lnk in keys_and_linkers:
+            if self._get_from_key(key) is not None:
+                continue
+            module_hash = get_module_hash(lnk.get_src_code(), key)
+            if (module_hash in self.module_hash_to_key_data or
+                    module_hash in to_build):
+                continue
+            to_build[module_hash] = (key, lnk)
+        if not to_build:
+            return
+
+        builds = []
+        with compilelock.lock_ctx():
+            for key, lnk in itervalues(to_build):
+                location = dlimport_workdir(self.dirname)
+                # refresh() deletes empty directories, so we must not
+                # leave this one empty once we release the lock.
+                open(os.path.join(location, 'mod.cpp'), 'w').close()
+                builds.append((location, key, lnk))
+
+        tasks = queue.Queue()
+        for build in builds:
+            tasks.put(build)
+        failed = set()
+
+        def worker():
+            while True:
+                try:
+                    location, key, lnk = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    lnk.build_cmodule(location)
+                except Exception:
+                    _logger.debug("Failed to compile the module in %s",
+                                  location, exc_info=True)
+                    failed.add(location)
+
+        threads = [threading.Thread(target=worker)
+                   for i in xrange(min(n_jobs, len(builds)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for location, key, lnk in builds:
+            if location in failed:
+                _rmtree(location, ignore_if_missing=True,
+                        msg='exception during compilation')
+            else:
+                self.module_from_key(key, lnk, location=location)
+
     def check_key(self, key, key_pkl):
         """
         Perform checks to detect broken __eq__ / __hash__ implementations.
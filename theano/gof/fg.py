@@ -736,6 +736,34 @@ class FunctionGraph(utils.object2):
                     raise Exception("Inconsistent clients list.",
                                     variable, node.inputs[i])
 
+    def fingerprint(self, r=None):
+        """
+        Return the structural fingerprint of the graph.
+
+        The fingerprint only depends on the Ops, the types, the constants and
+        the positions of the inputs, not on the names of the variables. It is
+        the same in all processes, so it can be used as the key of a cache.
+        It is equal to `graph.graph_fingerprint(self.inputs, self.outputs)`.
+
+        The first call attaches a `toolbox.Fingerprinter`, which updates the
+        fingerprint when the graph changes, so that later calls only hash the
+        nodes that changed.
+
+        Parameters
+        ----------
+        r : Variable or Apply, optional
+            If provided, return the fingerprint of this Variable or Apply
+            node of the graph instead.
+
+        """
+        for feature in self._features:
+            if isinstance(feature, toolbox.Fingerprinter):
+                break
+        else:
+            feature = toolbox.Fingerprinter()
+            self.attach_feature(feature)
+        return feature.fingerprint(self, r)
+
     def __str__(self):
         return "[%s]" % ", ".join(graph.as_string(self.inputs, self.outputs))
 
@@ -802,6 +830,8 @@ class FunctionGraph(utils.object2):
 
     def __setstate__(self, dct):
         self.__dict__.update(dct)
+        self.execute_callbacks_times = dict(
+            (feature, 0) for feature in self._features)
         for feature in self._features:
             if hasattr(feature, "unpickle"):
                 feature.unpickle(self)
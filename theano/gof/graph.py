@@ -3,14 +3,17 @@ Node classes (`Apply`, `Variable`) and expression graph algorithms.
 """
 from __future__ import absolute_import, print_function, division
 
-from collections import deque
+from collections import deque, Mapping
 from copy import copy
 from itertools import count
+import marshal
+import types
 
 import theano
 from theano import config
 from theano.gof import utils
 from six import string_types, integer_types, iteritems
+import six.moves.cPickle as pickle
 from theano.misc.ordered_set import OrderedSet
 
 __docformat__ = "restructuredtext en"
@@ -1135,6 +1138,240 @@ def io_connection_pattern(inputs, outputs):
     return global_connection_pattern
 
 
+def stable_hash(obj, memo=None, strict=False):
+    """
+    Return a hash of `obj` that is the same in all processes.
+
+    Objects with `__props__`, like most Ops and Types, are hashed from their
+    class and the hashes of their props. Other Theano objects are hashed from
+    their class and their whole state, functions from their name, code,
+    default values and closure, and anything else from its pickle.
+
+    Parameters
+    ----------
+    obj
+        An Op, a Type, a numpy array or another picklable object.
+    memo : dict, optional
+        If provided, the hashes of hashable objects are cached in it.
+    strict : bool
+        If True, raise ValueError when a part of `obj` can't be hashed and
+        is only identified by its class, so that the hash may be the same
+        for objects that are not equal.
+
+    """
+    if memo is not None and not strict:
+        try:
+            return memo[obj]
+        except KeyError:
+            pass
+        except TypeError:
+            # obj is not hashable
+            memo = None
+    unstable = []
+    h = _stable_hash(obj, set(), unstable)
+    if strict and unstable:
+        raise ValueError("%s has no stable hash, as %s can't be hashed" %
+                         (obj, unstable[0]))
+    if memo is not None and not strict:
+        memo[obj] = h
+    return h
+
+
+def _stable_hash(obj, seen, unstable):
+    cls = type(obj)
+    if isinstance(obj, Variable):
+        # Variables outside of an inner graph are identified by their type.
+        return leaf_fingerprint(obj)
+    elif id(obj) in seen:
+        # A reference to an object whose state is being hashed.
+        parts = ['<cycle>']
+    elif isinstance(obj, (list, tuple)):
+        parts = [cls.__name__] + [_stable_hash(o, seen, unstable)
+                                  for o in obj]
+    elif isinstance(obj, Mapping):
+        parts = [cls.__name__] + sorted(
+            '%s:%s' % (_stable_hash(k, seen, unstable),
+                       _stable_hash(v, seen, unstable))
+            for k, v in iteritems(obj))
+    elif isinstance(obj, types.FunctionType):
+        # Pickling a function only saves its name, so two versions of a
+        # function would have the same hash.
+        seen.add(id(obj))
+        code = obj.__code__
+        parts = ['%s.%s' % (obj.__module__,
+                            getattr(obj, '__qualname__', obj.__name__)),
+                 utils.hash_from_code(marshal.dumps(code)),
+                 _stable_hash(obj.__defaults__, seen, unstable),
+                 _stable_hash([c.cell_contents
+                               for c in (obj.__closure__ or ())],
+                              seen, unstable)]
+        seen.remove(id(obj))
+    elif isinstance(obj, types.MethodType):
+        parts = ['method', _stable_hash(obj.__func__, seen, unstable),
+                 _stable_hash(obj.__self__, seen, unstable)]
+    elif (cls.__module__.startswith('theano.') and
+            hasattr(obj, '__dict__')):
+        seen.add(id(obj))
+        props = getattr(obj, '__props__', None)
+        parts = ['%s.%s' % (cls.__module__, cls.__name__)]
+        if isinstance(props, tuple):
+            state = [(p, getattr(obj, p)) for p in props]
+        else:
+            if hasattr(obj, '__getstate__'):
+                state = obj.__getstate__()
+            else:
+                state = obj.__dict__
+            if state is None:
+                state = {}
+            if isinstance(state, Mapping):
+                # The whole state, with the private and name-mangled
+                # attributes, e.g. the function of a FromFunctionOp.
+                state = dict(state)
+                if (isinstance(state.get('inputs'), (list, tuple)) and
+                        isinstance(state.get('outputs'), (list, tuple))):
+                    # The inner graph of an Op like Scan or OpFromGraph.
+                    inner = (state.pop('inputs'), state.pop('outputs'))
+                    try:
+                        parts.append(graph_fingerprint(*inner, strict=True))
+                    except ValueError as e:
+                        unstable.append(e)
+                        parts.append(graph_fingerprint(*inner))
+                state = sorted(iteritems(state))
+            else:
+                state = [('', v) for v in state]
+        parts += ['%s=%s' % (k, _stable_hash(v, seen, unstable))
+                  for k, v in state]
+        seen.remove(id(obj))
+    else:
+        try:
+            return utils.hash_from_code(pickle.dumps(obj, protocol=2))
+        except Exception:
+            # E.g. an object that can't be pickled.
+            unstable.append(obj)
+            parts = ['%s.%s' % (cls.__module__, cls.__name__)]
+    return utils.hash_from_code(' '.join(parts))
+
+
+def leaf_fingerprint(r, position=None, memo=None):
+    """
+    Return the structural fingerprint of a Variable without owner.
+
+    Parameters
+    ----------
+    r
+        A Variable without owner.
+    position : int, optional
+        The position of `r` in the inputs of the graph. Constants are
+        identified by their type and data, and other variables that are not
+        inputs by their type only.
+    memo : dict, optional
+        Cache of the hashes of the types, see `stable_hash`.
+
+    """
+    type_hash = stable_hash(r.type, memo)
+    if position is not None:
+        return utils.hash_from_code('input %d %s' % (position, type_hash))
+    if isinstance(r, Constant):
+        return utils.hash_from_code('constant %s %s' % (
+            type_hash, stable_hash(r.data)))
+    return utils.hash_from_code('orphan %s' % type_hash)
+
+
+def apply_fingerprint(node, fingerprints, memo=None, strict=False):
+    """
+    Return the structural fingerprint of Apply `node`.
+
+    It only depends on the Op and on the fingerprints of the inputs, so two
+    nodes that compute the same thing from the same graph inputs get the
+    same fingerprint, whatever the names of their variables.
+
+    Parameters
+    ----------
+    node
+        An Apply node.
+    fingerprints : dict
+        Map from Variables to their fingerprint. It must contain the inputs
+        of `node` that are not Constants. The fingerprints of the Constant
+        inputs, of `node` and of its outputs are added to it.
+    memo : dict, optional
+        Cache of the hashes of the Ops and types, see `stable_hash`.
+    strict : bool
+        Raise ValueError if the Op has no stable hash, see `stable_hash`.
+
+    """
+    in_fps = []
+    for r in node.inputs:
+        fp = fingerprints.get(r)
+        if fp is None:
+            fp = fingerprints[r] = leaf_fingerprint(r, memo=memo)
+        in_fps.append(fp)
+    h = utils.hash_from_code('%s(%s)' % (stable_hash(node.op, memo, strict),
+                                         ','.join(in_fps)))
+    fingerprints[node] = h
+    for i, out in enumerate(node.outputs):
+        fingerprints[out] = utils.hash_from_code('%s[%d]' % (h, i))
+    return h
+
+
+def fingerprint_int(fp):
+    """
+    Return fingerprint `fp` as an integer in [0, 2 ** 128).
+
+    Graph fingerprints use the sum of those integers over the Apply nodes,
+    which can be updated when a node is added or removed.
+
+    """
+    return int(fp[-32:], 16)
+
+
+def combine_fingerprints(input_fingerprints, output_fingerprints, apply_sum):
+    """
+    Return the fingerprint of a graph.
+
+    Parameters
+    ----------
+    input_fingerprints
+        The fingerprints of the inputs of the graph, in order.
+    output_fingerprints
+        The fingerprints of the outputs of the graph, in order.
+    apply_sum
+        The sum of the `fingerprint_int` of all the Apply nodes of the graph,
+        modulo 2 ** 128. Two graphs that compute the same outputs but share
+        different subgraphs get different fingerprints.
+
+    """
+    return utils.hash_from_code('%s|%s|%032x' % (
+        ','.join(input_fingerprints), ','.join(output_fingerprints),
+        apply_sum))
+
+
+def graph_fingerprint(inputs, outputs, memo=None, strict=False):
+    """
+    Return the structural fingerprint of the graph between `inputs` and
+    `outputs`.
+
+    The fingerprint does not depend on the names of the variables and is the
+    same in all processes, so it can be used as the key of a cache. It is
+    equal to `FunctionGraph.fingerprint`, which updates it incrementally.
+    With `strict`, ValueError is raised if an Op of the graph has no stable
+    hash, see `stable_hash`.
+
+    """
+    fingerprints = dict((r, leaf_fingerprint(r, i, memo))
+                        for i, r in enumerate(inputs))
+    apply_sum = 0
+    for node in io_toposort(inputs, outputs):
+        apply_sum += fingerprint_int(apply_fingerprint(node, fingerprints,
+                                                       memo, strict))
+    out_fps = []
+    for r in outputs:
+        if r not in fingerprints:
+            fingerprints[r] = leaf_fingerprint(r, memo=memo)
+        out_fps.append(fingerprints[r])
+    return combine_fingerprints([fingerprints[r] for r in inputs], out_fps,
+                                apply_sum % 2 ** 128)
+
+
 def is_same_graph(var1, var2, givens=None, debug=False):
     """
     Return True iff Variables `var1` and `var2` perform the same computation.
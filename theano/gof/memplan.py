@@ -0,0 +1,226 @@
+"""
+Static memory planning for the VMs.
+
+When a function is called many times with inputs of the same shapes, the
+sizes of its intermediate results do not change from one call to the next.
+`MemoryPlannedVM` records them the first time it sees a new signature of
+input shapes and dtypes. It then assigns to each intermediate ndarray an
+offset in one preallocated arena, such that two intermediates alive at the
+same time never overlap. Before each call, the storage of the intermediates
+is set to views of that arena. Ops that reuse their output storage when it
+has the right shape (most C implementations do) then write directly in the
+arena, so nothing is allocated in the loop and the peak memory used for the
+intermediates is the size of the arena.
+
+"""
+from __future__ import absolute_import, print_function, division
+
+from collections import OrderedDict
+
+import numpy as np
+
+__docformat__ = "restructuredtext en"
+
+# Alignment in bytes of the buffers in the arena.
+ALIGNMENT = 64
+
+
+def buffer_lifetimes(order, fgraph):
+    """
+    Compute the lifetime of the buffers that can be planned.
+
+    A buffer is owned by the output of a node that is not a view or a
+    destroyed version of one of its inputs. It stays alive until the last
+    node that uses it, or any variable aliased to it through `view_map` and
+    `destroy_map`.
+
+    Parameters
+    ----------
+    order : list of Apply
+        The execution order of the nodes.
+    fgraph : FunctionGraph
+        The graph containing those nodes.
+
+    Returns
+    -------
+    OrderedDict
+        Map each variable owning a plannable buffer to the inclusive
+        interval `(first, last)` of positions in `order` where it is alive.
+        Buffers aliased to an output of `fgraph` are not returned, as they
+        are given to the user. Neither are 0-d variables, which are handled
+        by `calculate_reallocate_info`.
+
+    """
+    root = {}
+    excluded = set()
+    lifetimes = OrderedDict()
+    for i, node in enumerate(order):
+        for inp in node.inputs:
+            r = root.get(inp, inp)
+            if r in lifetimes:
+                lifetimes[r] = (lifetimes[r][0], i)
+        view_map = getattr(node.op, 'view_map', {})
+        destroy_map = getattr(node.op, 'destroy_map', {})
+        for j, out in enumerate(node.outputs):
+            aliased = view_map.get(j, []) + destroy_map.get(j, [])
+            if aliased:
+                roots = [root.get(node.inputs[k], node.inputs[k])
+                         for k in aliased]
+                root[out] = roots[0]
+                if len(roots) > 1:
+                    # We do not track buffers reachable from many roots.
+                    excluded.update(roots)
+            elif getattr(out, 'ndim', None) not in (None, 0):
+                lifetimes[out] = (i, i)
+    for out in fgraph.outputs:
+        excluded.add(root.get(out, out))
+    for var in excluded:
+        lifetimes.pop(var, None)
+    return lifetimes
+
+
+def _align(nbytes, alignment=ALIGNMENT):
+    return (nbytes + alignment - 1) // alignment * alignment
+
+
+def assign_offsets(sizes, lifetimes, alignment=ALIGNMENT):
+    """
+    Place buffers in an arena so that live buffers never overlap.
+
+    The buffers are placed from the largest to the smallest, each at the
+    lowest aligned offset free during its whole lifetime (first fit).
+
+    Parameters
+    ----------
+    sizes : OrderedDict
+        Map each buffer to its size in bytes.
+    lifetimes : dict
+        Map each buffer to its inclusive interval `(first, last)` of
+        positions in the execution order.
+    alignment : int
+        Alignment in bytes of each offset.
+
+    Returns
+    -------
+    offsets : dict
+        Map each buffer to its offset in the arena.
+    total : int
+        The size of the arena in bytes.
+
+    """
+    placed = []
+    offsets = {}
+    total = 0
+    for var in sorted(sizes, key=lambda v: -sizes[v]):
+        size = _align(sizes[var], alignment)
+        first, last = lifetimes[var]
+        conflicts = sorted((start, end)
+                           for start, end, f, l in placed
+                           if f <= last and first <= l)
+        offset = 0
+        for start, end in conflicts:
+            if offset + size <= start:
+                break
+            offset = max(offset, end)
+        placed.append((offset, offset + size, first, last))
+        offsets[var] = offset
+        total = max(total, offset + size)
+    return offsets, total
+
+
+class MemoryPlannedVM(object):
+    """
+    Run a VM with a static memory plan per signature of its inputs.
+
+    The first call with a new signature runs the VM as is, then builds the
+    plan from the intermediate results it left in the storage map. The
+    following calls with that signature set the storage of the
+    intermediates to views of the arena of the plan before running the VM.
+    The VM must not free its intermediate results (`allow_gc=False`) and
+    must execute the nodes in `order`, one at a time.
+
+    All other attributes are the ones of the wrapped VM.
+
+    Parameters
+    ----------
+    vm : VM
+        The VM to run.
+    order : list of Apply
+        The execution order of the nodes of the VM.
+    fgraph : FunctionGraph
+        The graph computed by the VM.
+    storage_map : dict
+        The storage map of the VM.
+
+    """
+
+    # Maximum number of plans kept, the least recently built is dropped.
+    max_plans = 8
+
+    def __init__(self, vm, order, fgraph, storage_map):
+        self.vm = vm
+        self.lifetimes = buffer_lifetimes(order, fgraph)
+        self.input_storage = [storage_map[v] for v in fgraph.inputs]
+        self.planned_storage = [(v, storage_map[v]) for v in self.lifetimes]
+        self.plans = OrderedDict()
+
+    def __getattr__(self, attr):
+        # Only called when attr is not found on the wrapper.
+        if attr == 'vm':
+            raise AttributeError(attr)
+        return getattr(self.vm, attr)
+
+    def signature(self):
+        """
+        Return the shapes and dtypes of the current inputs.
+
+        """
+        return tuple((getattr(s[0], 'shape', None),
+                      getattr(s[0], 'dtype', None))
+                     for s in self.input_storage)
+
+    def make_plan(self):
+        """
+        Build the plan from the intermediate results of the last call.
+
+        Returns
+        -------
+        arena : ndarray
+            The uint8 buffer holding all the planned intermediate results.
+        views : list of (storage, ndarray) pairs
+            The view of the arena to put in each storage.
+
+        """
+        sizes = OrderedDict()
+        layouts = {}
+        for var, storage in self.planned_storage:
+            value = storage[0]
+            if type(value) is np.ndarray and value.ndim > 0 and value.size:
+                sizes[var] = value.nbytes
+                layouts[var] = (value.shape, value.dtype)
+        offsets, total = assign_offsets(sizes, self.lifetimes)
+        arena = np.empty(total + ALIGNMENT, dtype=np.uint8)
+        base = -arena.ctypes.data % ALIGNMENT
+        views = []
+        for var, storage in self.planned_storage:
+            if var in offsets:
+                shape, dtype = layouts[var]
+                start = base + offsets[var]
+                view = arena[start:start + sizes[var]].view(dtype)
+                views.append((storage, view.reshape(shape)))
+        return arena, views
+
+    def __call__(self, *args, **kwargs):
+        sig = self.signature()
+        plan = self.plans.get(sig)
+        if plan is not None:
+            for storage, view in plan[1]:
+                storage[0] = view
+            return self.vm(*args, **kwargs)
+        rval = self.vm(*args, **kwargs)
+        if not kwargs.get('output_subset'):
+            # Only a full call leaves all the intermediate results around.
+            self.plans[sig] = self.make_plan()
+            if len(self.plans) > self.max_plans:
+                self.plans.popitem(last=False)
+        return rval
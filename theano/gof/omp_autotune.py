@@ -0,0 +1,211 @@
+"""
+Autotuning of the number of threads used by the OpenMP Ops.
+
+When the Theano flag ``openmp_autotune`` is True, the C thunks of the
+`OpenMPOp` are wrapped by `autotuned_thunk`. The calls on inputs of a new
+size class (the power of 2 of the size of the largest input) of an Op
+class time the thunk with 1 thread and with more threads, one candidate
+per call, so that Ops working in place are never run twice on the same
+inputs. The fastest number of threads is then stored in a table in the
+compiledir, which the following calls (and processes) use directly.
+
+The number of threads is set with `omp_set_num_threads` from the OpenMP
+runtime the C code is linked with. If it can not be found, the thunks are
+not wrapped.
+
+"""
+from __future__ import absolute_import, print_function, division
+
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import timeit
+
+import theano
+
+_logger = logging.getLogger('theano.gof.omp_autotune')
+
+__docformat__ = "restructuredtext en"
+
+# Name of the table in the compiledir.
+TABLE_FILENAME = 'openmp_autotune.json'
+
+# Number of calls timed for each candidate number of threads.
+TRIALS = 3
+
+_omp = None
+_table = None
+# key -> {n_threads: [times]} of the size classes being tuned.
+_pending = {}
+
+
+def omp_library():
+    """
+    Return the OpenMP runtime as a ctypes library, or None.
+
+    """
+    global _omp
+    if _omp is None:
+        _omp = False
+        for name in ['gomp', 'omp', 'iomp5']:
+            path = ctypes.util.find_library(name)
+            if path is None:
+                continue
+            try:
+                lib = ctypes.CDLL(path)
+                lib.omp_get_max_threads.restype = ctypes.c_int
+                lib.omp_set_num_threads.argtypes = [ctypes.c_int]
+            except (OSError, AttributeError):
+                continue
+            _omp = lib
+            break
+        else:
+            _logger.warning("The OpenMP runtime was not found, the OpenMP "
+                            "Ops are not autotuned.")
+    return _omp or None
+
+
+def candidate_threads(max_threads):
+    """
+    Return the numbers of threads tried: 1, the powers of 2 below
+    `max_threads`, and `max_threads`.
+
+    """
+    rval = [1]
+    while rval[-1] * 2 < max_threads:
+        rval.append(rval[-1] * 2)
+    if max_threads > 1:
+        rval.append(max_threads)
+    return rval
+
+
+def table_path():
+    return os.path.join(theano.config.compiledir, TABLE_FILENAME)
+
+
+def get_table():
+    """
+    Return the table of the tuned numbers of threads, loading it from the
+    compiledir the first time.
+
+    """
+    global _table
+    if _table is None:
+        _table = {}
+        try:
+            with open(table_path()) as f:
+                _table = json.load(f)
+        except (IOError, OSError, ValueError):
+            pass
+    return _table
+
+
+def save_table():
+    """
+    Write the table in the compiledir, merged with the entries other
+    processes may have written since it was loaded.
+
+    """
+    table = get_table()
+    path = table_path()
+    try:
+        with open(path) as f:
+            on_disk = json.load(f)
+    except (IOError, OSError, ValueError):
+        on_disk = {}
+    on_disk.update(table)
+    tmp = '%s.%d' % (path, os.getpid())
+    try:
+        with open(tmp, 'w') as f:
+            json.dump(on_disk, f, indent=1, sort_keys=True)
+        os.rename(tmp, path)
+    except (IOError, OSError) as e:
+        _logger.warning("Could not save the OpenMP autotuning table: %s", e)
+
+
+def reset():
+    """
+    Forget the tuned numbers of threads, in memory and in the compiledir.
+
+    """
+    global _table
+    _table = {}
+    _pending.clear()
+    if os.path.exists(table_path()):
+        os.remove(table_path())
+
+
+def size_class(storage):
+    """
+    Return the power of 2 of the size of the largest array in `storage`.
+
+    """
+    size = max([getattr(s[0], 'size', 1) for s in storage] + [1])
+    return int(size).bit_length()
+
+
+def tuning_key(op, node, bucket):
+    """
+    Return the key of the table for the calls of `op` on inputs of the
+    size class `bucket`.
+
+    """
+    name = type(op).__name__
+    scalar_op = getattr(op, 'scalar_op', None)
+    if scalar_op is not None:
+        name += '{%s}' % type(scalar_op).__name__
+    dtypes = ','.join(getattr(i.type, 'dtype', '?') for i in node.inputs)
+    return '%s|%s|%d' % (name, dtypes, bucket)
+
+
+def autotuned_thunk(op, node, thunk):
+    """
+    Wrap the C thunk of an OpenMPOp to choose its number of threads.
+
+    The wrapper has no `cthunk` attribute, so that the CVM calls it instead
+    of the C function.
+
+    """
+    omp = omp_library()
+    if omp is None:
+        return thunk
+    max_threads = omp.omp_get_max_threads()
+    candidates = candidate_threads(max_threads)
+    timer = timeit.default_timer
+
+    def rval():
+        key = tuning_key(op, node, size_class(thunk.inputs))
+        n = get_table().get(key)
+        if n is not None:
+            if n != max_threads:
+                omp.omp_set_num_threads(n)
+            try:
+                return thunk()
+            finally:
+                if n != max_threads:
+                    omp.omp_set_num_threads(max_threads)
+
+        times = _pending.setdefault(key, dict((c, []) for c in candidates))
+        n = min(candidates, key=lambda c: len(times[c]))
+        omp.omp_set_num_threads(n)
+        try:
+            t0 = timer()
+            r = thunk()
+            times[n].append(timer() - t0)
+        finally:
+            omp.omp_set_num_threads(max_threads)
+        if all(len(t) >= TRIALS for t in times.values()):
+            best = min(candidates, key=lambda c: min(times[c]))
+            get_table()[key] = best
+            del _pending[key]
+            save_table()
+            _logger.debug("Autotuned %s: %d threads", key, best)
+        return r
+
+    rval.inputs = thunk.inputs
+    rval.outputs = thunk.outputs
+    rval.lazy = False
+    rval.thunk = thunk
+    return rval
@@ -1229,6 +1229,17 @@ int main( int argc, const char* argv[] )
         if impl == 'c':
             self.update_self_openmp()
 
+    def make_c_thunk(self, node, storage_map, compute_map, no_recycling):
+        # Not make_thunk, so that cc.precompile_cmodules still compiles the
+        # modules of OpenMPOp concurrently.
+        thunk = super(OpenMPOp, self).make_c_thunk(
+            node, storage_map, compute_map, no_recycling)
+        if (self.openmp and theano.config.openmp_autotune and
+                hasattr(thunk, 'cthunk')):
+            from theano.gof import omp_autotune
+            thunk = omp_autotune.autotuned_thunk(self, node, thunk)
+        return thunk
+
 
 def simple_meth(tag):
     def f(self):
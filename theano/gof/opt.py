@@ -171,6 +171,40 @@ def inplace_optimizer(f):
     return rval
 
 
+def budget_exhausted(fgraph, priority=0):
+    """
+    Return True if an optional optimization of priority `priority` should be
+    skipped because of the optimization time budget of `fgraph`.
+
+    An optimization of priority p is skipped once 1 / (p + 1) of the budget
+    is used: priority 0 until the budget is exhausted, priority 1 until half
+    of it is used, etc. That way, the time left goes to the most important
+    optimizations.
+
+    """
+    budget = getattr(fgraph, 'optimization_budget', None)
+    if budget is None:
+        return False
+    start, time_budget = budget
+    return time.time() - start >= time_budget / (priority + 1.)
+
+
+def skip_optimizer(fgraph, optimizer, reason=None):
+    """
+    Record in `fgraph.skipped_optimizers` that `optimizer` was (partly)
+    skipped because of the time budget.
+
+    """
+    name = (getattr(optimizer, 'name', None) or
+            getattr(optimizer, '__name__', None) or str(optimizer))
+    if reason:
+        name = '%s (%s)' % (name, reason)
+    _logger.debug('Time budget exhausted, skipping %s', name)
+    if not hasattr(fgraph, 'skipped_optimizers'):
+        fgraph.skipped_optimizers = []
+    fgraph.skipped_optimizers.append(name)
+
+
 class SeqOptimizer(Optimizer, list):
     # inherit from Optimizer first to get Optimizer.__hash__
     """
@@ -179,6 +213,9 @@ class SeqOptimizer(Optimizer, list):
     sequentially.
 
     """
+    time_budget = None
+    budget_priorities = {}
+
     @staticmethod
     def warn(exc, self, optimizer):
         """
@@ -202,12 +239,21 @@ class SeqOptimizer(Optimizer, list):
         failure_callback : callable or None
             Keyword only argument. A callback used when a failure
             happen during optimization.
+        time_budget : float or None
+            Keyword only argument. Wall-clock time in seconds allowed for
+            the optimization of a graph. See `budget_exhausted`.
+        budget_priorities : dict
+            Keyword only argument. Map from the names of the optional
+            optimizers to their priority, an int >= 0 where 0 is the most
+            important. The optimizers not in it are always applied.
 
         """
         if len(opts) == 1 and isinstance(opts[0], (list, tuple)):
             opts = opts[0]
         self[:] = opts
         self.failure_callback = kw.pop('failure_callback', None)
+        self.time_budget = kw.pop('time_budget', None)
+        self.budget_priorities = kw.pop('budget_priorities', {})
         assert len(kw) == 0
 
     def apply(self, fgraph):
@@ -233,8 +279,26 @@ class SeqOptimizer(Optimizer, list):
             self, l, -1, -1, nb_node_before,
             -1, sub_profs, sub_validate_time,
             nb_nodes, {})
+        # The budget is counted from the start of the outermost
+        # SeqOptimizer that has one.
+        own_budget = (self.time_budget and
+                      getattr(fgraph, 'optimization_budget', None) is None)
+        if own_budget:
+            fgraph.optimization_budget = (time.time(), self.time_budget)
         try:
             for optimizer in self:
+                priority = self.budget_priorities.get(
+                    getattr(optimizer, 'name', None))
+                if (priority is not None and
+                        budget_exhausted(fgraph, priority)):
+                    skip_optimizer(fgraph, optimizer)
+                    l.append(0.)
+                    sub_profs.append(None)
+                    nb_nodes.append((len(fgraph.apply_nodes),
+                                     len(fgraph.apply_nodes)))
+                    if fgraph.profile:
+                        sub_validate_time.append(fgraph.profile.validate_time)
+                    continue
                 try:
                     nb_nodes_before = len(fgraph.apply_nodes)
                     t0 = time.time()
@@ -255,6 +319,8 @@ class SeqOptimizer(Optimizer, list):
                     else:
                         raise
         finally:
+            if own_budget:
+                del fgraph.optimization_budget
 
             if fgraph.profile:
                 validate_time = fgraph.profile.validate_time - validate_before
@@ -363,7 +429,10 @@ class SeqOptimizer(Optimizer, list):
             new_t.append(prof1[1][idx1] +
                          prof2[1][idx2])
             new_l.append(l)
-            if hasattr(l, 'merge_profile'):
+            if prof1[6][idx1] is None or prof2[6][idx2] is None:
+                # Skipped because of the time budget.
+                new_sub_profile.append(prof1[6][idx1] or prof2[6][idx2])
+            elif hasattr(l, 'merge_profile'):
                 assert len(prof1[6][idx1]) == len(prof2[6][idx2])
                 new_sub_profile.append(l.merge_profile(prof1[6][idx1],
                                                        prof2[6][idx2]))
@@ -510,6 +579,11 @@ class MergeFeature(object):
     That way, the MergeOptimizer can remember the result of the last merge
     pass on the fgraph.
 
+    The distinct nodes are kept in a table indexed by their Op and inputs,
+    so that a new or modified node is compared to at most one other node.
+    Duplicates are thus scheduled for merging as soon as they appear, and
+    MergeOptimizer passes only have to apply those replacements.
+
     """
     def on_attach(self, fgraph):
         assert not hasattr(fgraph, 'merge_feature')
@@ -525,6 +599,11 @@ class MergeFeature(object):
         # For all Apply nodes
         # Set of distinct (not mergeable) nodes
         self.nodes_seen = set()
+        # node -> signature (for nodes in nodes_seen)
+        self.node_sig = {}
+        # signature -> node. The hash-consing table used to find the merge
+        # candidate of a node without scanning the clients of its inputs.
+        self.node_sig_inv = {}
         # Ordered set of distinct (not mergeable) nodes without any input
         self.noinput_nodes = OrderedSet()
 
@@ -547,11 +626,30 @@ class MergeFeature(object):
         for node in fgraph.toposort():
             self.on_import(fgraph, node, "on_attach")
 
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        # The signatures hash the Ops, which may not be unpickled yet when
+        # the table is. It is rebuilt by unpickle().
+        del d['node_sig'], d['node_sig_inv']
+        return d
+
+    def unpickle(self, fgraph):
+        self.node_sig = {}
+        self.node_sig_inv = {}
+        for node in self.nodes_seen:
+            sig = (node.op, tuple(node.inputs))
+            try:
+                self.node_sig_inv.setdefault(sig, node)
+            except TypeError:
+                continue
+            self.node_sig[node] = sig
+
     def on_change_input(self, fgraph, node, i, r, new_r, reason):
         # If inputs to node change, it is not guaranteed that it is distinct
         # from the other nodes in nodes_seen
         if node in self.nodes_seen:
             self.nodes_seen.discard(node)
+            self.forget_node(node)
             self.process_node(fgraph, node)
 
         # Since we are in on_change_input, node should have inputs.
@@ -570,6 +668,7 @@ class MergeFeature(object):
 
     def on_prune(self, fgraph, node, reason):
         self.nodes_seen.discard(node)
+        self.forget_node(node)
         if not node.inputs:
             self.noinput_nodes.discard(node)
         for c in node.inputs:
@@ -601,6 +700,15 @@ class MergeFeature(object):
             self.const_sig_inv[sig] = c
             self.seen_constants.add(id(c))
 
+    def forget_node(self, node):
+        """
+        Remove `node` from the hash-consing table.
+
+        """
+        sig = self.node_sig.pop(node, None)
+        if sig is not None and self.node_sig_inv.get(sig) is node:
+            del self.node_sig_inv[sig]
+
     def process_node(self, fgraph, node):
         """
         Check if a node can be merged, and queue that replacement.
@@ -611,10 +719,25 @@ class MergeFeature(object):
 
         node_has_assert = False
 
+        # Nodes with an equal Op and the same inputs have the same
+        # signature. The inputs are compared by identity, as in the check
+        # below.
+        sig = (node.op, tuple(node.inputs))
+        try:
+            other = self.node_sig_inv.get(sig)
+        except TypeError:
+            # The Op is not hashable, look for the candidates among the
+            # clients of the inputs.
+            sig = None
+        if sig is not None:
+            if other is not None and other is not node:
+                merge_candidates = [other]
+            else:
+                merge_candidates = []
         # These asserts ensure that the fgraph has set the clients field
         # properly.
         # The clients should at least contain `node` itself!
-        if node.inputs:
+        elif node.inputs:
             # Take the smallest clients list. Some ops like elemwise
             # have optimization that put constant as the first inputs.
             # As constant have in general more clients than other type of nodes
@@ -740,6 +863,9 @@ class MergeFeature(object):
             self.nodes_seen.add(node)
             if not node.inputs:
                 self.noinput_nodes.add(node)
+            if sig is not None:
+                self.node_sig[node] = sig
+                self.node_sig_inv.setdefault(sig, node)
 
     def get_merged_assert_input(self, node, candidate):
         new_inputs = []
@@ -1063,6 +1189,24 @@ def pre_constant_merge(vars):
 #   Local Optimizers   #
 ########################
 
+def track_keys(op):
+    """
+    Return the keys under which the optimizers that may apply to a node
+    computing `op` are indexed.
+
+    They are the class of `op`, `op` itself and, for Ops like Elemwise and
+    CAReduce that wrap a scalar Op, the pairs (class of `op`, class) for
+    the class of its scalar Op and all its bases, as the optimizers test
+    the scalar Op with isinstance. See `LocalOptimizer.tracks`.
+
+    """
+    keys = [type(op), op]
+    scalar_op = getattr(op, 'scalar_op', None)
+    if scalar_op is not None:
+        keys.extend((type(op), c) for c in type(scalar_op).__mro__)
+    return keys
+
+
 class LocalOptimizer(object):
     """
     A class for node-based optimizations.
@@ -1084,6 +1228,10 @@ class LocalOptimizer(object):
 
         Return None to apply to all nodes.
 
+        Op instances are also accepted, as well as pairs like
+        (Elemwise, scalar.Add) for the Ops of a class that wrap a scalar Op
+        of a given class. See `track_keys`.
+
         """
         return None
 
@@ -1258,7 +1406,13 @@ def local_optimizer(tracks, inplace=False, requirements=()):
             if len(tracks) is 0:
                 raise ValueError("Use None instead of an empty list to apply to all nodes.", f.__module__, f.__name__)
             for t in tracks:
-                if not (isinstance(t, op.Op) or issubclass(t, op.PureOp)):
+                if isinstance(t, tuple):
+                    # (op class, scalar op class)
+                    if not (len(t) == 2 and
+                            all(isinstance(c, type) for c in t) and
+                            issubclass(t[0], op.PureOp)):
+                        raise ValueError("Tracks are op classes or instances", f.__module__, f.__name__)
+                elif not (isinstance(t, op.Op) or issubclass(t, op.PureOp)):
                     raise ValueError("Tracks are op classes or instances", f.__module__, f.__name__)
         req = requirements
         if inplace:
@@ -1320,7 +1474,7 @@ class LocalOptGroup(LocalOptimizer):
                 self.applied_true.setdefault(o, 0)
                 self.node_created.setdefault(o, 0)
 
-            for c in o.tracks():
+            for c in (o.tracks() or [None]):
                 self.track_map[c].append(o)
 
     def __str__(self):
@@ -1329,11 +1483,12 @@ class LocalOptGroup(LocalOptimizer):
                         ','.join([str(o) for o in self.opts])))
 
     def tracks(self):
+        if self.track_map[None]:
+            # At least one optimizer applies to all nodes.
+            return None
         t = []
         for l in self.opts:
-            tt = l.tracks()
-            if tt:
-                t.extend(tt)
+            t.extend(l.tracks())
         return t
 
     def transform(self, node):
@@ -1342,7 +1497,10 @@ class LocalOptGroup(LocalOptimizer):
         fgraph = node.fgraph
         repl = None
         while True:
-            opts = self.track_map[type(node.op)] + self.track_map[node.op] + self.track_map[None]
+            opts = []
+            for key in track_keys(node.op):
+                opts.extend(self.track_map.get(key, ()))
+            opts.extend(self.track_map[None])
             new_repl = None
             for opt in opts:
                 opt_start = time.time()
@@ -2237,16 +2395,31 @@ class OpKeyOptimizer(NavigatorOptimizer):
 
 
 class ChangeTracker:
-    def __init__(self):
+    def __init__(self, track_nodes=False):
         self.changed = False
         self.nb_imported = 0
+        # If track_nodes, the nodes that were imported or whose inputs
+        # changed, as well as the owners of the replaced and new variables.
+        if track_nodes:
+            self.touched = OrderedSet()
+        else:
+            self.touched = None
 
     def on_import(self, fgraph, node, reason):
         self.nb_imported += 1
         self.changed = True
+        if self.touched is not None:
+            self.touched.add(node)
 
     def on_change_input(self, fgraph, node, i, r, new_r, reason):
         self.changed = True
+        if self.touched is not None:
+            if node != 'output':
+                self.touched.add(node)
+            # The owner of r lost a client and the one of new_r got one.
+            for var in (r, new_r):
+                if var.owner is not None:
+                    self.touched.add(var.owner)
 
     def reset(self):
         self.changed = False
@@ -2293,6 +2466,13 @@ class EquilibriumOptimizer(NavigatorOptimizer):
         They must not traverse the graph as they are called very frequently.
         The MergeOptimizer is one example of optimization that respect this.
         They are applied after all global optimizer, then when one local optimizer is applied, then after all final optimizer.
+    worklist : bool
+        If True, after the first iteration, the local optimizers are only
+        applied to the nodes that changed during the previous iteration, and
+        to their clients and the owners of their inputs. When such an
+        iteration changes nothing, the whole graph is traversed once more to
+        check that the equilibrium is reached. Defaults to the Theano flag
+        optdb.worklist.
 
     """
 
@@ -2303,7 +2483,8 @@ class EquilibriumOptimizer(NavigatorOptimizer):
                  tracks_on_change_inputs=False,
                  max_use_ratio=None,
                  final_optimizers=None,
-                 cleanup_optimizers=None):
+                 cleanup_optimizers=None,
+                 worklist=None):
         super(EquilibriumOptimizer, self).__init__(
             None,
             ignore_newtrees=ignore_newtrees,
@@ -2331,6 +2512,9 @@ class EquilibriumOptimizer(NavigatorOptimizer):
         self.max_use_ratio = max_use_ratio
         assert self.max_use_ratio is not None, (
             'max_use_ratio has to be a number')
+        if worklist is None:
+            worklist = config.optdb.worklist
+        self.worklist = worklist
 
     def get_local_optimizers(self):
         for opt in self.local_optimizers_all:
@@ -2354,14 +2538,60 @@ class EquilibriumOptimizer(NavigatorOptimizer):
         for opt in self.cleanup_optimizers:
             opt.add_requirements(fgraph)
 
+    @staticmethod
+    def worklist_nodes(fgraph, touched):
+        """
+        Return the nodes to visit after the nodes `touched` changed.
+
+        They are the nodes of `touched` still in `fgraph`, their clients and
+        the owners of their inputs, in topological order.
+
+        """
+        nodes = OrderedSet()
+        for node in touched:
+            if node not in fgraph.apply_nodes:
+                continue
+            nodes.add(node)
+            for r in node.inputs:
+                if r.owner is not None:
+                    nodes.add(r.owner)
+            for r in node.outputs:
+                for client, _ in r.clients:
+                    if client != 'output':
+                        nodes.add(client)
+        order = []
+        done = set()
+        for node in nodes:
+            stack = [node]
+            while stack:
+                n = stack[-1]
+                if n in done:
+                    stack.pop()
+                    continue
+                todo = [r.owner for r in n.inputs
+                        if r.owner in nodes and r.owner not in done]
+                if todo:
+                    stack.extend(todo)
+                    continue
+                stack.pop()
+                done.add(n)
+                order.append(n)
+        return order
+
     def apply(self, fgraph, start_from=None):
-        change_tracker = ChangeTracker()
-        fgraph.attach_feature(change_tracker)
         if start_from is None:
             start_from = fgraph.outputs
+            worklist = self.worklist
         else:
             for node in start_from:
                 assert node in fgraph.outputs
+            # The changed nodes may not be ancestors of start_from.
+            worklist = False
+        change_tracker = ChangeTracker(track_nodes=worklist)
+        fgraph.attach_feature(change_tracker)
+        # The nodes touched during the previous iteration, or None to
+        # traverse the whole graph.
+        touched = None
 
         changed = True
         max_use_abort = False
@@ -2410,6 +2640,8 @@ class EquilibriumOptimizer(NavigatorOptimizer):
             process_count = {}
             t0 = time.time()
             changed = False
+            if worklist:
+                change_tracker.touched = OrderedSet()
             iter_cleanup_sub_profs = {}
             for copt in self.cleanup_optimizers:
                 iter_cleanup_sub_profs[copt] = []
@@ -2443,7 +2675,10 @@ class EquilibriumOptimizer(NavigatorOptimizer):
 
             # apply local optimizer
             topo_t0 = time.time()
-            q = deque(graph.io_toposort(fgraph.inputs, start_from))
+            if touched is None:
+                q = deque(graph.io_toposort(fgraph.inputs, start_from))
+            else:
+                q = deque(self.worklist_nodes(fgraph, touched))
             io_toposort_timing.append(time.time() - topo_t0)
 
             nb_nodes.append(len(q))
@@ -2468,9 +2703,10 @@ class EquilibriumOptimizer(NavigatorOptimizer):
                     if node not in fgraph.apply_nodes:
                         continue
                     current_node = node
-                    for lopt in (self.local_optimizers_all +
-                                 self.local_optimizers_map.get(type(node.op), []) +
-                                 self.local_optimizers_map.get(node.op, [])):
+                    lopts = list(self.local_optimizers_all)
+                    for key in track_keys(node.op):
+                        lopts.extend(self.local_optimizers_map.get(key, ()))
+                    for lopt in lopts:
                         nb = change_tracker.nb_imported
                         t_opt = time.time()
                         lopt_change = self.process_node(fgraph, node, lopt)
@@ -2531,6 +2767,20 @@ class EquilibriumOptimizer(NavigatorOptimizer):
             loop_process_count.append(process_count)
             loop_timing.append(float(time.time() - t0))
 
+            if changed and budget_exhausted(fgraph):
+                skip_optimizer(fgraph, self, 'stopped after %d iterations' %
+                               len(loop_timing))
+                break
+
+            if worklist:
+                if changed:
+                    touched = change_tracker.touched
+                elif touched is not None:
+                    # Nothing changed around the nodes visited, check the
+                    # whole graph before stopping.
+                    touched = None
+                    changed = True
+
         end_nb_nodes = len(fgraph.apply_nodes)
 
         if max_use_abort:
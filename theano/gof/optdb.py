@@ -164,12 +164,16 @@ class Query(object):
     position_cutoff : float
         Used by SequenceDB to keep only optimizer that are positioned before
         the cut_off point.
+    time_budget : float or None
+        Used by SequenceDB to limit the wall-clock time of the optimization,
+        in seconds. The optional optimizers are skipped when it is
+        exhausted. If None, the Theano flag optdb.time_budget is used.
 
     """
 
     def __init__(self, include, require=None, exclude=None,
                  subquery=None, position_cutoff=float('inf'),
-                 extra_optimizations=None):
+                 extra_optimizations=None, time_budget=None):
         self.include = OrderedSet(include)
         self.require = require or OrderedSet()
         self.exclude = exclude or OrderedSet()
@@ -178,6 +182,7 @@ class Query(object):
         if extra_optimizations is None:
             extra_optimizations = []
         self.extra_optimizations = extra_optimizations
+        self.time_budget = time_budget
         if isinstance(self.require, (list, tuple)):
             self.require = OrderedSet(self.require)
         if isinstance(self.exclude, (list, tuple)):
@@ -185,14 +190,17 @@ class Query(object):
 
     def __str__(self):
         return ("Query{inc=%s,ex=%s,require=%s,subquery=%s,"
-                "position_cutoff=%f,extra_opts=%s}" %
+                "position_cutoff=%f,extra_opts=%s,time_budget=%s}" %
                 (self.include, self.exclude, self.require, self.subquery,
-                 self.position_cutoff, self.extra_optimizations))
+                 self.position_cutoff, self.extra_optimizations,
+                 self.time_budget))
 
     def __setstate__(self, state):
         self.__dict__.update(state)
         if not hasattr(self, 'extra_optimizations'):
             self.extra_optimizations = []
+        if not hasattr(self, 'time_budget'):
+            self.time_budget = None
 
     # add all opt with this tag
     def including(self, *tags):
@@ -201,7 +209,8 @@ class Query(object):
                      self.exclude,
                      self.subquery,
                      self.position_cutoff,
-                     self.extra_optimizations)
+                     self.extra_optimizations,
+                     self.time_budget)
 
     # remove all opt with this tag
     def excluding(self, *tags):
@@ -210,7 +219,8 @@ class Query(object):
                      self.exclude.union(tags),
                      self.subquery,
                      self.position_cutoff,
-                     self.extra_optimizations)
+                     self.extra_optimizations,
+                     self.time_budget)
 
     # keep only opt with this tag.
     def requiring(self, *tags):
@@ -219,7 +229,8 @@ class Query(object):
                      self.exclude,
                      self.subquery,
                      self.position_cutoff,
-                     self.extra_optimizations)
+                     self.extra_optimizations,
+                     self.time_budget)
 
     def register(self, *optimizations):
         return Query(self.include,
@@ -227,7 +238,18 @@ class Query(object):
                      self.exclude,
                      self.subquery,
                      self.position_cutoff,
-                     self.extra_optimizations + list(optimizations))
+                     self.extra_optimizations + list(optimizations),
+                     self.time_budget)
+
+    # limit the optimization time.
+    def with_time_budget(self, time_budget):
+        return Query(self.include,
+                     self.require,
+                     self.exclude,
+                     self.subquery,
+                     self.position_cutoff,
+                     self.extra_optimizations,
+                     time_budget)
 
 
 class EquilibriumDB(DB):
@@ -310,6 +332,10 @@ class SequenceDB(DB):
     The optdb itself (`theano.compile.mode.optdb`), from which (among many
     other tags) fast_run and fast_compile optimizers are drawn is a SequenceDB.
 
+    Optimizations registered with a `budget_priority` are optional: they are
+    skipped when the optimization time budget of the query is exhausted (see
+    `Query` and `opt.budget_exhausted`).
+
     """
 
     seq_opt = opt.SeqOptimizer
@@ -317,10 +343,15 @@ class SequenceDB(DB):
     def __init__(self, failure_callback=opt.SeqOptimizer.warn):
         super(SequenceDB, self).__init__()
         self.__position__ = {}
+        self.__budget_priority__ = {}
         self.failure_callback = failure_callback
 
-    def register(self, name, obj, position, *tags):
+    def register(self, name, obj, position, *tags, **kwtags):
+        budget_priority = kwtags.pop('budget_priority', None)
+        assert not kwtags
         super(SequenceDB, self).register(name, obj, *tags)
+        if budget_priority is not None:
+            self.__budget_priority__[name] = budget_priority
         if position == 'last':
             if len(self.__position__) == 0:
                 self.__position__[name] = 0
@@ -343,6 +374,7 @@ class SequenceDB(DB):
 
         position_cutoff = kwtags.pop('position_cutoff',
                                      config.optdb.position_cutoff)
+        time_budget = kwtags.pop('time_budget', config.optdb.time_budget)
         position_dict = self.__position__
 
         if len(tags) >= 1 and isinstance(tags[0], Query):
@@ -350,6 +382,8 @@ class SequenceDB(DB):
             assert len(tags) == 1
             if getattr(tags[0], 'position_cutoff', None):
                 position_cutoff = tags[0].position_cutoff
+            if getattr(tags[0], 'time_budget', None) is not None:
+                time_budget = tags[0].time_budget
 
             # The Query instance might contain extra optimizations which need
             # to be added the the sequence of optimizations (don't alter the
@@ -373,6 +407,10 @@ class SequenceDB(DB):
         kwargs = {}
         if self.failure_callback:
             kwargs["failure_callback"] = self.failure_callback
+        if time_budget:
+            kwargs["time_budget"] = time_budget
+        if self.__budget_priority__:
+            kwargs["budget_priorities"] = self.__budget_priority__
         ret = self.seq_opt(opts, **kwargs)
         if hasattr(tags[0], 'name'):
             ret.name = tags[0].name
@@ -1,5 +1,8 @@
 from __future__ import absolute_import, print_function, division
 from collections import defaultdict
+import time
+
+import numpy as np
 from six import iteritems
 from theano.gof.graph import list_of_nodes
 from theano.compat import cmp
@@ -274,3 +277,219 @@ def key_to_cmp(key):
     def key_cmp(a, b):
         return cmp(key(a), key(b))
     return key_cmp
+
+
+# Size assumed for the dimensions whose length is not known statically.
+DEFAULT_DIM = 100
+
+
+def estimate_nbytes(var, default_dim=DEFAULT_DIM):
+    """
+    Static estimate of the number of bytes of the value of a variable.
+
+    The length of the broadcastable dimensions is 1. The other ones are
+    read from the ShapeFeature of the graph of `var` when they are
+    constants, else they are assumed to be `default_dim`. Variables whose
+    type has no dtype or no ndim are counted as 0 bytes.
+
+    """
+    dtype = getattr(var.type, 'dtype', None)
+    ndim = getattr(var.type, 'ndim', None)
+    if dtype is None or ndim is None:
+        return 0
+    try:
+        nbytes = np.dtype(dtype).itemsize
+    except TypeError:
+        return 0
+    broadcastable = getattr(var.type, 'broadcastable', (False,) * ndim)
+    shape_feature = getattr(getattr(var, 'fgraph', None), 'shape_feature',
+                            None)
+    shape = None
+    if shape_feature is not None:
+        shape = shape_feature.shape_of.get(var)
+    for i in range(ndim):
+        if broadcastable[i]:
+            continue
+        dim = None
+        if shape is not None:
+            dim = getattr(shape[i], 'data', None)
+        if dim is None:
+            dim = default_dim
+        nbytes *= int(dim)
+    return nbytes
+
+
+class _MemoryModel(object):
+    """
+    Track the estimated live bytes while nodes of a graph are executed.
+
+    Outputs that are views or destroyed versions of an input share the
+    buffer of that input, which is freed once no node uses it or any of its
+    aliases anymore. The buffers of the graph inputs are not counted and the
+    buffers aliased to the graph outputs are never freed.
+
+    """
+
+    def __init__(self, fgraph, nodes, default_dim):
+        self.root = {}
+        self.nbytes = {}
+        for node in nodes:
+            view_map = getattr(node.op, 'view_map', {})
+            destroy_map = getattr(node.op, 'destroy_map', {})
+            for j, out in enumerate(node.outputs):
+                aliased = view_map.get(j, []) + destroy_map.get(j, [])
+                if aliased:
+                    inp = node.inputs[aliased[0]]
+                    self.root[out] = self.root.get(inp, inp)
+                else:
+                    self.nbytes[out] = estimate_nbytes(out, default_dim)
+        self.pinned = set(self.root.get(o, o) for o in fgraph.outputs)
+        self.uses = defaultdict(int)
+        for node in nodes:
+            for r in self.input_roots(node):
+                self.uses[r] += 1
+        self.live = 0
+
+    def input_roots(self, node):
+        return set(self.root.get(i, i) for i in node.inputs)
+
+    def cost(self, node):
+        """
+        Return the bytes allocated by `node` and the net change of the
+        live bytes once it is executed.
+
+        """
+        alloc = 0
+        freed = 0
+        for out in node.outputs:
+            if out in self.nbytes:
+                alloc += self.nbytes[out]
+                if not self.uses[out] and out not in self.pinned:
+                    freed += self.nbytes[out]
+        for r in self.input_roots(node):
+            if self.uses[r] == 1 and r not in self.pinned:
+                freed += self.nbytes.get(r, 0)
+        return alloc, alloc - freed
+
+    def execute(self, node):
+        """
+        Update the live bytes for the execution of `node` and return the
+        peak reached during it.
+
+        """
+        alloc, net = self.cost(node)
+        peak = self.live + alloc
+        self.live += net
+        for r in self.input_roots(node):
+            self.uses[r] -= 1
+        return peak
+
+
+def estimate_peak(fgraph, order, default_dim=DEFAULT_DIM):
+    """
+    Estimate the peak live bytes of executing the nodes of `fgraph`
+    in `order`, see `estimate_nbytes`.
+
+    """
+    model = _MemoryModel(fgraph, order, default_dim)
+    peak = 0
+    for node in order:
+        peak = max(peak, model.execute(node))
+    return peak
+
+
+def memory_schedule(fgraph, default_dim=DEFAULT_DIM, lookahead=True,
+                    time_limit=1.0):
+    """
+    Order the nodes of a FunctionGraph to reduce the peak memory used.
+
+    The nodes are picked greedily among the ones ready to execute, the
+    nodes that free the most memory first. With `lookahead`, the gain of
+    the best node that a candidate alone makes ready is added to its own.
+    The order respects the dependencies of the graph and the orderings of
+    its features (e.g. the destroy handler). The sizes are the static
+    estimates of `estimate_nbytes`.
+
+    Parameters
+    ----------
+    fgraph : FunctionGraph
+        The graph to schedule.
+    default_dim : int
+        Length assumed for the dimensions not known statically.
+    lookahead : bool
+        Look one node ahead when comparing the candidates.
+    time_limit : float
+        If the search takes longer than this many seconds, stop it and
+        return `fgraph.toposort()`.
+
+    Returns
+    -------
+    list of Apply
+        The nodes of `fgraph`, in the scheduled order if its estimated peak
+        is lower than the one of `fgraph.toposort()`, else in that order.
+
+    """
+    t0 = time.time()
+    base = fgraph.toposort()
+    index = dict((node, i) for i, node in enumerate(base))
+    preds = dict((node, set(i.owner for i in node.inputs if i.owner))
+                 for node in base)
+    for node, prereqs in iteritems(fgraph.orderings()):
+        preds[node].update(prereqs)
+    succs = dict((node, []) for node in base)
+    for node in base:
+        for p in preds[node]:
+            succs[p].append(node)
+    n_waiting = dict((node, len(preds[node])) for node in base)
+
+    model = _MemoryModel(fgraph, base, default_dim)
+    ready = [node for node in base if not n_waiting[node]]
+    order = []
+    peak = 0
+    while ready:
+        if time.time() - t0 > time_limit:
+            return base
+
+        def key(node):
+            net = model.cost(node)[1]
+            if lookahead:
+                gains = [model.cost(s)[1] for s in succs[node]
+                         if n_waiting[s] == 1]
+                if gains and min(gains) < 0:
+                    net += min(gains)
+            return (net, index[node])
+        node = min(ready, key=key)
+        ready.remove(node)
+        order.append(node)
+        peak = max(peak, model.execute(node))
+        for s in succs[node]:
+            n_waiting[s] -= 1
+            if not n_waiting[s]:
+                ready.append(s)
+    assert len(order) == len(base)
+    if peak < estimate_peak(fgraph, base, default_dim):
+        return order
+    return base
+
+
+def memory_schedule_fn(default_dim=DEFAULT_DIM, lookahead=True,
+                       time_limit=1.0):
+    """
+    Make a schedule function that reduces the peak memory used.
+
+    Give it to a linker to use it, e.g.
+    ``theano.Mode(linker=theano.gof.vm.VM_Linker(
+    schedule=memory_schedule_fn()))``.
+
+    See Also
+    --------
+    memory_schedule
+
+    """
+    def schedule(fgraph):
+        """
+        Order nodes in a FunctionGraph.
+
+        """
+        return memory_schedule(fgraph, default_dim, lookahead, time_limit)
+    return schedule
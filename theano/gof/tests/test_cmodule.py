@@ -6,9 +6,11 @@ deterministic based on the input type and the op.
 """
 from __future__ import absolute_import, print_function, division
 
+from nose.plugins.skip import SkipTest
 import numpy as np
 
 import theano
+from theano.gof.cc import get_module_cache, precompile_cmodules
 from theano.gof.cmodule import GCC_compiler
 
 
@@ -69,3 +71,67 @@ def test_flag_detection():
     # but was not detected because that path is not usually taken,
     # so we test it here directly.
     GCC_compiler.try_flags(["-lblas"])
+
+
+class AddVersionOp(theano.Op):
+    """Add `version` to a double vector, with a new module per version."""
+    __props__ = ('version',)
+
+    def __init__(self, version):
+        self.version = version
+
+    def make_node(self, x):
+        x = theano.tensor.as_tensor_variable(x)
+        return theano.Apply(self, [x], [x.type()])
+
+    def c_code_cache_version(self):
+        return (self.version,)
+
+    def c_code(self, node, name, inames, onames, sub):
+        iname, = inames
+        oname, = onames
+        fail = sub['fail']
+        version = self.version
+        return """
+        Py_XDECREF(%(oname)s);
+        %(oname)s = (PyArrayObject*)PyArray_NewCopy(%(iname)s, NPY_ANYORDER);
+        if (!%(oname)s)
+            %(fail)s;
+        for (npy_intp i = 0; i < PyArray_SIZE(%(oname)s); ++i)
+            ((double*)PyArray_DATA(%(oname)s))[i] += %(version)s;
+        """ % locals()
+
+
+def test_precompile_cmodules():
+    if not theano.config.cxx:
+        raise SkipTest("Need cxx for this test")
+    # Versions that are not in the cache yet.
+    base = np.random.RandomState().randint(2 ** 30)
+    x = theano.tensor.dvector('x')
+    outs = [AddVersionOp(base + i)(x) for i in range(3)]
+    fgraph = theano.gof.FunctionGraph([x], outs)
+    nodes = fgraph.toposort()
+    storage_map = dict((v, [None]) for v in fgraph.variables)
+    compute_map = dict((v, [False]) for v in fgraph.variables)
+    cache = get_module_cache()
+    n_compiled = cache.stats[2]
+    precompile_cmodules(nodes, storage_map, compute_map, [], n_jobs=2)
+    assert cache.stats[2] == n_compiled + 3
+
+    # Making the thunks only loads the modules.
+    mode = theano.Mode(linker='cvm', optimizer=None)
+    f = theano.function([x], outs, mode=mode)
+    assert cache.stats[2] == n_compiled + 3
+    for i, out in enumerate(f(np.arange(4.))):
+        assert np.allclose(out, np.arange(4.) + base + i)
+
+    # The OpenMPOp, like Elemwise, are not skipped.
+    y = theano.tensor.dvector('y')
+    base = np.random.RandomState().randint(2 ** 30)
+    fgraph = theano.gof.FunctionGraph([y], [y + base])
+    storage_map = dict((v, [None]) for v in fgraph.variables)
+    compute_map = dict((v, [False]) for v in fgraph.variables)
+    n_compiled = cache.stats[2]
+    precompile_cmodules(fgraph.toposort(), storage_map, compute_map, [],
+                        n_jobs=2)
+    assert cache.stats[2] == n_compiled + 1
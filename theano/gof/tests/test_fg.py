@@ -48,3 +48,51 @@ class TFunctionGraph(unittest.TestCase):
                 u = CompatUnpickler(f)
             d = u.load()
         f = theano.function(**d)
+
+    def test_fingerprint(self):
+        x, y = tt.vectors('x', 'y')
+        fg1 = FunctionGraph([x, y], [tt.exp(x) + y * 2])
+        a, b = tt.vectors('a', 'b')
+        fg2 = FunctionGraph([a, b], [tt.exp(a) + b * 2])
+        # Variable names don't matter, but the position of the inputs does.
+        assert fg1.fingerprint() == fg2.fingerprint()
+        fg3 = FunctionGraph([y, x], [tt.exp(x) + y * 2])
+        assert fg1.fingerprint() != fg3.fingerprint()
+        fg4 = FunctionGraph([x, y], [tt.exp(x) + y * 3])
+        assert fg1.fingerprint() != fg4.fingerprint()
+        fg5 = FunctionGraph([x, tt.matrix()], [x])
+        assert fg5.fingerprint() != FunctionGraph([x, y], [x]).fingerprint()
+
+        # Variables and nodes also have a fingerprint.
+        out = fg1.outputs[0]
+        assert fg1.fingerprint(out) == fg2.fingerprint(fg2.outputs[0])
+        assert fg1.fingerprint(out.owner) != fg1.fingerprint(out)
+
+        # Sharing subgraphs changes the fingerprint.
+        e = tt.exp(x)
+        fg6 = FunctionGraph([x], [e, e])
+        fg7 = FunctionGraph([x], [tt.exp(x), tt.exp(x)])
+        assert fg6.fingerprint() != fg7.fingerprint()
+
+    def test_fingerprint_incremental(self):
+        x, y = tt.vectors('x', 'y')
+        fg = FunctionGraph([x, y], [tt.exp(x) + tt.log(y) * 2])
+        fp = fg.fingerprint()
+        assert fp == theano.gof.graph.graph_fingerprint(fg.inputs,
+                                                        fg.outputs)
+        exp_out = fg.outputs[0].owner.inputs[0]
+        fg.replace(exp_out, tt.sin(fg.inputs[0]))
+        fp2 = fg.fingerprint()
+        assert fp2 != fp
+        assert fp2 == theano.gof.graph.graph_fingerprint(fg.inputs,
+                                                         fg.outputs)
+        assert fp2 == FunctionGraph(
+            [x, y], [tt.sin(x) + tt.log(y) * 2]).fingerprint()
+        fg.replace(fg.outputs[0], fg.inputs[1])
+        assert fg.fingerprint() == FunctionGraph([x, y], [y]).fingerprint()
+
+        # The fingerprint is the same after unpickling and cloning.
+        fg = FunctionGraph([x, y], [tt.exp(x) + tt.log(y) * 2])
+        fg.fingerprint()
+        assert pickle.loads(pickle.dumps(fg)).fingerprint() == fp
+        assert fg.clone().fingerprint() == fp
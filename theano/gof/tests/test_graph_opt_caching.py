@@ -1,15 +1,32 @@
 from __future__ import absolute_import, print_function, division
 import os
+import shutil
+import tempfile
+import threading
+import time
+
 import numpy as np
 import theano
 import theano.tensor as T
+from theano.compile.graphcache import (get_optimized_graph_cache,
+                                       OptimizedGraphCache)
 
 floatX = 'float32'
 
 
+@theano.compile.ops.as_op(itypes=[T.dvector], otypes=[T.dvector])
+def as_op_double(x):
+    return x * 2
+
+
+@theano.compile.ops.as_op(itypes=[T.dvector], otypes=[T.dvector])
+def as_op_triple(x):
+    return x * 3
+
+
 def test_graph_opt_caching():
-    opt_db_file = theano.config.compiledir + '/optimized_graphs.pkl'
-    os.system('rm %s' % opt_db_file)
+    cache = get_optimized_graph_cache()
+    cache.clear()
 
     mode = theano.config.mode
     if mode in ["DEBUG_MODE", "DebugMode"]:
@@ -22,20 +39,110 @@ def test_graph_opt_caching():
         c = theano.shared(np.ones((10, 10), dtype=floatX))
         d = theano.shared(np.ones((10, 10), dtype=floatX))
         e = T.sum(T.sum(T.sum(a ** 2 + b) + c) + d)
+        hits, stores = cache.hits, cache.stores
         f1 = theano.function([a, b], e, mode=mode)
+        assert cache.hits == hits
+        assert cache.stores == stores + 1
 
         m = T.fmatrix('x1')
         n = T.fmatrix('x2')
-        p = theano.shared(np.ones((10, 10), dtype=floatX))
+        p = theano.shared(2 * np.ones((10, 10), dtype=floatX))
         q = theano.shared(np.ones((10, 10), dtype=floatX))
         j = T.sum(T.sum(T.sum(m ** 2 + n) + p) + q)
         f2 = theano.function([m, n], j, mode=mode)
+        assert cache.hits == hits + 1
+        assert cache.stores == stores + 1
 
         in1 = np.ones((10, 10), dtype=floatX)
         in2 = np.ones((10, 10), dtype=floatX)
-        assert f1(in1, in2) == f2(in1, in2)
+        assert f1(in1, in2) == 2010100
+        # The cached graph uses the shared variables of f2.
+        assert f2(in1, in2) == 2020100
+        p.set_value(np.zeros((10, 10), dtype=floatX))
+        assert f2(in1, in2) == 2000100
+
+        # A different graph is not found in the cache.
+        f3 = theano.function([m, n], T.sum(m * n), mode=mode)
+        assert cache.hits == hits + 1
+        assert f3(in1, in2) == 100
+
+        # A graph whose optimization was cut short is not stored.
+        stores = cache.stores
+        budget_mode = theano.compile.mode.get_mode(mode).with_time_budget(1e-9)
+        f4 = theano.function([m, n], T.exp(m * n).sum(), mode=budget_mode)
+        assert f4.maker.fgraph.skipped_optimizers
+        assert cache.stores == stores
+    finally:
+        theano.config.cache_optimizations = default
+
+
+def test_graph_opt_cache_cleanup():
+    dirname = tempfile.mkdtemp()
+    try:
+        cache = OptimizedGraphCache(dirname)
+        x = T.fvector('x')
+        fgraph = theano.gof.FunctionGraph([x], [x * 2])
+        query = theano.compile.mode.get_default_mode()._optimizer
+        keys = []
+        for i in range(3):
+            key = cache.key(theano.gof.FunctionGraph([x], [x * i]), [],
+                            query)
+            cache.store(key, fgraph, fgraph)
+            keys.append(key)
+        assert len(set(keys)) == 3
+        # Make the first entry the least recently used one.
+        old = time.time() - 100
+        os.utime(cache._path(keys[0]), (old, old))
+        size = os.path.getsize(cache._path(keys[1]))
+        cache.cleanup(max_size=2 * size + 1)
+        assert cache.evictions == 1
+        assert cache.load(keys[0], fgraph) is None
+        assert cache.load(keys[1], fgraph) is not None
+
+        # Corrupted entries are deleted.
+        with open(cache._path(keys[2]), 'wb') as f:
+            f.write(b'garbage')
+        assert cache.load(keys[2], fgraph) is None
+        assert not os.path.exists(cache._path(keys[2]))
+
+        cache.clear()
+        assert cache.load(keys[1], fgraph) is None
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_graph_opt_cache_key_function():
+    # Ops without __props__ are hashed from their whole state, e.g. the
+    # function of an as_op.
+    cache = get_optimized_graph_cache()
+    query = theano.compile.mode.get_default_mode()._optimizer
+    x = T.dvector('x')
+    keys = [cache.key(theano.gof.FunctionGraph([x], [op(x)]), [], query)
+            for op in (as_op_double, as_op_triple)]
+    assert None not in keys
+    assert keys[0] != keys[1]
+
+    default = theano.config.cache_optimizations
+    try:
+        theano.config.cache_optimizations = True
+        val = np.arange(3.)
+        for op, factor in [(as_op_double, 2), (as_op_triple, 3)]:
+            f = theano.function([x], op(x))
+            assert np.allclose(f(val), val * factor)
     finally:
         theano.config.cache_optimizations = default
 
+    # A function whose closure can't be hashed makes the graph uncacheable.
+    lock = threading.Lock()
+
+    def locked(x):
+        with lock:
+            return x
+    op = theano.compile.ops.as_op(itypes=[T.dvector],
+                                  otypes=[T.dvector])(locked)
+    assert cache.key(theano.gof.FunctionGraph([x], [op(x)]), [],
+                     query) is None
+
+
 if __name__ == '__main__':
     test_graph_opt_caching()
@@ -0,0 +1,73 @@
+from __future__ import absolute_import, print_function, division
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import theano
+from theano.gof import omp_autotune
+
+
+def test_candidate_threads():
+    assert omp_autotune.candidate_threads(1) == [1]
+    assert omp_autotune.candidate_threads(4) == [1, 2, 4]
+    assert omp_autotune.candidate_threads(6) == [1, 2, 4, 6]
+
+
+class FakeOmp(object):
+    def __init__(self):
+        self.n = 4
+        self.calls = []
+
+    def omp_get_max_threads(self):
+        return self.n
+
+    def omp_set_num_threads(self, n):
+        self.n = n
+
+
+def test_autotuned_thunk():
+    tmpdir = tempfile.mkdtemp()
+    old = (omp_autotune._omp, omp_autotune.table_path, omp_autotune._table)
+    fake = FakeOmp()
+    omp_autotune._omp = fake
+    omp_autotune.table_path = lambda: os.path.join(tmpdir, 'table.json')
+    omp_autotune._table = None
+    try:
+        x = theano.tensor.vector()
+        node = (x + 1).owner
+        storage = [[np.zeros(1000)]]
+
+        def thunk():
+            fake.calls.append(fake.n)
+        thunk.inputs = storage
+        thunk.outputs = [[None]]
+
+        f = omp_autotune.autotuned_thunk(node.op, node, thunk)
+        assert not hasattr(f, 'cthunk')
+        n_tuning = omp_autotune.TRIALS * 3
+        for i in range(n_tuning):
+            f()
+            # The number of threads is restored after each call.
+            assert fake.n == 4
+        assert sorted(set(fake.calls)) == [1, 2, 4]
+        key = omp_autotune.tuning_key(node.op, node,
+                                      omp_autotune.size_class(storage))
+        best = omp_autotune.get_table()[key]
+        with open(omp_autotune.table_path()) as fi:
+            assert json.load(fi)[key] == best
+        del fake.calls[:]
+        f()
+        assert fake.calls == [best]
+
+        # Another size class is tuned on its own.
+        storage[0][0] = np.zeros(10)
+        f()
+        assert len(omp_autotune._pending) == 1
+    finally:
+        (omp_autotune._omp, omp_autotune.table_path,
+         omp_autotune._table) = old
+        omp_autotune._pending.clear()
+        shutil.rmtree(tmpdir)
@@ -6,7 +6,8 @@ from theano.gof.op import Op
 from theano.gof.opt import (OpKeyOptimizer, PatternSub, TopoOptimizer, OpSub,
                             MergeOptimizer, config, theano,
                             EquilibriumOptimizer, logging, pre_constant_merge,
-                            pre_greedy_local_optimizer)
+                            pre_greedy_local_optimizer, LocalOptGroup,
+                            local_optimizer)
 from theano.gof.fg import FunctionGraph
 
 from theano import tensor as T
@@ -537,6 +538,20 @@ class TestMergeOptimizer:
                         if isinstance(n.op, NoInputOp)]
         assert len(no_input_ops) == 2, fg.apply_nodes
 
+    def test_merge_incremental(self):
+        # Duplicates created by a replacement are found by the MergeFeature
+        # when they appear, so the next merge pass only applies them.
+        x, y, z = inputs()
+        e = op1(op2(x, y), op2(x, z))
+        g = FunctionGraph([x, y, z], [e])
+        MergeOptimizer().optimize(g)
+        assert not g.merge_feature.scheduled
+        g.replace(g.inputs[2], g.inputs[1])
+        assert len(g.merge_feature.scheduled) == 1
+        MergeOptimizer().optimize(g)
+        assert str(g) == "[Op1(*1 -> Op2(x, y), *1)]"
+        assert len(g.merge_feature.node_sig_inv) == 2
+
 
 class TestEquilibrium(object):
 
@@ -571,6 +586,31 @@ class TestEquilibrium(object):
         opt.optimize(g)
         assert str(g) == '[Op2(x, y)]'
 
+    def test_worklist(self):
+        op7 = MyOp('Op7')
+        results = []
+        for worklist in [False, True]:
+            x, y, z = map(MyVariable, 'xyz')
+            e = op1(op1(op3(x, y)))
+            g = FunctionGraph([x, y, z],
+                              [e, op7(x, z), op7(z, x), op7(op7(y, z))])
+            opt = EquilibriumOptimizer(
+                [PatternSub((op1, (op2, 'x', 'y')), (op4, 'x', 'y')),
+                 PatternSub((op3, 'x', 'y'), (op4, 'x', 'y')),
+                 PatternSub((op4, 'x', 'y'), (op5, 'x', 'y')),
+                 PatternSub((op5, 'x', 'y'), (op6, 'x', 'y')),
+                 PatternSub((op6, 'x', 'y'), (op2, 'x', 'y'))
+                 ],
+                max_use_ratio=10, worklist=worklist)
+            nb_nodes = opt.optimize(g)[5]
+            results.append(str(g))
+        assert results[0] == results[1]
+        assert results[1].startswith('[Op2(x, y), ')
+        # Only the changed nodes and their neighbours are visited after the
+        # first iteration, and the whole graph at the end.
+        assert max(nb_nodes[1:-1]) < nb_nodes[0]
+        assert nb_nodes[-1] == len(g.apply_nodes)
+
     @theano.configparser.change_flags(on_opt_error='ignore')
     def test_low_use_ratio(self):
         x, y, z = map(MyVariable, 'xyz')
@@ -611,3 +651,39 @@ def test_pre_constant_merge_slice():
 
     # Make sure constant of slice signature is hashable.
     hash(cst.signature())
+
+
+def test_tracks_scalar_op():
+    # Optimizers can track the Elemwise of a given scalar Op.
+    tried = []
+
+    @local_optimizer([(T.Elemwise, theano.scalar.Add)])
+    def local_add(node):
+        tried.append(node)
+        return False
+
+    x = T.vector()
+    g = FunctionGraph([x], [T.exp(x) + x])
+    add_node = g.outputs[0].owner
+    group = LocalOptGroup(local_add)
+    for node in g.toposort():
+        group.transform(node)
+    assert tried == [add_node]
+
+    del tried[:]
+    EquilibriumOptimizer([local_add], max_use_ratio=1).optimize(g)
+    assert tried == [add_node]
+
+    # The subclasses of the tracked scalar Op are also tried.
+    @local_optimizer([(T.Elemwise, theano.scalar.UnaryScalarOp)])
+    def local_unary(node):
+        tried.append(node)
+        return False
+
+    del tried[:]
+    g = FunctionGraph([x], [T.exp(x) + x])
+    exp_node = g.outputs[0].owner.inputs[0].owner
+    group = LocalOptGroup(local_unary)
+    for node in g.toposort():
+        group.transform(node)
+    assert tried == [exp_node]
@@ -1,8 +1,10 @@
 from __future__ import absolute_import, print_function, division
+import time
 from unittest import TestCase
 
 from theano.compat import exc_message
-from theano.gof.optdb import opt, DB
+from theano.gof.fg import FunctionGraph
+from theano.gof.optdb import opt, DB, Query, SequenceDB
 
 
 class Test_DB(TestCase):
@@ -55,3 +57,43 @@ class Test_DB(TestCase):
                 raise
         except Exception:
             self.fail()
+
+
+class Test_SequenceDB(TestCase):
+
+    def test_time_budget(self):
+        applied = []
+
+        class Opt(opt.Optimizer):
+            def __init__(self, duration=0):
+                self.duration = duration
+
+            def apply(self, fgraph):
+                applied.append(self.name)
+                time.sleep(self.duration)
+
+        db = SequenceDB()
+        db.register('slow', Opt(0.2), 0, 'a')
+        db.register('opt0', Opt(), 1, 'a', budget_priority=0)
+        db.register('opt1', Opt(), 2, 'a', budget_priority=1)
+        db.register('required', Opt(), 3, 'a')
+
+        fgraph = FunctionGraph([], [])
+        db.query(Query(include=['a'])).optimize(fgraph)
+        assert applied == ['slow', 'opt0', 'opt1', 'required']
+        assert not hasattr(fgraph, 'skipped_optimizers')
+
+        # More than half of the budget is used by 'slow'.
+        del applied[:]
+        db.query(Query(include=['a'],
+                       time_budget=0.3)).optimize(fgraph)
+        assert applied == ['slow', 'opt0', 'required']
+        assert fgraph.skipped_optimizers == ['opt1']
+
+        # The budget is exhausted.
+        del applied[:]
+        fgraph = FunctionGraph([], [])
+        db.query(Query(include=['a']).with_time_budget(0.1)).optimize(
+            fgraph)
+        assert applied == ['slow', 'required']
+        assert fgraph.skipped_optimizers == ['opt0', 'opt1']
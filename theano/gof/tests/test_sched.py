@@ -1,7 +1,12 @@
 from __future__ import absolute_import, print_function, division
+import numpy as np
+
 from theano.gof.sched import (make_dependence_cmp, sort_apply_nodes,
-                              reverse_dict, _toposort, posort)
+                              reverse_dict, _toposort, posort,
+                              estimate_nbytes, estimate_peak,
+                              memory_schedule, memory_schedule_fn)
 
+import theano
 from theano import tensor
 from theano.gof.graph import io_toposort
 from theano.compat import cmp
@@ -68,3 +73,36 @@ def test_posort():
             lambda a, b: a - b]
     assert (posort(l, *cmps) ==
             [10, 1, 11, 2, 12, 3, 13, 4, 14, 5, 15, 6, 16, 7, 17, 8, 18, 9, 19])
+
+
+def test_estimate_nbytes():
+    x = tensor.TensorType('float64', (False, True, False))()
+    assert estimate_nbytes(x, default_dim=10) == 8 * 10 * 10
+    assert estimate_nbytes(tensor.iscalar()) == 4
+
+
+def test_memory_schedule():
+    x = tensor.vector('x')
+    # Each outer product is large, its sum is small.
+    outs = [tensor.outer(x + i, x).sum() for i in range(4)]
+    fgraph = theano.FunctionGraph([x], [tensor.add(*outs)])
+    order = memory_schedule(fgraph)
+
+    assert set(order) == set(fgraph.apply_nodes)
+    computed = set()
+    for node in order:
+        assert all(i.owner is None or i.owner in computed
+                   for i in node.inputs)
+        computed.add(node)
+    assert (estimate_peak(fgraph, order) <=
+            estimate_peak(fgraph, fgraph.toposort()))
+    # Only one outer product is alive at a time.
+    nbytes = estimate_nbytes(outs[0].owner.inputs[0])
+    assert estimate_peak(fgraph, order) < 2 * nbytes
+
+    mode = theano.Mode(linker=theano.gof.vm.VM_Linker(
+        schedule=memory_schedule_fn()))
+    f = theano.function([x], tensor.add(*outs), mode=mode)
+    val = np.arange(3).astype(theano.config.floatX)
+    expected = sum(np.outer(val + i, val).sum() for i in range(4))
+    assert np.allclose(f(val), expected)
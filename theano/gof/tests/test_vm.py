@@ -3,13 +3,14 @@ import gc
 import sys
 import time
 import unittest
+from collections import OrderedDict
 
 from nose.plugins.skip import SkipTest
 import numpy as np
 from six import itervalues
 
 from theano import function
-from theano.gof import vm
+from theano.gof import memplan, vm
 from theano.gof import OpWiseCLinker
 from six.moves import xrange
 from theano.compile import Mode
@@ -17,6 +18,7 @@ from theano.compile import Mode
 from theano import tensor
 from theano.ifelse import ifelse
 import theano
+from theano.tests import unittest_tools as utt
 
 
 class TestCallbacks(unittest.TestCase):
@@ -412,8 +414,10 @@ def test_reallocation():
     y = tensor.scalar('y')
     z = tensor.tanh(3 * x + y) + tensor.cosh(x + 5 * y)
     # The functinality is currently implement for non lazy and non c VM only.
-    for l in [vm.VM_Linker(allow_gc=False, lazy=False, use_cloop=False),
-              vm.VM_Linker(allow_gc=True, lazy=False, use_cloop=False)]:
+    for l in [vm.VM_Linker(allow_gc=False, lazy=False, use_cloop=False,
+                           n_threads=1),
+              vm.VM_Linker(allow_gc=True, lazy=False, use_cloop=False,
+                           n_threads=1)]:
         m = theano.compile.get_mode(theano.Mode(linker=l))
         m = m.excluding('fusion', 'inplace')
 
@@ -440,6 +444,52 @@ def test_reallocation():
                        itervalues(storage_map))) < len(storage_map)
 
 
+def test_memory_planner():
+    x = tensor.matrix('x')
+    z = tensor.tanh(tensor.dot(x, x) + 1).sum(axis=0) * 2
+    l = vm.VM_Linker(allow_gc=False, use_cloop=False, lazy=False,
+                     n_threads=1, memory_planner=True)
+    m = theano.compile.get_mode(theano.Mode(linker=l)).excluding('fusion')
+    f = theano.function([x], z, mode=m)
+    f_ref = theano.function([x], z)
+    assert isinstance(f.fn, memplan.MemoryPlannedVM)
+
+    for shape in [(3, 3), (3, 3), (5, 5), (5, 5), (3, 3)]:
+        val = np.random.rand(*shape).astype(theano.config.floatX)
+        utt.assert_allclose(f(val), f_ref(val))
+    assert len(f.fn.plans) == 2
+
+    # Buffers alive at the same time do not overlap in the arena.
+    arena, views = list(f.fn.plans.values())[0]
+    lifetimes = f.fn.lifetimes
+    planned = dict((id(s), v) for v, s in f.fn.planned_storage)
+    for i, (s1, v1) in enumerate(views):
+        assert v1.base is arena or v1.base.base is arena
+        for s2, v2 in views[i + 1:]:
+            f1, l1 = lifetimes[planned[id(s1)]]
+            f2, l2 = lifetimes[planned[id(s2)]]
+            if f1 <= l2 and f2 <= l1:
+                assert not np.may_share_memory(v1, v2)
+
+    # The lazy VMs do not run the nodes in order.
+    c = tensor.scalar('c')
+    z = ifelse(c, tensor.tanh(tensor.dot(x, x)).sum(), (x * 2).sum())
+    for lazy in [True, None]:
+        l = vm.VM_Linker(allow_gc=False, use_cloop=False, lazy=lazy,
+                         n_threads=1, memory_planner=True)
+        f = theano.function([c, x], z, mode=theano.Mode(linker=l))
+        assert not isinstance(f.fn, memplan.MemoryPlannedVM)
+
+
+def test_assign_offsets():
+    sizes = OrderedDict([('a', 100), ('b', 50), ('c', 100), ('d', 10)])
+    lifetimes = {'a': (0, 1), 'b': (1, 2), 'c': (2, 3), 'd': (3, 3)}
+    offsets, total = memplan.assign_offsets(sizes, lifetimes, alignment=64)
+    # 'c' reuses the memory of 'a', 'd' the space left after 'c'.
+    assert offsets == {'a': 0, 'c': 0, 'b': 128, 'd': 128}
+    assert total == 192
+
+
 def test_no_recycling():
     x = theano.tensor.vector()
     for lnk in [vm.VM_Linker(use_cloop=True),
@@ -453,3 +503,76 @@ def test_no_recycling():
         m1 = f.fn.thunks[0].thunk.module
         m2 = f2.fn.thunks[0].thunk.module
         assert m1 is m2
+
+
+class TestParallelLoop(unittest.TestCase):
+    def test_matches_sequential(self):
+        x = tensor.matrix('x')
+        w = tensor.matrix('w')
+        heads = [tensor.tanh(tensor.dot(x, w) * i).sum(axis=0)
+                 for i in range(1, 5)]
+        out = tensor.concatenate(heads) + x.max()
+        x_val = np.random.rand(20, 10).astype(theano.config.floatX)
+        w_val = np.random.rand(10, 10).astype(theano.config.floatX)
+
+        f_ref = function([x, w], out,
+                         mode=Mode(linker=vm.VM_Linker(use_cloop=False,
+                                                       n_threads=1)))
+        expected = f_ref(x_val, w_val)
+        for allow_gc in [False, True]:
+            lnk = vm.VM_Linker(allow_gc=allow_gc, n_threads=4)
+            f = function([x, w], out, mode=Mode(linker=lnk))
+            assert isinstance(f.fn, vm.ParallelLoop)
+            for i in range(3):
+                utt.assert_allclose(f(x_val, w_val), expected)
+
+    def test_inplace(self):
+        # The inplace additions must wait for the other readers of x.
+        x = tensor.vector('x')
+        out = [x * 2, x.sum(), tensor.exp(x)]
+        mode = Mode(linker=vm.VM_Linker(n_threads=3))
+        f = function([theano.In(x, mutable=True)],
+                     [(o + 1) for o in out], mode=mode)
+        assert isinstance(f.fn, vm.ParallelLoop)
+        x_val = np.arange(5).astype(theano.config.floatX)
+        r = f(x_val.copy())
+        utt.assert_allclose(r[0], x_val * 2 + 1)
+        utt.assert_allclose(r[1], x_val.sum() + 1)
+        utt.assert_allclose(r[2], np.exp(x_val) + 1)
+
+    def test_destroy_without_destroy_handler(self):
+        from theano.tensor import inplace
+        x = tensor.vector('x')
+        y = tensor.exp(x)
+        y2 = y * x
+        z = inplace.add_inplace(y, x)
+        fgraph = theano.FunctionGraph([x], [y2, z], clone=False)
+        order = [y.owner, y2.owner, z.owner]
+        preds = vm.calculate_parallel_dependencies(order, fgraph)
+        assert preds[2] == set([0, 1])
+
+    def test_lazy_fallback(self):
+        a, b, c = tensor.scalars('abc')
+        f = function([a, b, c], ifelse(a, 2 * b, 2 * c),
+                     mode=Mode(linker=vm.VM_Linker(n_threads=4)))
+        assert not isinstance(f.fn, vm.ParallelLoop)
+        assert f(1, 2, 3) == 4
+
+    def test_error(self):
+        x = tensor.vector('x')
+        y = tensor.vector('y')
+        f = function([x, y], [x + y, tensor.exp(x)],
+                     mode=Mode(linker=vm.VM_Linker(n_threads=2)))
+        assert isinstance(f.fn, vm.ParallelLoop)
+        self.assertRaises(ValueError, f, [1, 2], [3, 4, 5])
+        f([1, 2], [3, 4])
+
+    def test_partial_function(self):
+        x = tensor.scalar('x')
+        y = x ** 2
+        f = function([x], [y + 7, y - 9, y / 14.],
+                     mode=Mode(optimizer=None,
+                               linker=vm.VM_Linker(n_threads=2)))
+        assert isinstance(f.fn, vm.ParallelLoop)
+        assert f(3, output_subset=[0, 1, 2]) == f(3)
+        assert f(4, output_subset=[0, 2]) == [f(4)[0], f(4)[2]]
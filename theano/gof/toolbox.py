@@ -363,6 +363,10 @@ class History(Feature):
         fgraph.revert = partial(self.revert, fgraph)
 
     def unpickle(self, fgraph):
+        # ReplaceValidate does not pickle the history.
+        if not hasattr(self, 'history'):
+            self.history = {}
+        self.history[fgraph] = []
         fgraph.checkpoint = GetCheckpoint(self, fgraph)
         fgraph.revert = partial(self.revert, fgraph)
 
@@ -661,6 +665,132 @@ class NodeFinder(Bookkeeper):
         return all
 
 
+class Fingerprinter(Bookkeeper):
+    """
+    Keep the structural fingerprint of a FunctionGraph up to date.
+
+    See `FunctionGraph.fingerprint`. When a node changes, it and the nodes
+    that depend on it are marked as dirty, and their fingerprints are only
+    recomputed by the next call to `fingerprint`.
+
+    """
+
+    def __init__(self):
+        self.fgraph = None
+
+    def on_attach(self, fgraph):
+        if self.fgraph is not None:
+            # E.g. when a graph is cloned with its features.
+            raise AlreadyThere("A Fingerprinter instance can only serve one "
+                               "FunctionGraph.")
+        if any(isinstance(feature, Fingerprinter)
+               for feature in fgraph._features):
+            raise AlreadyThere("Fingerprinter is already present.")
+        self.fgraph = fgraph
+        self.unpickle(fgraph)
+
+    def unpickle(self, fgraph):
+        self.memo = {}
+        self.fingerprints = {}
+        self.n_inputs = 0
+        # Sum of the fingerprint_int of the clean nodes.
+        self.apply_sum = 0
+        self.dirty = set()
+        Bookkeeper.on_attach(self, fgraph)
+
+    def on_detach(self, fgraph):
+        self.fgraph = None
+        del self.memo, self.fingerprints, self.dirty
+
+    def __getstate__(self):
+        # Recomputed by unpickle().
+        d = self.__dict__.copy()
+        for attr in ('memo', 'fingerprints', 'dirty'):
+            d.pop(attr, None)
+        return d
+
+    def on_import(self, fgraph, node, reason):
+        self.dirty.add(node)
+
+    def on_prune(self, fgraph, node, reason):
+        if node in self.dirty:
+            self.dirty.remove(node)
+        else:
+            self.apply_sum -= graph.fingerprint_int(self.fingerprints[node])
+        self.fingerprints.pop(node, None)
+        for out in node.outputs:
+            self.fingerprints.pop(out, None)
+
+    def on_change_input(self, fgraph, node, i, r, new_r, reason=None):
+        if node == 'output':
+            # The outputs are hashed by fingerprint().
+            return
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node in self.dirty:
+                # Its clients are already dirty.
+                continue
+            self.apply_sum -= graph.fingerprint_int(self.fingerprints[node])
+            self.dirty.add(node)
+            for out in node.outputs:
+                stack.extend(client for client, _ in fgraph.clients(out)
+                             if client != 'output')
+
+    def update(self, fgraph):
+        """
+        Recompute the fingerprints of the dirty nodes.
+
+        """
+        if self.n_inputs != len(fgraph.inputs):
+            # Inputs can be added with FunctionGraph.add_input.
+            for i, r in enumerate(fgraph.inputs):
+                self.fingerprints[r] = graph.leaf_fingerprint(r, i, self.memo)
+            self.n_inputs = len(fgraph.inputs)
+        dirty = self.dirty
+        while dirty:
+            stack = [next(iter(dirty))]
+            while stack:
+                node = stack[-1]
+                if node not in dirty:
+                    stack.pop()
+                    continue
+                # Hash the dirty ancestors first.
+                todo = [r.owner for r in node.inputs if r.owner in dirty]
+                if todo:
+                    stack.extend(todo)
+                    continue
+                stack.pop()
+                dirty.remove(node)
+                fp = graph.apply_fingerprint(node, self.fingerprints,
+                                             self.memo)
+                self.apply_sum += graph.fingerprint_int(fp)
+        self.apply_sum %= 2 ** 128
+
+    def fingerprint(self, fgraph, r=None):
+        """
+        Return the fingerprint of `fgraph`, or of its Variable or Apply `r`.
+
+        """
+        self.update(fgraph)
+        if r is not None:
+            if r not in self.fingerprints:
+                if not isinstance(r, graph.Constant):
+                    raise ValueError("%s is not in the FunctionGraph" % r)
+                self.fingerprints[r] = graph.leaf_fingerprint(r,
+                                                              memo=self.memo)
+            return self.fingerprints[r]
+        out_fps = []
+        for out in fgraph.outputs:
+            if out not in self.fingerprints:
+                self.fingerprints[out] = graph.leaf_fingerprint(
+                    out, memo=self.memo)
+            out_fps.append(self.fingerprints[out])
+        return graph.combine_fingerprints(
+            [self.fingerprints[r] for r in fgraph.inputs], out_fps,
+            self.apply_sum)
+
+
 class PrintListener(Feature):
 
     def __init__(self, active=True):
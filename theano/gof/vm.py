@@ -7,10 +7,13 @@ VM was a better name at some point.
 """
 from __future__ import absolute_import, print_function, division
 
+from . import cc
 from . import link
+from . import memplan
 from collections import defaultdict
 import logging
 import sys
+import threading
 import time
 import warnings
 
@@ -19,7 +22,7 @@ from theano.configparser import (config, _config_var_list)
 import theano.gof.cmodule
 
 from six import iteritems, itervalues
-from six.moves import xrange
+from six.moves import queue, xrange
 
 logger = logging.getLogger(__name__)
 
@@ -113,6 +116,71 @@ def calculate_reallocate_info(order, fgraph, storage_map, compute_map_re,
     return reallocated_info
 
 
+def calculate_parallel_dependencies(order, fgraph):
+    """
+    Return the indices of the nodes each node must wait for.
+
+    Parameters
+    ----------
+    order
+        A list of nodes in toposort order.
+    fgraph
+        The FunctionGraph the nodes belong to.
+
+    Returns
+    -------
+    list of sets
+        The i-th set contains the indices in `order` of the nodes that must
+        have finished before `order[i]` can start. Besides the owners of the
+        inputs, it contains the prerequisites from `fgraph.orderings()`, which
+        is where the DestroyHandler puts the constraints induced by
+        destroy_map and view_map.
+
+    Notes
+    -----
+    When the fgraph has no DestroyHandler, nothing orders a node that destroys
+    an input with respect to the other readers of that memory. In that case
+    we order them as in `order`, so that running the nodes concurrently
+    computes the same values as running them sequentially.
+
+    """
+    node_idx = dict((node, i) for i, node in enumerate(order))
+    predecessors = [set() for node in order]
+    ords = fgraph.orderings()
+    for i, node in enumerate(order):
+        for inp in node.inputs:
+            if inp.owner in node_idx:
+                predecessors[i].add(node_idx[inp.owner])
+        for prereq in ords.get(node, []):
+            if prereq in node_idx:
+                predecessors[i].add(node_idx[prereq])
+
+    if not hasattr(fgraph, 'destroyers'):
+        # Map each view (or destroyed output) to the variable owning the
+        # memory it uses.
+        view_of = {}
+        for node in order:
+            for op_map in (getattr(node.op, 'view_map', {}),
+                           getattr(node.op, 'destroy_map', {})):
+                for o, i_list in iteritems(op_map):
+                    inp = node.inputs[i_list[0]]
+                    view_of[node.outputs[o]] = view_of.get(inp, inp)
+        readers = defaultdict(set)
+        for i, node in enumerate(order):
+            for inp in node.inputs:
+                readers[view_of.get(inp, inp)].add(i)
+        for i, node in enumerate(order):
+            for i_list in itervalues(getattr(node.op, 'destroy_map', {})):
+                for j in i_list:
+                    inp = node.inputs[j]
+                    for r in readers[view_of.get(inp, inp)]:
+                        if r < i:
+                            predecessors[i].add(r)
+                        elif r > i:
+                            predecessors[r].add(i)
+    return predecessors
+
+
 class VM(object):
     """
     A VM object's __call__ method evaluates a Theano program.
@@ -304,6 +372,226 @@ class LoopGC(VM):
                 link.raise_with_op(node, thunk)
 
 
+def _parallel_loop_worker(tasks, done):
+    """
+    Body of the threads used by ParallelLoop.
+
+    It only holds references to the queues, so that the VM can be garbage
+    collected while its threads wait for work.
+
+    """
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        idx, thunk, time_thunk = task
+        try:
+            if time_thunk:
+                t0 = time.time()
+                thunk()
+                dt = time.time() - t0
+            else:
+                thunk()
+                dt = 0
+            done.put((idx, dt, None))
+        except BaseException:
+            done.put((idx, 0, sys.exc_info()))
+
+
+class ParallelLoop(VM):
+    """
+    Unconditional program execution that runs independent nodes concurrently.
+
+    A node is handed to a pool of worker threads as soon as all the nodes it
+    depends on have finished (see `calculate_parallel_dependencies`). All the
+    scheduling and garbage collection bookkeeping is done by the calling
+    thread, the workers only run thunks.
+
+    Python thunks hold the GIL most of the time, so the speed up comes from
+    the thunks that release it while they compute, like NumPy functions and
+    the C code of the BLAS ops. Lazy thunks are not supported.
+
+    Parameters
+    ----------
+    nodes
+        A list of nodes in toposort order.
+    thunks
+        A list of thunks to execute those nodes, in toposort order.
+    pre_call_clear
+        A list of containers to empty at the beginning of each call.
+    storage_map
+        Map from each variable of the graph to its storage.
+    fgraph
+        The FunctionGraph the nodes belong to.
+    allow_gc
+        If True, the storage of intermediate results is released as soon as
+        all the nodes using it have finished.
+    n_threads
+        Number of worker threads.
+    n_updates
+        Number of outputs of the fgraph that are update expressions. They are
+        always computed, even when an output_subset is given.
+
+    """
+
+    def __init__(self, nodes, thunks, pre_call_clear, storage_map, fgraph,
+                 allow_gc, n_threads, n_updates=0):
+        super(ParallelLoop, self).__init__(nodes, thunks, pre_call_clear)
+        if any(th.lazy for th in thunks):
+            raise ValueError("ParallelLoop does not support lazy thunks")
+        self.allow_gc = allow_gc
+        self.n_threads = n_threads
+        self.outputs = fgraph.outputs
+        self.n_updates = n_updates
+        self.node_idx = dict((node, i) for i, node in enumerate(nodes))
+
+        self.predecessors = calculate_parallel_dependencies(nodes, fgraph)
+        self.successors = [[] for node in nodes]
+        for i, preds in enumerate(self.predecessors):
+            for j in sorted(preds):
+                self.successors[j].append(i)
+
+        # For the gc, we count the nodes that still have to read each
+        # intermediate result. The last of them clears the storage.
+        self.gc_storage = []
+        self.node_gc_inputs = [[] for node in nodes]
+        if allow_gc:
+            gc_idx = {}
+            outputs = set(fgraph.outputs)
+            for i, node in enumerate(nodes):
+                for inp in set(node.inputs):
+                    if inp.owner is None or inp in outputs:
+                        continue
+                    if inp not in gc_idx:
+                        gc_idx[inp] = len(self.gc_storage)
+                        self.gc_storage.append(storage_map[inp])
+                    self.node_gc_inputs[i].append(gc_idx[inp])
+
+        self._tasks = None
+        self._done = None
+        self._schedules = {None: self._make_schedule(range(len(nodes)))}
+
+    def _make_schedule(self, needed):
+        """
+        Return the initial counters of a call that runs the nodes `needed`.
+
+        The first list holds the number of predecessors each node waits for,
+        or -1 for the nodes that must not run (the counter then never reaches
+        0). The second list holds, for each intermediate result, the number of
+        nodes that will read it.
+
+        """
+        needed = set(needed)
+        n_waiting = [-1] * len(self.nodes)
+        n_readers = [0] * len(self.gc_storage)
+        for i in needed:
+            n_waiting[i] = len(self.predecessors[i] & needed)
+            for j in self.node_gc_inputs[i]:
+                n_readers[j] += 1
+        return n_waiting, n_readers
+
+    def _get_schedule(self, output_subset):
+        if output_subset is None:
+            return self._schedules[None]
+        first_updated = len(self.outputs) - self.n_updates
+        key = tuple(sorted(set(output_subset))) + tuple(
+            range(first_updated, len(self.outputs)))
+        if key not in self._schedules:
+            needed = set()
+            todo = [self.outputs[i].owner for i in key
+                    if self.outputs[i].owner in self.node_idx]
+            while todo:
+                idx = self.node_idx[todo.pop()]
+                if idx not in needed:
+                    needed.add(idx)
+                    todo.extend(self.nodes[j] for j in self.predecessors[idx])
+            self._schedules[key] = self._make_schedule(needed)
+        return self._schedules[key]
+
+    def _start_workers(self):
+        self._tasks = queue.Queue()
+        self._done = queue.Queue()
+        for i in xrange(self.n_threads):
+            worker = threading.Thread(target=_parallel_loop_worker,
+                                      args=(self._tasks, self._done))
+            worker.daemon = True
+            worker.start()
+
+    def __del__(self):
+        if getattr(self, '_tasks', None) is not None:
+            for i in xrange(self.n_threads):
+                self._tasks.put(None)
+
+    def __call__(self, output_subset=None):
+        if self._tasks is None:
+            self._start_workers()
+        tasks = self._tasks
+        done = self._done
+        thunks = self.thunks
+        successors = self.successors
+        node_gc_inputs = self.node_gc_inputs
+        gc_storage = self.gc_storage
+        time_thunks = self.time_thunks
+
+        for cont in self.pre_call_clear:
+            cont[0] = None
+
+        n_waiting, n_readers = self._get_schedule(output_subset)
+        n_waiting = list(n_waiting)
+        n_readers = list(n_readers)
+        ready = [i for i, n in enumerate(n_waiting) if n == 0]
+        n_running = 0
+        failure = None
+        while True:
+            if failure is None:
+                if len(ready) == 1 and n_running == 0:
+                    # Nothing can run concurrently, so we skip the round
+                    # trip to a worker thread.
+                    idx = ready.pop()
+                    try:
+                        t0 = time.time()
+                        thunks[idx]()
+                        result = (idx, time.time() - t0, None)
+                    except Exception:
+                        result = (idx, 0, sys.exc_info())
+                else:
+                    for idx in ready:
+                        tasks.put((idx, thunks[idx], time_thunks))
+                    n_running += len(ready)
+                    ready = []
+                    if n_running == 0:
+                        break
+                    result = done.get()
+                    n_running -= 1
+            elif n_running:
+                result = done.get()
+                n_running -= 1
+            else:
+                break
+
+            idx, dt, exc_info = result
+            if exc_info is not None:
+                if failure is None:
+                    failure = result
+                continue
+            if time_thunks:
+                self.call_counts[idx] += 1
+                self.call_times[idx] += dt
+            for succ in successors[idx]:
+                n_waiting[succ] -= 1
+                if n_waiting[succ] == 0:
+                    ready.append(succ)
+            for i in node_gc_inputs[idx]:
+                n_readers[i] -= 1
+                if n_readers[i] == 0:
+                    gc_storage[i][0] = None
+
+        if failure is not None:
+            idx, dt, exc_info = failure
+            link.raise_with_op(self.nodes[idx], thunks[idx],
+                               exc_info=exc_info)
+
+
 class Stack(VM):
     """
     Finish-to-start evalution order of thunks.
@@ -723,12 +1011,23 @@ class VM_Linker(link.LocalLinker):
     allow_partial_eval
         If True, enforces usage of Stack or CVM, to allow for partial
         evaluation of functions (calculating a subset of outputs).
+    n_threads
+        Number of threads used to execute independent nodes concurrently.
+        If None, use the Theano flag vm.n_threads. When larger than 1, the
+        ParallelLoop VM is used instead of CVM, Loop and LoopGC, unless the
+        graph needs lazy evaluation, callbacks or memory profiling.
+    memory_planner
+        If True, place the intermediate results in one preallocated arena
+        per signature of the input shapes, see `theano.gof.memplan`. If
+        None, use the Theano flag vm.memory_planner. Only used when
+        allow_gc is False and the nodes are executed one at a time.
 
     """
 
     def __init__(self, allow_gc=None, use_cloop=False, callback=None,
                  callback_input=None, lazy=None, schedule=None,
-                 c_thunks=None, allow_partial_eval=None):
+                 c_thunks=None, allow_partial_eval=None, n_threads=None,
+                 memory_planner=None):
         # Note: if more parameters are added to __init__, make sure to forward
         # them in the "type(self)(...)" call in the "accept" method below.
         if allow_gc is None:
@@ -743,6 +1042,8 @@ class VM_Linker(link.LocalLinker):
             c_thunks = bool(theano.config.cxx)
         self.c_thunks = c_thunks
         self.allow_partial_eval = allow_partial_eval
+        self.n_threads = n_threads
+        self.memory_planner = memory_planner
         self.updated_vars = {}
         if schedule:
             self.schedule = schedule
@@ -805,7 +1106,9 @@ class VM_Linker(link.LocalLinker):
                 lazy=self.lazy,
                 schedule=self.schedule,
                 c_thunks=self.c_thunks,
-                allow_partial_eval=self.allow_partial_eval
+                allow_partial_eval=self.allow_partial_eval,
+                n_threads=self.n_threads,
+                memory_planner=self.memory_planner
             ).accept(fgraph, no_recycling, profile)
         self.fgraph = fgraph
         self.no_recycling = no_recycling
@@ -864,6 +1167,49 @@ class VM_Linker(link.LocalLinker):
                 dependencies[k] += ls
         return dependencies
 
+    def get_n_threads(self):
+        """
+        Return the number of threads the VM will use.
+
+        """
+        if self.n_threads is None:
+            return config.vm.n_threads
+        return self.n_threads
+
+    def use_parallel_loop(self, thunks):
+        """
+        Return True if make_vm will build a ParallelLoop for `thunks`.
+
+        """
+        lazy = self.lazy
+        if lazy is None:
+            lazy = config.vm.lazy
+        return (self.get_n_threads() > 1 and
+                not lazy and
+                not any(th.lazy for th in thunks) and
+                self.callback is None and
+                self.callback_input is None and
+                not ((config.profile or config.print_global_stats) and
+                     config.profile_memory))
+
+    def use_memory_planner(self, thunks):
+        """
+        Return True if make_all will plan the memory of the intermediates.
+
+        """
+        memory_planner = self.memory_planner
+        if memory_planner is None:
+            memory_planner = config.vm.memory_planner
+        # The lazy VMs do not run the nodes in the planned order.
+        lazy = self.lazy
+        if lazy is None:
+            lazy = config.vm.lazy
+        return (memory_planner and
+                not self.allow_gc and
+                not lazy and
+                not any(th.lazy for th in thunks) and
+                not self.use_parallel_loop(thunks))
+
     def make_vm(self, nodes, thunks,
                 input_storage, output_storage, storage_map,
                 post_thunk_clear,
@@ -874,7 +1220,12 @@ class VM_Linker(link.LocalLinker):
 
         pre_call_clear = [storage_map[v] for v in self.no_recycling]
 
-        if (self.callback is not None or self.callback_input is not None or
+        if self.use_parallel_loop(thunks):
+            vm = ParallelLoop(
+                nodes, thunks, pre_call_clear,
+                storage_map, self.fgraph, self.allow_gc,
+                self.get_n_threads(), len(updated_vars))
+        elif (self.callback is not None or self.callback_input is not None or
                 ((config.profile or config.print_global_stats) and config.profile_memory) or
                 (self.allow_partial_eval and not self.use_cloop)):
 
@@ -1007,6 +1358,9 @@ class VM_Linker(link.LocalLinker):
                 dependencies=dependency_map_list,
             )
             assert c0 == sys.getrefcount(node_n_inputs)
+            # The C code keeps a reference to the same list, so changes to
+            # it made through this attribute are seen by the C loop.
+            vm.pre_call_clear = pre_call_clear
         else:
             lazy = self.lazy
             if lazy is None:
@@ -1071,6 +1425,8 @@ class VM_Linker(link.LocalLinker):
         impl = None
         if self.c_thunks is False:
             impl = 'py'
+        else:
+            cc.precompile_cmodules(order, storage_map, compute_map, [])
         for node in order:
             try:
                 thunk_start = time.time()
@@ -1108,7 +1464,8 @@ class VM_Linker(link.LocalLinker):
         if lazy is None:
             lazy = not all([(not th.lazy) for th in thunks])
         if not (lazy or ((config.profile or config.print_global_stats) and config.profile_memory) or
-                self.use_cloop or self.callback or self.callback_input):
+                self.use_cloop or self.callback or self.callback_input or
+                self.use_parallel_loop(thunks)):
             for pair in itervalues(reallocated_info):
                 storage_map[pair[1]] = storage_map[pair[0]]
 
@@ -1137,6 +1494,8 @@ class VM_Linker(link.LocalLinker):
 
         vm.storage_map = storage_map
         vm.compute_map = compute_map
+        if self.use_memory_planner(thunks):
+            vm = memplan.MemoryPlannedVM(vm, order, fgraph, storage_map)
 
         return (vm,
                 [link.Container(input, storage)
@@ -1154,3 +1513,7 @@ class VM_Linker(link.LocalLinker):
             self.allow_partial_eval = None
         if not hasattr(self, 'callback_input'):
             self.callback_input = None
+        if not hasattr(self, 'n_threads'):
+            self.n_threads = None
+        if not hasattr(self, 'memory_planner'):
+            self.memory_planner = None
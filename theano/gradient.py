@@ -362,7 +362,7 @@ def Lop(f, wrt, eval_points, consider_constant=None,
 def grad(cost, wrt, consider_constant=None,
          disconnected_inputs='raise', add_names=True,
          known_grads=None, return_disconnected='zero',
-         null_gradients='raise'):
+         null_gradients='raise', checkpoints=None):
     """
     Return symbolic gradients for one or more variables with respect to some
     cost.
@@ -408,6 +408,21 @@ def grad(cost, wrt, consider_constant=None,
 
         - 'raise' : raise a NullTypeGradError exception
         - 'return' : return the null gradients
+    checkpoints : {None, 'sqrt'}, number or list of variables, optional
+        Trade computation for memory by recomputing the forward graph
+        in the backward pass (rematerialization). The forward graph is
+        split into segments. Only the variables passed from one segment to
+        the next (the checkpoints) are kept for the backward pass. The
+        gradient of each segment is computed by an :class:`OpFromGraph`
+        that recomputes its intermediate values from its inputs, so the
+        optimizer does not merge them back with the forward graph.
+
+        - None : do not recompute anything (default)
+        - 'sqrt' : about sqrt(n) segments of sqrt(n) nodes each
+        - a number : a memory budget in bytes, a segment ends once the
+          estimated size of its intermediate values exceeds it
+          (see :func:`theano.gof.sched.estimate_nbytes`)
+        - a list of variables : end a segment after each of them
 
     Returns
     -------
@@ -550,8 +565,13 @@ def grad(cost, wrt, consider_constant=None,
         if hasattr(g.type, 'dtype'):
             assert g.type.dtype in tensor.float_dtypes
 
-    rval = _populate_grad_dict(var_to_app_to_idx,
-                               grad_dict, wrt, cost_name)
+    if checkpoints is None:
+        rval = _populate_grad_dict(var_to_app_to_idx,
+                                   grad_dict, wrt, cost_name)
+    else:
+        rval = _populate_grad_dict_checkpointed(
+            outputs, grad_dict, wrt, consider_constant, checkpoints,
+            cost_name)
 
     for i in xrange(len(rval)):
         if isinstance(rval[i].type, NullType):
@@ -1318,6 +1338,134 @@ def _populate_grad_dict(var_to_app_to_idx,
     return rval
 
 
+def _checkpoint_segments(nodes, checkpoints, cuts):
+    """
+    Helper function for _populate_grad_dict_checkpointed.
+
+    Split `nodes`, in topological order, into segments of consecutive
+    nodes according to `checkpoints` (see grad). A segment always ends
+    after a node computing one of the variables in `cuts`.
+
+    """
+    if checkpoints == 'sqrt':
+        size = max(1, int(np.ceil(np.sqrt(len(nodes)))))
+
+        def ends(node, segment):
+            return len(segment) >= size
+    elif isinstance(checkpoints, (list, tuple)):
+        cuts = set(cuts).union(checkpoints)
+
+        def ends(node, segment):
+            return False
+    elif isinstance(checkpoints, (int, float)) and checkpoints > 0:
+        from theano.gof.sched import estimate_nbytes
+
+        def ends(node, segment):
+            return sum(estimate_nbytes(out) for n in segment
+                       for out in n.outputs) > checkpoints
+    else:
+        raise ValueError("Invalid value for keyword 'checkpoints', valid "
+                         "values are None, 'sqrt', a positive number or "
+                         "a list of variables, got %s." % str(checkpoints))
+
+    segments = [[]]
+    for node in nodes:
+        segments[-1].append(node)
+        if (ends(node, segments[-1]) or
+                any(out in cuts for out in node.outputs)):
+            segments.append([])
+    return [segment for segment in segments if segment]
+
+
+def _populate_grad_dict_checkpointed(outputs, grad_dict, wrt,
+                                     consider_constant, checkpoints,
+                                     cost_name=None):
+    """
+        Helper function for grad function, used instead of
+        _populate_grad_dict when checkpoints is not None.
+
+        The graph computing `outputs` is split into segments with
+        _checkpoint_segments. The segments are visited from the last to the
+        first. For each segment, the gradient with respect to its inputs is
+        computed from the gradient on its outputs through an OpFromGraph
+        of the segment, whose gradient recomputes the segment.
+
+        returns: a list of gradients corresponding to wrt
+
+    """
+    from theano.compile.builders import OpFromGraph
+
+    if consider_constant is None:
+        consider_constant = []
+    blocked = set(consider_constant)
+    # The gradient of those variables must be read or set between segments
+    cuts = set(wrt).union(blocked).union(grad_dict)
+    nodes = gof.graph.io_toposort(gof.graph.inputs(outputs), outputs)
+    segments = _checkpoint_segments(nodes, checkpoints, cuts)
+
+    # Variables used by each segment
+    used_after = set(outputs).union(cuts)
+    seg_io = []
+    for segment in reversed(segments):
+        computed = set(out for node in segment for out in node.outputs)
+        seg_inputs = []
+        for node in segment:
+            for inp in node.inputs:
+                if (inp not in computed and inp not in seg_inputs and
+                        not isinstance(inp, gof.Constant)):
+                    seg_inputs.append(inp)
+        seg_outputs = [out for node in segment for out in node.outputs
+                       if out in used_after]
+        used_after.update(seg_inputs)
+        seg_io.append((seg_inputs, seg_outputs))
+
+    grads = OrderedDict((var, g) for var, g in grad_dict.items()
+                        if not isinstance(g.type, DisconnectedType))
+
+    def accumulate(var, g):
+        if isinstance(g.type, DisconnectedType):
+            return
+        if var not in grads or isinstance(g.type, NullType):
+            grads[var] = g
+        elif not isinstance(grads[var].type, NullType):
+            grads[var] = grads[var] + g
+
+    for seg_inputs, seg_outputs in seg_io:
+        known = [(out, grads[out]) for out in seg_outputs
+                 if out in grads and out not in blocked]
+        if not known or not seg_inputs:
+            continue
+        null_grads = [g for out, g in known if isinstance(g.type, NullType)]
+        if null_grads:
+            for inp in seg_inputs:
+                accumulate(inp, null_grads[0])
+            continue
+        local_inputs = [inp.type() for inp in seg_inputs]
+        local_outputs = theano.clone(
+            [out for out, g in known],
+            replace=OrderedDict(izip(seg_inputs, local_inputs)))
+        op = OpFromGraph(local_inputs, local_outputs,
+                         name='checkpoint_segment')
+        new_outputs = op(*seg_inputs, return_list=True)
+        seg_grads = grad(
+            cost=None, wrt=seg_inputs,
+            known_grads=OrderedDict(izip(new_outputs,
+                                         [g for out, g in known])),
+            disconnected_inputs='ignore',
+            return_disconnected='Disconnected',
+            null_gradients='return')
+        for inp, g in izip(seg_inputs, seg_grads):
+            accumulate(inp, g)
+
+    rval = []
+    for var in wrt:
+        g = grads.get(var, grad_dict.get(var, disconnected_type()))
+        if cost_name is not None and var.name is not None:
+            g.name = '(d%s/d%s)' % (cost_name, var.name)
+        rval.append(g)
+    return rval
+
+
 def _float_zeros_like(x):
     """ Like zeros_like, but forces the object to have a
     a floating point dtype """
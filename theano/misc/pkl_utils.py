@@ -5,6 +5,7 @@ These pickled graphs can be used, for instance, as cases for
 unit tests or regression tests.
 """
 from __future__ import absolute_import, print_function, division
+import mmap
 import numpy as np
 import os
 import pickle
@@ -187,6 +188,21 @@ class PersistentNdarrayID(object):
         return name
 
     def __call__(self, obj):
+        if type(obj) is np.memmap and isinstance(obj.base, mmap.mmap):
+            # Save where the array is mapped from, not its content.
+            if id(obj) not in self.seen:
+                mode = 'r+' if obj.mode == 'w+' else obj.mode
+                order = 'C' if obj.flags.c_contiguous else 'F'
+
+                def write_memmap(f):
+                    pickle.dump(dict(filename=obj.filename,
+                                     dtype=obj.dtype.str, mode=mode,
+                                     offset=obj.offset, shape=obj.shape,
+                                     order=order), f, 2)
+                name = self._resolve_name(obj)
+                zipadd(write_memmap, self.zip_file, name)
+                self.seen[id(obj)] = 'memmap.{0}'.format(name)
+            return self.seen[id(obj)]
         if type(obj) is np.ndarray:
             if id(obj) not in self.seen:
                 def write_array(f):
@@ -286,7 +302,7 @@ class PersistentNdarrayLoad(object):
     def __call__(self, persid):
         from theano.gpuarray.type import get_context
         from theano.gpuarray import pygpu
-        array_type, name = persid.split('.')
+        array_type, name = persid.split('.', 1)
 
         if name in self.cache:
             return self.cache[name]
@@ -304,6 +320,9 @@ class PersistentNdarrayLoad(object):
                 ret = pygpu.array(array, context=get_context(ctx_name))
             else:
                 raise ImportError("pygpu not found. Cannot unpickle GpuArray")
+        elif array_type == 'memmap':
+            with self.zip_file.open(name) as f:
+                ret = np.memmap(**pickle.load(f))
         else:
             with self.zip_file.open(name) as f:
                 ret = np.lib.format.read_array(f)
@@ -403,3 +422,236 @@ def zipadd(func, zip_file, name):
         zip_file.write(temp_file.name, arcname=name)
     if os.path.isfile(temp_file.name):
         os.remove(temp_file.name)
+
+
+# Checkpoint format: a header, the data of the arrays, each at an offset
+# multiple of CHECKPOINT_ALIGNMENT, then the index. The header is the magic
+# string followed by the offset of the index, as a little-endian uint64.
+CHECKPOINT_MAGIC = b'THEANOCK'
+CHECKPOINT_ALIGNMENT = 64
+
+
+class CheckpointWriter(object):
+    """Write the data section of a checkpoint file.
+
+    :param f: The file handle of the checkpoint, opened in binary mode and
+        positioned after the header.
+    :type f: file
+
+    """
+    def __init__(self, f):
+        self.f = f
+        self.arrays = {}
+
+    def add(self, name, array):
+        """Write `array` in the data section and index it under `name`."""
+        offset = self.f.tell()
+        padding = -offset % CHECKPOINT_ALIGNMENT
+        self.f.write(b'\0' * padding)
+        offset += padding
+        if array.flags.f_contiguous and not array.flags.c_contiguous:
+            order = 'F'
+            data = array.T
+        else:
+            order = 'C'
+            data = array
+        # Write one sub-array of the first axis at a time, to avoid copying
+        # non-contiguous arrays at once.
+        if data.ndim > 1 and not data.flags.c_contiguous:
+            for sub in data:
+                self.f.write(np.ascontiguousarray(sub).data)
+        elif data.size:
+            self.f.write(np.ascontiguousarray(data).data)
+        self.arrays[name] = (offset, array.dtype.str, array.shape, order)
+
+
+class PersistentCheckpointID(PersistentSharedVariableID):
+    """Persist ndarrays in the data section of a checkpoint file.
+
+    The names are the ones of :class:`PersistentSharedVariableID`. Arrays of
+    objects are pickled as usual.
+
+    :param writer: The writer of the data section.
+    :type writer: :class:`CheckpointWriter`
+
+    """
+    def __init__(self, writer, allow_unnamed=True, allow_duplicates=True):
+        super(PersistentCheckpointID, self).__init__(
+            writer, allow_unnamed, allow_duplicates)
+        self.writer = writer
+
+    def __call__(self, obj):
+        if isinstance(obj, SharedVariable):
+            return super(PersistentCheckpointID, self).__call__(obj)
+        if (type(obj) in (np.ndarray, np.memmap) and
+                not obj.dtype.hasobject):
+            if id(obj) not in self.seen:
+                name = self._resolve_name(obj)
+                self.writer.add(name, obj)
+                self.seen[id(obj)] = 'checkpoint.{0}'.format(name)
+            return self.seen[id(obj)]
+
+
+class PersistentCheckpointLoad(object):
+    """Load the NumPy arrays of a checkpoint file when unpickling.
+
+    :param filename: The path of the checkpoint file.
+    :type filename: str
+
+    :param arrays: The index of the arrays of the checkpoint.
+    :type arrays: dict
+
+    :param mmap_mode: See :func:`load_checkpoint`.
+    :type mmap_mode: {'r', 'r+', 'c', None}
+
+    """
+    def __init__(self, filename, arrays, mmap_mode='r'):
+        self.filename = filename
+        self.arrays = arrays
+        self.mmap_mode = mmap_mode
+        self.cache = {}
+
+    def __call__(self, persid):
+        array_type, name = persid.split('.', 1)
+        if array_type != 'checkpoint':
+            raise pickle.UnpicklingError(
+                'unsupported persistent id {0}'.format(persid))
+        if name not in self.cache:
+            self.cache[name] = self.load_array(name)
+        return self.cache[name]
+
+    def load_array(self, name):
+        """Map or read the array saved under `name`."""
+        offset, dtype, shape, order = self.arrays[name]
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape))
+        if not size:
+            return np.empty(shape, dtype=dtype, order=order)
+        if self.mmap_mode is not None:
+            return np.memmap(self.filename, dtype=dtype, mode=self.mmap_mode,
+                             offset=offset, shape=shape, order=order)
+        with open(self.filename, 'rb') as f:
+            f.seek(offset)
+            data = np.fromfile(f, dtype=dtype, count=size)
+        if order == 'F':
+            return data.reshape(shape[::-1]).T
+        return data.reshape(shape)
+
+
+def dump_checkpoint(obj, filename, protocol=DEFAULT_PROTOCOL,
+                    persistent_id=PersistentCheckpointID):
+    """Pickles an object to a checkpoint file with uncompressed arrays.
+
+    Unlike :func:`dump`, the arrays are stored uncompressed, each at an
+    offset aligned to 64 bytes, followed by an index of their names and
+    positions and the pickle of `obj`. :func:`load_checkpoint` can then map
+    them in memory without reading them, and :func:`load_checkpoint_array`
+    can load one of them without touching the others.
+
+    :param obj: The object to pickle.
+    :type obj: object
+
+    :param filename: The path of the checkpoint file to write.
+    :type filename: str
+
+    :param protocol: The pickling protocol to use.
+    :type protocol: int, optional
+
+    :param persistent_id: The callable that saves arrays in the data section
+        of the file, see :class:`PersistentCheckpointID`.
+    :type persistent_id: callable
+
+    >>> import theano
+    >>> foo = theano.shared(np.zeros((1000, 1000)), name='foo')
+    >>> dump_checkpoint(foo, 'model.ckpt')
+    >>> foo = load_checkpoint('model.ckpt')
+    >>> isinstance(foo.get_value(borrow=True), np.memmap)
+    True
+    >>> load_checkpoint_array('model.ckpt', 'foo').shape
+    (1000, 1000)
+
+    """
+    # The arrays of `obj` can be memory maps of `filename`, loaded by
+    # load_checkpoint. So we write to another file and rename it.
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(CHECKPOINT_MAGIC + b'\0' * 8)
+            writer = CheckpointWriter(f)
+            pkl = BytesIO()
+            p = pickle.Pickler(pkl, protocol=protocol)
+            p.persistent_id = persistent_id(writer)
+            p.dump(obj)
+            index_offset = f.tell()
+            pickle.dump(dict(version=1, arrays=writer.arrays,
+                             pkl=pkl.getvalue()), f, protocol)
+            f.seek(len(CHECKPOINT_MAGIC))
+            f.write(np.array(index_offset, dtype='<u8').tobytes())
+        # mkstemp creates the file readable only by the user.
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o666 & ~umask)
+        if os.name == 'nt' and os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tmp_path, filename)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _read_checkpoint_index(filename):
+    with open(filename, 'rb') as f:
+        if f.read(len(CHECKPOINT_MAGIC)) != CHECKPOINT_MAGIC:
+            raise ValueError('{0} is not a checkpoint file'.format(filename))
+        index_offset = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+        f.seek(index_offset)
+        return pickle.load(f)
+
+
+def load_checkpoint(filename, mmap_mode='r',
+                    persistent_load=PersistentCheckpointLoad):
+    """Load an object saved with :func:`dump_checkpoint`.
+
+    :param filename: The path of the checkpoint file.
+    :type filename: str
+
+    :param mmap_mode: With 'r' (the default), 'r+' or 'c', the arrays are
+        :class:`numpy.memmap` of the file opened in that mode, so only the
+        parts that are used are read, when they are first accessed. With
+        None, each array is read in memory.
+    :type mmap_mode: {'r', 'r+', 'c', None}, optional
+
+    :param persistent_load: The persistent loading function to use for
+        unpickling.
+    :type persistent_load: callable, optional
+
+    """
+    index = _read_checkpoint_index(filename)
+    p = pickle.Unpickler(BytesIO(index['pkl']))
+    p.persistent_load = persistent_load(filename, index['arrays'], mmap_mode)
+    return p.load()
+
+
+def load_checkpoint_array(filename, name, mmap_mode='r'):
+    """Load the array saved under `name` in a checkpoint file.
+
+    Only the index of the file and the array itself are read.
+
+    :param filename: The path of the checkpoint file.
+    :type filename: str
+
+    :param name: The name of the array, e.g. the name of its shared variable.
+    :type name: str
+
+    :param mmap_mode: See :func:`load_checkpoint`.
+    :type mmap_mode: {'r', 'r+', 'c', None}, optional
+
+    """
+    arrays = _read_checkpoint_index(filename)['arrays']
+    if name not in arrays:
+        raise KeyError('no array named {0} in {1}, the arrays are: {2}'.format(
+            name, filename, ', '.join(sorted(arrays))))
+    return PersistentCheckpointLoad(filename, arrays,
+                                    mmap_mode).load_array(name)
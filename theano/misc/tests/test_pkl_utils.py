@@ -1,7 +1,9 @@
 from __future__ import absolute_import, print_function, division
 import os
+import pickle
 import shutil
 import unittest
+import zipfile
 from tempfile import mkdtemp
 
 import numpy as np
@@ -9,7 +11,8 @@ import numpy as np
 import theano
 
 from theano.sandbox.rng_mrg import MRG_RandomStreams
-from theano.misc.pkl_utils import dump, load, StripPickler
+from theano.misc.pkl_utils import (dump, load, StripPickler, dump_checkpoint,
+                                   load_checkpoint, load_checkpoint_array)
 
 
 class T_dump_load(unittest.TestCase):
@@ -50,6 +53,64 @@ class T_dump_load(unittest.TestCase):
             foo_1, foo_2, foo_3, array = load(f)
         assert array == np.array(3)
 
+    def test_dump_load_memmap(self):
+        np.save('emb.npy', np.arange(12.).reshape(3, 4))
+        emb = theano.shared('emb.npy', name='emb')
+        with open('model.zip', 'wb') as f:
+            dump(emb, f)
+        with open('model.zip', 'rb') as f:
+            emb_2 = load(f)
+        value = emb_2.get_value(borrow=True)
+        assert isinstance(value, np.memmap)
+        assert value.filename == os.path.abspath('emb.npy')
+        assert not value.flags.writeable
+        assert np.all(value == np.arange(12.).reshape(3, 4))
+        # Only the reference to the file was saved.
+        with zipfile.ZipFile('model.zip') as zip_file:
+            names = [n for n in zip_file.namelist() if n != 'pkl']
+            assert len(names) == 1
+            ref = pickle.loads(zip_file.read(names[0]))
+        assert ref['filename'] == os.path.abspath('emb.npy')
+        assert ref['shape'] == (3, 4)
+        del value, emb, emb_2
+
+    def test_dump_load_checkpoint(self):
+        w = theano.shared(np.arange(12.).reshape(3, 4), name='w')
+        b = theano.shared(np.asfortranarray(np.ones((2, 3), dtype='int8')),
+                          name='b')
+        arrays = [np.arange(5), np.zeros((0, 2)), np.array(3.)]
+        dump_checkpoint((w, b, arrays, w), 'model.ckpt')
+
+        w_2, b_2, arrays_2, w_3 = load_checkpoint('model.ckpt')
+        assert w_3 is w_2
+        value = w_2.get_value(borrow=True)
+        assert isinstance(value, np.memmap) and not value.flags.writeable
+        assert value.ctypes.data % 64 == 0
+        assert np.all(value == w.get_value())
+        assert b_2.get_value(borrow=True).flags.f_contiguous
+        assert np.all(b_2.get_value() == 1)
+        for a, a_2 in zip(arrays, arrays_2):
+            assert a.shape == a_2.shape and np.all(a == a_2)
+
+        w_2, b_2, arrays_2, w_3 = load_checkpoint('model.ckpt',
+                                                  mmap_mode=None)
+        assert not isinstance(w_2.get_value(borrow=True), np.memmap)
+        assert np.all(b_2.get_value() == 1)
+
+        value = load_checkpoint_array('model.ckpt', 'w')
+        assert np.all(value == w.get_value())
+        self.assertRaises(KeyError, load_checkpoint_array, 'model.ckpt', 'x')
+        del value, w_2, b_2, w_3
+
+        # Save to the file the arrays are mapped from.
+        w_2, b_2, arrays_2, w_3 = load_checkpoint('model.ckpt')
+        dump_checkpoint((w_2, b_2), 'model.ckpt')
+        w_3, b_3 = load_checkpoint('model.ckpt')
+        assert np.all(w_3.get_value() == w.get_value())
+        assert np.all(b_3.get_value() == 1)
+        assert os.listdir('.') == ['model.ckpt']
+        del w_2, b_2, w_3, b_3
+
 
 class TestStripPickler(unittest.TestCase):
     def setUp(self):
@@ -2257,7 +2257,8 @@ optdb.register('scan_eqopt1', scan_eqopt1, .05, 'fast_run', 'scan')
 # but after stabilize at 1.5. Should we put it before stabilize?
 optdb.register('scan_eqopt2', scan_eqopt2, 1.6, 'fast_run', 'scan')
 # ScanSaveMem should execute only once per node.
-optdb.register('scanOp_save_mem', ScanSaveMem(), 1.61, 'fast_run', 'scan')
+optdb.register('scanOp_save_mem', ScanSaveMem(), 1.61, 'fast_run', 'scan',
+               budget_priority=1)
 optdb.register('scanOp_make_inplace',
                ScanInplaceOptimizer(typeInfer=None),
                75,
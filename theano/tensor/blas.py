@@ -689,6 +689,10 @@ class GemmRelated(Op):
                 int Nz0 = Nz[0], Nz1 = Nz[1], Nx1 = Nx[1];
                 //std::cerr << (unit/256) MOD 16 << (unit / 16) MOD 16 << unit MOD 16<< '\\n';
                 //double t0 = time_time();
+                int bad_unit = 0;
+                // The BLAS call does not touch Python objects, so we let
+                // other threads run while it computes.
+                Py_BEGIN_ALLOW_THREADS
                 switch(unit)
                 {
                     case 0x000: sgemm_(&N, &N, &Nz1, &Nz0, &Nx1, &a, y, &sy_0, x, &sx_0, &b, z, &sz_0); break;
@@ -699,8 +703,13 @@ class GemmRelated(Op):
                     case 0x101: sgemm_(&N, &T, &Nz0, &Nz1, &Nx1, &a, x, &sx_1, y, &sy_0, &b, z, &sz_1); break;
                     case 0x011: sgemm_(&T, &N, &Nz0, &Nz1, &Nx1, &a, x, &sx_0, y, &sy_1, &b, z, &sz_1); break;
                     case 0x111: sgemm_(&N, &N, &Nz0, &Nz1, &Nx1, &a, x, &sx_1, y, &sy_1, &b, z, &sz_1); break;
-                    default: PyErr_SetString(PyExc_ValueError, "some matrix has no unit stride"); %(fail)s;
+                    default: bad_unit = 1;
                 };
+                Py_END_ALLOW_THREADS
+                if (bad_unit) {
+                    PyErr_SetString(PyExc_ValueError, "some matrix has no unit stride");
+                    %(fail)s;
+                }
                 //fprintf(stderr, "Calling sgemm %%i %%i %%i %%i took %%f\\n", unit, Nz1, Nz0, Nx1, time_time() - t0);
         """
 
@@ -728,6 +737,8 @@ class GemmRelated(Op):
                 //sx_0, sx_1,
                 //sz_0, sz_1
                 //);
+                int bad_unit = 0;
+                Py_BEGIN_ALLOW_THREADS
                 switch(unit)
                 {
                     case 0x000: dgemm_(&N, &N, &Nz1, &Nz0, &Nx1, &a, y,
@@ -746,10 +757,14 @@ class GemmRelated(Op):
                                        &sx_0, y, &sy_1, &b, z, &sz_1); break;
                     case 0x111: dgemm_(&N, &N, &Nz0, &Nz1, &Nx1, &a, x,
                                        &sx_1, y, &sy_1, &b, z, &sz_1); break;
-                    default: PyErr_SetString(PyExc_ValueError,
-                                             "some matrix has no unit stride");
-                             %(fail)s;
+                    default: bad_unit = 1;
                 };
+                Py_END_ALLOW_THREADS
+                if (bad_unit) {
+                    PyErr_SetString(PyExc_ValueError,
+                                    "some matrix has no unit stride");
+                    %(fail)s;
+                }
                 //fprintf(stderr, "Calling dgemm %%i %%i %%i %%i took %%f\\n",
                 //        unit, Nz1, Nz0, Nx1, time_time()- t0);
         """
@@ -787,7 +802,7 @@ class GemmRelated(Op):
             self.end_switch_typenum), '')
 
     def build_gemm_version(self):
-        return (13, blas_header_version())
+        return (14, blas_header_version())
 
 
 class Gemm(GemmRelated):
@@ -1760,7 +1775,7 @@ blas_optdb.register('local_dot_to_dot22',
                     0, 'fast_run', 'fast_compile')
 blas_optdb.register('gemm_optimizer',
                     GemmOptimizer(),
-                    10, 'fast_run')
+                    10, 'fast_run', budget_priority=0)
 blas_optdb.register('local_gemm_to_gemv',
                     EquilibriumOptimizer([local_gemm_to_gemv,
                                           local_gemm_to_ger,
@@ -1130,47 +1130,49 @@ second dimension
                     sub)
             except theano.gof.utils.MethodNotDefined:
                 # Try to make one generic version, this will help the
-                # compiler to vectorize the code as their won't be as
+                # compiler to vectorize the code as there won't be as
                 # many ptr and the stride will be hard coded.
-                if all([io.broadcastable == node.outputs[0].broadcastable or
-                        all(io.broadcastable)
-                        for io in node.inputs + node.outputs]):
-                    z = onames[0]
-                    contig = """
-                    // All output have the same size
-                    npy_intp n = PyArray_SIZE(%(z)s);
-                    """ % locals()
-                    index = ""
-                    for x, var in zip(inames + onames,
-                                      inputs + node.outputs):
-                        if not all(var.broadcastable):
-                            contig += """
-            dtype_%(x)s * %(x)s_ptr = (dtype_%(x)s*) PyArray_DATA(%(x)s);
-                            """ % locals()
-                            index += """
-            dtype_%(x)s& %(x)s_i = %(x)s_ptr[i];
-                            """ % locals()
-                        else:
-                            contig += """
-            dtype_%(x)s& %(x)s_i = ((dtype_%(x)s*) PyArray_DATA(%(x)s))[0];
-                            """ % locals()
-                    if self.openmp:
-                        contig += """#pragma omp parallel for if(n>=%d)
-                        """ % (config.openmp_elemwise_minsize)
-                    contig += """
-                    for(int i=0; i<n; i++){
-                        %(index)s
-                        %(task_code)s;
-                    }
-                    """ % locals()
+                contig = cgen.make_contiguous_loop(
+                    list(inames) + list(onames),
+                    [var.type.dtype_specs()[1]
+                     for var in inputs + node.outputs],
+                    [var.broadcastable for var in inputs + node.outputs],
+                    node.outputs[0].broadcastable,
+                    task_code, openmp=self.openmp,
+                    restrict=not self.inplace_pattern)
+            z = list(zip(inames + onames, inputs + node.outputs))
+            full = [arr for arr, var in z
+                    if var.broadcastable == node.outputs[0].broadcastable]
+            if (len(full) == len(z) and node.outputs[0].ndim == 2 and
+                    not any(node.outputs[0].broadcastable)):
+                # Operands transposed compared to the others are read by
+                # blocks instead of with a large stride.
+                cond = ' && '.join(["(PyArray_IS_C_CONTIGUOUS(%s) || "
+                                    "PyArray_IS_F_CONTIGUOUS(%s))" % (arr, arr)
+                                    for arr in full])
+                blocked = cgen.make_blocked_loop(
+                    full, [var.type.dtype_specs()[1] for arr, var in z],
+                    task_code, openmp=self.openmp)
+                loop = """
+            if(%(cond)s){
+                %(blocked)s
+            }else{
+                %(loop)s
+            }
+            """ % locals()
             if contig is not None:
-                z = list(zip(inames + onames, inputs + node.outputs))
                 cond1 = ' && '.join(["PyArray_ISCONTIGUOUS(%s)" % arr
                                     for arr, var in z
                                     if not all(var.broadcastable)])
                 cond2 = ' && '.join(["PyArray_ISFORTRAN(%s)" % arr
                                     for arr, var in z
                                     if not all(var.broadcastable)])
+                _, split = cgen.contiguous_split(
+                    [var.broadcastable for var in inputs + node.outputs],
+                    node.outputs[0].broadcastable)
+                if split:
+                    # The loop over the rows needs the C order.
+                    cond2 = '0'
                 loop = """
             if((%(cond1)s) || (%(cond2)s)){
                 %(contig)s
@@ -1202,7 +1204,7 @@ second dimension
         return support_code
 
     def c_code_cache_version_apply(self, node):
-        version = [13]  # the version corresponding to the c code in this Op
+        version = [14]  # the version corresponding to the c code in this Op
 
         # now we insert versions for the ops on which we depend...
         scalar_node = Apply(
@@ -1215,7 +1217,7 @@ second dimension
         for i in node.inputs + node.outputs:
             version.append(
                 get_scalar_type(dtype=i.type.dtype).c_code_cache_version())
-        version.append(('openmp', self.openmp))
+        version.append(('openmp', self.openmp, cgen.openmp_minsize()))
         if all(version):
             return tuple(version)
         else:
@@ -1234,7 +1236,7 @@ second dimension
 #   CAReduce   #
 ################
 
-class CAReduce(Op):
+class CAReduce(OpenMPOp):
     """
     CAReduce = Commutative Associative Reduce
     Reduces a scalar operation along the specified axis(es).
@@ -1280,7 +1282,7 @@ class CAReduce(Op):
 
     __props__ = ("scalar_op", "axis")
 
-    def __init__(self, scalar_op, axis=None):
+    def __init__(self, scalar_op, axis=None, openmp=None):
         if scalar_op.nin not in [-1, 2] or scalar_op.nout != 1:
             raise NotImplementedError((
                 "CAReduce only supports binary functions with a single "
@@ -1302,6 +1304,7 @@ class CAReduce(Op):
             self.axis = tuple(self.axis)
 
         self.set_ufunc(scalar_op)
+        super(CAReduce, self).__init__(openmp=openmp)
 
     def set_ufunc(self, scalar_op):
         # This is probably a speed up of the implementation
@@ -1372,7 +1375,7 @@ class CAReduce(Op):
         return d
 
     def __setstate__(self, d):
-        self.__dict__.update(d)
+        super(CAReduce, self).__setstate__(d)
         self.set_ufunc(self.scalar_op)
 
     def __str__(self):
@@ -1603,6 +1606,46 @@ class CAReduce(Op):
             [order, list(range(nnested)) + ['x'] * len(axis)],
             [idtype, adtype], all_code, sub)
 
+        ndim = node.inputs[0].type.ndim
+        if (list(axis) == list(range(len(axis))) or
+                list(axis) == list(range(ndim - len(axis), ndim))):
+            # The reduced elements of each result are in one block of a
+            # C-contiguous input: use the parallel, pairwise reduction.
+            if self.openmp:
+                # The OpenMP loops can't jump to the failure label.
+                fail = gof.cc.failure_code(sub, use_goto=False)
+            else:
+                fail = sub['fail']
+            acc_dtype = getattr(self, 'acc_dtype', None) or output.type.dtype
+            combine_in = self.scalar_op.c_code(
+                Apply(self.scalar_op,
+                      [get_scalar_type(dtype=iv.type.dtype).make_variable()
+                       for iv in (node.inputs * 2)],
+                      [get_scalar_type(dtype=ov.type.dtype).make_variable()
+                       for ov in node.outputs]),
+                None, ["red_acc_i", "red_in_i"], ["red_acc_i"],
+                dict(sub, fail=fail))
+            acc_scalar = get_scalar_type(dtype=acc_dtype)
+            combine_acc = self.scalar_op.c_code(
+                Apply(self.scalar_op,
+                      [acc_scalar.make_variable(),
+                       acc_scalar.make_variable()],
+                      [acc_scalar.make_variable()]),
+                None, ["red_acc_i", "red_other_i"], ["red_acc_i"],
+                dict(sub, fail=fail))
+            parallel = cgen.make_careduce_parallel(
+                iname, aname, idtype, adtype, identity,
+                combine_in, combine_acc, order1, list(axis),
+                openmp=self.openmp)
+            loop = """
+            if (PyArray_IS_C_CONTIGUOUS(%(iname)s) &&
+                    PyArray_IS_C_CONTIGUOUS(%(aname)s)) {
+                %(parallel)s
+            } else {
+                %(loop)s
+            }
+            """ % locals()
+
         end = ""
         if adtype != odtype:
             end = """
@@ -1618,11 +1661,12 @@ class CAReduce(Op):
 
     def c_headers(self):
         # Sometimes, Elemwise's c_code is returned, so we need its headers
-        return ['<vector>', '<algorithm>']
+        return (['<vector>', '<algorithm>'] +
+                super(CAReduce, self).c_headers())
 
     def c_code_cache_version_apply(self, node):
         # the version corresponding to the c code in this Op
-        version = [8]
+        version = [9]
 
         # now we insert versions for the ops on which we depend...
         scalar_node = Apply(
@@ -1635,6 +1679,7 @@ class CAReduce(Op):
         for i in node.inputs + node.outputs:
             version.append(
                 get_scalar_type(dtype=i.type.dtype).c_code_cache_version())
+        version.append(('openmp', self.openmp, cgen.openmp_minsize()))
         if all(version):
             return tuple(version)
         else:
@@ -2156,3 +2201,302 @@ class ProdWithoutZeros(CAReduceDtype):
             "If `a` is guarenteed to contains no zeros, use "
             "`product(a, no_zeros_in_input=True)`.")
         return [a_grad]
+
+
+class FusedCAReduce(CAReduceDtype):
+    """
+    Reduces the result of an elementwise scalar op without storing it.
+
+    ``FusedCAReduce(pre_scalar_op, scalar_op, axis)(*inputs)`` computes
+    ``CAReduceDtype(scalar_op, axis)(Elemwise(pre_scalar_op)(*inputs))``.
+    The C code applies `pre_scalar_op` to the inputs in the inner loop of
+    the reduction, so that expressions like ``sum((x - y) ** 2)`` are
+    computed in a single pass over the inputs. It is introduced by the
+    ``local_careduce_fusion`` optimization, usually with a
+    `scalar.Composite` built by the elemwise fusion.
+
+    Parameters
+    ----------
+    pre_scalar_op
+        A scalar op with only one output, applied elementwise to the
+        inputs.
+    scalar_op
+        A binary scalar op with only one output.
+        It must be commutative and associative and have an identity.
+    axis, dtype, acc_dtype
+        See `CAReduceDtype`.
+    openmp
+        See `CAReduce`. The reduction is parallel when the reduced axes are
+        the leading or the trailing ones and the inputs, with the same
+        broadcastable pattern, are C-contiguous.
+
+    """
+    __props__ = ("pre_scalar_op", "scalar_op", "axis", "dtype", "acc_dtype")
+
+    def __init__(self, pre_scalar_op, scalar_op, axis=None, dtype=None,
+                 acc_dtype=None, openmp=None):
+        if pre_scalar_op.nout != 1:
+            raise NotImplementedError(
+                "FusedCAReduce only supports pre_scalar_op with a single "
+                "output.")
+        if not hasattr(scalar_op, 'identity'):
+            raise NotImplementedError(
+                "FusedCAReduce only supports scalar_op with an identity.")
+        self.pre_scalar_op = pre_scalar_op
+        CAReduce.__init__(self, scalar_op, axis=axis, openmp=openmp)
+        self.dtype = dtype
+        self.acc_dtype = acc_dtype
+
+    def make_node(self, *inputs):
+        pre_out = Elemwise(self.pre_scalar_op)(*inputs)
+        red_op = CAReduceDtype(self.scalar_op, self.axis, self.dtype,
+                               self.acc_dtype)
+        red_node = red_op.make_node(pre_out)
+        red_op = red_node.op
+        if (red_op.axis == self.axis and red_op.dtype == self.dtype and
+                red_op.acc_dtype == self.acc_dtype):
+            op = self
+        else:
+            op = copy(self)
+            op.set_ufunc(self.scalar_op)
+            op.axis = red_op.axis
+            op.dtype = red_op.dtype
+            op.acc_dtype = red_op.acc_dtype
+        # The Elemwise has added the DimShuffles the inputs may need.
+        return Apply(op, pre_out.owner.inputs,
+                     [red_node.outputs[0].type()])
+
+    def __str__(self):
+        axis = ""
+        if self.axis is not None:
+            axis = "{%s}" % ", ".join(str(x) for x in self.axis)
+        return "FusedCAReduce{%s, %s}%s" % (
+            self.pre_scalar_op, self.scalar_op, axis)
+
+    def _inner_nodes(self, node):
+        # The unfused Elemwise and CAReduceDtype nodes, used by perform.
+        if not hasattr(node.tag, 'inner_nodes'):
+            pre_out = Elemwise(self.pre_scalar_op)(*node.inputs)
+            out = CAReduceDtype(self.scalar_op, self.axis, self.dtype,
+                                self.acc_dtype)(pre_out)
+            pre_out.owner.op.prepare_node(pre_out.owner, None, None, 'py')
+            node.tag.inner_nodes = (pre_out.owner, out.owner)
+        return node.tag.inner_nodes
+
+    def _pre_node(self, node):
+        # The scalar node of pre_scalar_op, used by the C code.
+        return self.pre_scalar_op.make_node(
+            *[get_scalar_type(dtype=i.type.dtype).make_variable()
+              for i in node.inputs])
+
+    def perform(self, node, inputs, output_storage):
+        pre_node, red_node = self._inner_nodes(node)
+        pre_storage = [None]
+        pre_node.op.perform(pre_node, inputs, [pre_storage])
+        red_node.op.perform(red_node, pre_storage, output_storage)
+
+    def infer_shape(self, node, shapes):
+        # The shape of the output of the Elemwise.
+        pre_shape = []
+        for d in xrange(node.inputs[0].type.ndim):
+            for i, shape in izip(node.inputs, shapes):
+                if not i.type.broadcastable[d]:
+                    pre_shape.append(shape[d])
+                    break
+            else:
+                pre_shape.append(1)
+        if self.axis is None:
+            return (),
+        return [s for d, s in enumerate(pre_shape) if d not in self.axis],
+
+    def _c_all(self, node, name, inames, onames, sub):
+        _inames = inames
+        inames = gof.utils.uniq(inames)
+        inputs = gof.utils.uniq(node.inputs)
+        assert len(inames) == len(inputs)
+        output = node.outputs[0]
+        oname, = onames
+
+        pre_node = self._pre_node(node)
+        pre_dtype = pre_node.outputs[0].type.dtype
+        if 'float16' in (pre_dtype, self.acc_dtype, output.type.dtype):
+            raise theano.gof.utils.MethodNotDefined("no c_code for "
+                                                    "float16")
+        ndim = node.inputs[0].type.ndim
+        axis = self.axis
+        if axis is None:
+            axis = list(range(ndim))
+        if len(axis) == 0:
+            raise theano.gof.utils.MethodNotDefined(
+                "no c_code without reduced axis")
+
+        idtypes = [i.type.dtype_specs()[1] for i in inputs]
+        odtype = output.type.dtype_specs()[1]
+        acc_type = TensorType(broadcastable=output.broadcastable,
+                              dtype=self.acc_dtype)
+        adtype = acc_type.dtype_specs()[1]
+        pdtype = get_scalar_type(dtype=pre_dtype).dtype_specs()[1]
+
+        order1 = [d for d in xrange(ndim) if d not in axis]
+        order = order1 + list(axis)
+        nnested = len(order1)
+        # The broadcasted dimensions of the inputs are not iterated.
+        orders = [[i.type.broadcastable[d] and 'x' or d for d in order]
+                  for i in inputs]
+        acc_order = list(range(nnested)) + ['x'] * len(axis)
+
+        sub = dict(sub)
+        for i, iname in enumerate(inames):
+            sub['lv%i' % i] = iname
+
+        decl = ""
+        if adtype != odtype:
+            # Create an accumulator variable different from the output
+            aname = "acc"
+            decl = acc_type.c_declare(aname, sub)
+            decl += acc_type.c_init(aname, sub)
+        else:
+            # the output is the accumulator variable
+            aname = oname
+
+        decl += cgen.make_declare(orders, idtypes, sub)
+        checks = cgen.make_checks(orders, idtypes, sub)
+
+        # Allocate the output (and accumulation) buffer, with the shape of
+        # the kept dimensions of the inputs.
+        alloc = ""
+        buffers = [(oname, odtype)]
+        if adtype != odtype:
+            buffers.append((aname, adtype))
+        for vname, vdtype in buffers:
+            alloc += cgen.make_declare([acc_order], [vdtype],
+                                       dict(sub, lv0=vname))
+            alloc += cgen.make_alloc([o[:nnested] for o in orders], vdtype,
+                                     dict(sub, olv=vname))
+            alloc += cgen.make_checks([acc_order], [vdtype],
+                                      dict(sub, lv0=vname))
+
+        task0_decl = ("%(dtype)s& %(name)s_i = *%(name)s_iter;\n"
+                      "%(name)s_i = %(identity)s;"
+                      % dict(dtype=adtype, name=aname,
+                             identity=self.scalar_op.identity))
+
+        task1_decl = "".join("%(dtype)s& %(name)s_i = *%(name)s_iter;\n"
+                             % dict(dtype=dtype, name=iname)
+                             for dtype, iname in izip(idtypes, inames))
+        task1_decl += "%s %s_pre_i;\n" % (pdtype, aname)
+        self.pre_scalar_op.prepare_node(pre_node, None, None, 'c')
+        pre_code = self.pre_scalar_op.c_code(
+            pre_node, name + '_scalar_pre_',
+            ["%s_i" % s for s in _inames], ["%s_pre_i" % aname], sub)
+        pre_scalar = get_scalar_type(dtype=pre_dtype)
+        task1_code = self.scalar_op.c_code(
+            Apply(self.scalar_op,
+                  [pre_scalar.make_variable(), pre_scalar.make_variable()],
+                  [get_scalar_type(dtype=output.type.dtype).make_variable()]),
+            None,
+            ["%s_i" % aname, "%s_pre_i" % aname],
+            ["%s_i" % aname],
+            sub)
+        code1 = """
+        {
+            %(task1_decl)s
+            %(pre_code)s
+            %(task1_code)s
+        }
+        """ % locals()
+
+        if len(axis) == 1:
+            all_code = [("", "")] * nnested + [(task0_decl, code1), ""]
+        else:
+            all_code = ([("", "")] * nnested +
+                        [(task0_decl, "")] +
+                        [("", "")] * (len(axis) - 2) +
+                        [("", code1), ""])
+        i = len(inames)
+        loop = cgen.make_loop_careduce(
+            orders + [acc_order], idtypes + [adtype], all_code,
+            dict(sub, **{'lv%i' % i: aname}))
+
+        if (len(set(i.type.broadcastable for i in inputs)) == 1 and
+                (list(axis) == list(range(len(axis))) or
+                 list(axis) == list(range(ndim - len(axis), ndim)))):
+            # Without broadcasting, the reduced elements of each result are
+            # in one block of C-contiguous inputs: use the parallel,
+            # pairwise reduction of CAReduce, applying pre_scalar_op to
+            # the elements as they are accumulated.
+            if self.openmp:
+                # The OpenMP loops can't jump to the failure label.
+                fail = gof.cc.failure_code(sub, use_goto=False)
+            else:
+                fail = sub['fail']
+            red_pre_code = "%s red_in_i;\n" % pdtype
+            red_pre_code += self.pre_scalar_op.c_code(
+                pre_node, name + '_scalar_pre_',
+                ["red_in%d_i" % inames.index(s) for s in _inames],
+                ["red_in_i"], dict(sub, fail=fail))
+            combine_in = self.scalar_op.c_code(
+                Apply(self.scalar_op,
+                      [pre_scalar.make_variable(), pre_scalar.make_variable()],
+                      [get_scalar_type(dtype=output.type.dtype)
+                       .make_variable()]),
+                None, ["red_acc_i", "red_in_i"], ["red_acc_i"],
+                dict(sub, fail=fail))
+            acc_scalar = get_scalar_type(dtype=self.acc_dtype)
+            combine_acc = self.scalar_op.c_code(
+                Apply(self.scalar_op,
+                      [acc_scalar.make_variable(),
+                       acc_scalar.make_variable()],
+                      [acc_scalar.make_variable()]),
+                None, ["red_acc_i", "red_other_i"], ["red_acc_i"],
+                dict(sub, fail=fail))
+            parallel = cgen.make_careduce_parallel(
+                inames, aname, idtypes, adtype, self.scalar_op.identity,
+                combine_in, combine_acc, order1, list(axis),
+                openmp=self.openmp, pre_code=red_pre_code)
+            contiguous = " &&\n".join("PyArray_IS_C_CONTIGUOUS(%s)" % v
+                                      for v in inames + [aname])
+            loop = """
+            if (%(contiguous)s) {
+                %(parallel)s
+            } else {
+                %(loop)s
+            }
+            """ % locals()
+
+        end = ""
+        if adtype != odtype:
+            end = """
+            PyArray_CopyInto(%(oname)s, %(aname)s);
+            """ % dict(oname=oname, aname=aname)
+            end += acc_type.c_cleanup(aname, sub)
+
+        return decl, checks, alloc, loop, end
+
+    def c_support_code(self):
+        return self.pre_scalar_op.c_support_code()
+
+    def c_support_code_apply(self, node, nodename):
+        return self.pre_scalar_op.c_support_code_apply(
+            node, nodename + '_scalar_pre_')
+
+    def c_code_cache_version_apply(self, node):
+        version = [2]
+        pre_node = self._pre_node(node)
+        version.append(
+            self.pre_scalar_op.c_code_cache_version_apply(pre_node))
+        pre_scalar = get_scalar_type(dtype=pre_node.outputs[0].type.dtype)
+        scalar_node = Apply(
+            self.scalar_op,
+            [pre_scalar.make_variable(), pre_scalar.make_variable()],
+            [get_scalar_type(dtype=node.outputs[0].type.dtype)
+             .make_variable()])
+        version.append(self.scalar_op.c_code_cache_version_apply(scalar_node))
+        for i in node.inputs + node.outputs:
+            version.append(
+                get_scalar_type(dtype=i.type.dtype).c_code_cache_version())
+        version.append(('openmp', self.openmp, cgen.openmp_minsize()))
+        if all(version):
+            return tuple(version)
+        else:
+            return ()
@@ -3,6 +3,19 @@ from six.moves import xrange
 import theano
 
 
+def openmp_minsize():
+    """
+    Return the minimum size for which the generated loops use OpenMP.
+
+    With the Theano flag openmp_autotune, the number of threads is chosen
+    at runtime, so the loops are always parallel.
+
+    """
+    if theano.config.openmp_autotune:
+        return 0
+    return theano.config.openmp_elemwise_minsize
+
+
 def make_declare(loop_orders, dtypes, sub):
     """
     Produce code to declare all necessary variables.
@@ -212,7 +225,7 @@ def make_loop(loop_orders, dtypes, loop_tasks, sub, openmp=None):
             if index != 'x':
                 suitable_n = "%(var)s_n%(index)s" % locals()
         if openmp:
-            openmp_elemwise_minsize = theano.config.openmp_elemwise_minsize
+            openmp_elemwise_minsize = openmp_minsize()
             forloop = """#pragma omp parallel for if( %(suitable_n)s >=%(openmp_elemwise_minsize)s)\n""" % locals()
         else:
             forloop = ""
@@ -405,7 +418,7 @@ def make_reordered_loop(init_loop_orders, olv_index, dtypes, inner_task, sub,
             update = pointer_update
         if i == 0:
             if openmp:
-                openmp_elemwise_minsize = theano.config.openmp_elemwise_minsize
+                openmp_elemwise_minsize = openmp_minsize()
                 forloop += """#pragma omp parallel for if( %(total)s >=%(openmp_elemwise_minsize)s)\n""" % locals()
         forloop += "for(int %(iterv)s = 0; %(iterv)s<%(total)s; %(iterv)s++)" % locals()
 
@@ -425,6 +438,259 @@ def make_reordered_loop(init_loop_orders, olv_index, dtypes, inner_task, sub,
                       loop,
                       '}\n'])
 
+
+def simd_pragma(openmp=None, parallel_if=None):
+    """
+    Return a pragma asking the compiler to vectorize the next loop.
+
+    The pragma is `#pragma omp simd`, which needs OpenMP 4.0. It is
+    guarded by the preprocessor, so that it is ignored by older compilers
+    and when the code is not compiled with OpenMP.
+
+    Parameters
+    ----------
+    openmp : bool
+        If the code is compiled with OpenMP.
+    parallel_if : str, optional
+        If given, the loop is also shared between threads when this C
+        condition is true (`#pragma omp parallel for simd if(...)`).
+
+    """
+    if not openmp:
+        return ""
+    if parallel_if is None:
+        return """
+#if defined(_OPENMP) && _OPENMP >= 201307
+#pragma omp simd
+#endif
+"""
+    return """
+#if defined(_OPENMP) && _OPENMP >= 201307
+#pragma omp parallel for simd if(%(parallel_if)s)
+#else
+#pragma omp parallel for if(%(parallel_if)s)
+#endif
+""" % locals()
+
+
+def contiguous_split(broadcastables, out_broadcastable):
+    """
+    Find how to loop over contiguous operands with two flat loops.
+
+    Ignoring the dimensions broadcasted in the output, we look for the
+    first dimension `k` such that every operand is either broadcasted in
+    all the dimensions before `k` or in none of them, and the same for the
+    dimensions from `k`. The outer loop then goes over the dimensions
+    before `k` and the inner loop over the others, both with unit strides
+    when the operands are C-contiguous. For instance a matrix plus a row
+    splits at 1, and a matrix plus a matrix at 0 (there is no outer loop).
+
+    Parameters
+    ----------
+    broadcastables : list of tuple of bool
+        The broadcastable pattern of each operand.
+    out_broadcastable : tuple of bool
+        The broadcastable pattern of the output.
+
+    Returns
+    -------
+    dims : list of int
+        The dimensions of the output that are not broadcasted.
+    k : int or None
+        The position of the split in `dims`, or None if there is none.
+
+    """
+    dims = [d for d, b in enumerate(out_broadcastable) if not b]
+    for k in xrange(len(dims)):
+        for bcast in broadcastables:
+            outer = set(bcast[d] for d in dims[:k])
+            inner = set(bcast[d] for d in dims[k:])
+            if len(outer) > 1 or len(inner) > 1:
+                break
+        else:
+            return dims, k
+    return dims, None
+
+
+def make_contiguous_loop(names, dtypes, broadcastables, out_broadcastable,
+                         task_code, openmp=None, restrict=True):
+    """
+    Generate a loop over operands that are all C-contiguous.
+
+    The loop is split as computed by `contiguous_split`. Operands
+    broadcasted in the inner dimensions are read once per outer iteration,
+    and the inner loop has unit strides, so that the compiler can
+    vectorize it. The inner loop is marked with `simd_pragma`.
+
+    Parameters
+    ----------
+    names : list of str
+        The C names of the operands (the PyArrayObject* of the inputs,
+        then of the outputs). The sizes of the loops are taken from the
+        last one, which must be an output.
+    dtypes : list of str
+        The C type of the elements of each operand.
+    broadcastables : list of tuple of bool
+        The broadcastable pattern of each operand.
+    out_broadcastable : tuple of bool
+        The broadcastable pattern of the output.
+    task_code : str
+        The code computing an element. It uses the element of each operand
+        `name` through a reference named `name_i`.
+    openmp : bool
+        If the code is compiled with OpenMP.
+    restrict : bool
+        If the operands can be declared as not aliased with
+        `__restrict__`. It must be False when an output is computed in
+        place of an input.
+
+    Returns
+    -------
+    str or None
+        The code, or None if there is no split.
+
+    """
+    dims, k = contiguous_split(broadcastables, out_broadcastable)
+    if k is None:
+        return None
+    restrict = restrict and "__restrict__" or ""
+    z = names[-1]
+    n_outer = " * ".join(["PyArray_DIMS(%s)[%d]" % (z, d)
+                          for d in dims[:k]]) or "1"
+    n_inner = " * ".join(["PyArray_DIMS(%s)[%d]" % (z, d)
+                          for d in dims[k:]]) or "1"
+    decl = """
+    npy_intp n_inner = %(n_inner)s;
+    """ % locals()
+    if k > 0:
+        decl += """
+        npy_intp n_outer = %(n_outer)s;
+        """ % locals()
+    outer_decl = ""
+    inner_decl = ""
+    for x, dtype, bcast in zip(names, dtypes, broadcastables):
+        outer_b = all(bcast[d] for d in dims[:k])
+        inner_b = all(bcast[d] for d in dims[k:])
+        if outer_b and inner_b:
+            decl += """
+            %(dtype)s& %(x)s_i = ((%(dtype)s*) PyArray_DATA(%(x)s))[0];
+            """ % locals()
+            continue
+        decl += """
+        %(dtype)s* %(restrict)s %(x)s_ptr = (%(dtype)s*) PyArray_DATA(%(x)s);
+        """ % locals()
+        if outer_b:
+            inner_decl += """
+            %(dtype)s& %(x)s_i = %(x)s_ptr[i];
+            """ % locals()
+        elif inner_b:
+            outer_decl += """
+            %(dtype)s& %(x)s_i = %(x)s_ptr[r];
+            """ % locals()
+        else:
+            outer_decl += """
+            %(dtype)s* %(restrict)s %(x)s_row = %(x)s_ptr + r * n_inner;
+            """ % locals()
+            inner_decl += """
+            %(dtype)s& %(x)s_i = %(x)s_row[i];
+            """ % locals()
+    if k == 0:
+        # There is only one row.
+        parallel_if = "n_inner >= %d" % openmp_minsize()
+        pragma = simd_pragma(openmp, parallel_if)
+        return """
+        {
+            %(decl)s
+            %(pragma)s
+            for (npy_intp i = 0; i < n_inner; i++) {
+                %(inner_decl)s
+                %(task_code)s;
+            }
+        }
+        """ % locals()
+    if openmp:
+        parallel = "#pragma omp parallel for if(n_outer * n_inner >= %d)" % (
+            openmp_minsize())
+    else:
+        parallel = ""
+    pragma = simd_pragma(openmp)
+    return """
+    {
+        %(decl)s
+        %(parallel)s
+        for (npy_intp r = 0; r < n_outer; r++) {
+            %(outer_decl)s
+            %(pragma)s
+            for (npy_intp i = 0; i < n_inner; i++) {
+                %(inner_decl)s
+                %(task_code)s;
+            }
+        }
+    }
+    """ % locals()
+
+
+def make_blocked_loop(names, dtypes, task_code, openmp=None, block=32):
+    """
+    Generate a loop over 2d operands that are C- or Fortran-contiguous.
+
+    When some operands are transposed compared to the others, any loop
+    order reads one of them with a large stride. This loop goes over
+    square blocks of `block` x `block` elements instead, so that the
+    lines of all the operands used by a block stay in the cache.
+
+    Parameters
+    ----------
+    names : list of str
+        The C names of the operands, all 2d and of the same shape.
+    dtypes : list of str
+        The C type of the elements of each operand.
+    task_code : str
+        The code computing an element, see `make_contiguous_loop`.
+    openmp : bool
+        If the code is compiled with OpenMP.
+    block : int
+        The size of the side of the blocks.
+
+    """
+    z = names[-1]
+    decl = ""
+    inner_decl = ""
+    for x, dtype in zip(names, dtypes):
+        decl += """
+        %(dtype)s* %(x)s_ptr = (%(dtype)s*) PyArray_DATA(%(x)s);
+        npy_intp %(x)s_s0 = PyArray_STRIDES(%(x)s)[0] / sizeof(%(dtype)s);
+        npy_intp %(x)s_s1 = PyArray_STRIDES(%(x)s)[1] / sizeof(%(dtype)s);
+        """ % locals()
+        inner_decl += """
+        %(dtype)s& %(x)s_i = %(x)s_ptr[i0 * %(x)s_s0 + i1 * %(x)s_s1];
+        """ % locals()
+    if openmp:
+        parallel = "#pragma omp parallel for if(n0 * n1 >= %d)" % (
+            openmp_minsize())
+    else:
+        parallel = ""
+    return """
+    {
+        npy_intp n0 = PyArray_DIMS(%(z)s)[0];
+        npy_intp n1 = PyArray_DIMS(%(z)s)[1];
+        %(decl)s
+        %(parallel)s
+        for (npy_intp b0 = 0; b0 < n0; b0 += %(block)d) {
+            npy_intp e0 = b0 + %(block)d < n0 ? b0 + %(block)d : n0;
+            for (npy_intp b1 = 0; b1 < n1; b1 += %(block)d) {
+                npy_intp e1 = b1 + %(block)d < n1 ? b1 + %(block)d : n1;
+                for (npy_intp i0 = b0; i0 < e0; i0++) {
+                    for (npy_intp i1 = b1; i1 < e1; i1++) {
+                        %(inner_decl)s
+                        %(task_code)s;
+                    }
+                }
+            }
+        }
+    }
+    """ % locals()
+
 # print make_declare(((0, 1, 2, 3), ('x', 1, 0, 3), ('x', 'x', 'x', 0)),
 #                    ('double', 'int', 'float'),
 #                    dict(lv0='x', lv1='y', lv2='z', fail="FAIL;"))
@@ -525,3 +791,207 @@ def make_loop_careduce(loop_orders, dtypes, loop_tasks, sub):
 
     s += loop_tasks[-1]
     return "{%s}" % s
+
+
+def make_careduce_parallel(iname, aname, idtype, adtype, identity,
+                           combine_in, combine_acc, keep_dims, red_dims,
+                           openmp=None, block=128, pre_code=None):
+    """
+    Generate a reduction over the leading or the trailing dimensions of a
+    C-contiguous input, parallel with OpenMP and with pairwise partial
+    results.
+
+    The input is seen as a 2d array, with `n_red` reduced elements for
+    each of the `n_keep` results. The reduced elements are accumulated
+    by blocks of `block` elements, and the results of the blocks are
+    combined pairwise (like numpy's pairwise summation), so that the
+    rounding error of a sum grows like the logarithm of the number of
+    elements instead of linearly. When there are enough results, they are
+    shared between the threads. Otherwise, the reduced elements are split
+    between the threads and their partial results are combined pairwise.
+
+    Parameters
+    ----------
+    iname : str or list of str
+        The C name of the input, or the names of several inputs with the
+        same shape, combined elementwise by `pre_code`.
+    aname : str
+        The C name of the C-contiguous array receiving the results.
+    idtype : str or list of str
+        The C type of the elements of the input(s).
+    adtype : str
+        The C type of the results.
+    identity : str
+        The identity of the reduction, as a C expression.
+    combine_in : str
+        Code that combines an element `red_in_i` of the input in the
+        result `red_acc_i`.
+    combine_acc : str
+        Code that combines another result `red_other_i` in the result
+        `red_acc_i`.
+    keep_dims : list of int
+        The dimensions of the input that are not reduced. The reduced
+        dimensions must be all the ones before them, or all the ones
+        after them.
+    red_dims : list of int
+        The reduced dimensions.
+    openmp : bool
+        If the code is compiled with OpenMP.
+    block : int
+        The number of elements accumulated before combining pairwise.
+    pre_code : str
+        Code that declares and computes `red_in_i` from the elements
+        `red_in0_i`, `red_in1_i`, ... of the inputs, before it is combined
+        in the result. Required when there are several inputs.
+
+    """
+    if not isinstance(iname, (list, tuple)):
+        iname, idtype = [iname], [idtype]
+    if pre_code is None:
+        assert len(iname) == 1
+        load = "const %s& red_in_i = in_ptr0[red_k];" % idtype[0]
+    else:
+        load = "".join("const %s& red_in%d_i = in_ptr%d[red_k];\n"
+                       % (dtype, k, k) for k, dtype in enumerate(idtype))
+        load += pre_code
+    in_ptrs = "".join("const %s* in_ptr%d = (const %s*) PyArray_DATA(%s);\n"
+                      % (dtype, k, dtype, name)
+                      for k, (dtype, name) in enumerate(zip(idtype, iname)))
+    iname = iname[0]
+    trailing = not keep_dims or max(keep_dims) < min(red_dims)
+    n_keep = " * ".join(["PyArray_DIMS(%s)[%d]" % (iname, d)
+                         for d in keep_dims]) or "1"
+    n_red = " * ".join(["PyArray_DIMS(%s)[%d]" % (iname, d)
+                        for d in red_dims]) or "1"
+    # Number of results reduced together. When the reduced elements are
+    # contiguous, each result is computed on its own.
+    cols = 1 if trailing else 64
+    if trailing:
+        accumulate = """
+        for (npy_intp c = 0; c < ncol; c++) {
+            const npy_intp p = (jb + c) * n_red;
+            %(adtype)s& red_acc_i = acc[c];
+            for (npy_intp i = ib; i < ie; i++) {
+                const npy_intp red_k = p + i;
+                %(load)s
+                %(combine_in)s
+            }
+        }
+        """ % locals()
+    else:
+        accumulate = """
+        for (npy_intp i = ib; i < ie; i++) {
+            const npy_intp p = i * n_keep + jb;
+            for (npy_intp c = 0; c < ncol; c++) {
+                %(adtype)s& red_acc_i = acc[c];
+                const npy_intp red_k = p + c;
+                %(load)s
+                %(combine_in)s
+            }
+        }
+        """ % locals()
+    # Reduce the elements [i0, i1) of the results [jb, jb + ncol) in dst.
+    tile = """
+    {
+        %(adtype)s stack_v[64][%(cols)d];
+        npy_intp stack_l[64];
+        int top = 0;
+        %(adtype)s acc[%(cols)d];
+        for (npy_intp ib = i0; ib < i1; ib += %(block)d) {
+            npy_intp ie = ib + %(block)d < i1 ? ib + %(block)d : i1;
+            for (npy_intp c = 0; c < ncol; c++) {
+                acc[c] = %(identity)s;
+            }
+            %(accumulate)s
+            // Combine with the partial results of as many blocks.
+            npy_intp level = 0;
+            while (top > 0 && stack_l[top - 1] == level) {
+                top--;
+                for (npy_intp c = 0; c < ncol; c++) {
+                    %(adtype)s& red_acc_i = acc[c];
+                    %(adtype)s& red_other_i = stack_v[top][c];
+                    %(combine_acc)s
+                }
+                level++;
+            }
+            for (npy_intp c = 0; c < ncol; c++) {
+                stack_v[top][c] = acc[c];
+            }
+            stack_l[top] = level;
+            top++;
+        }
+        for (npy_intp c = 0; c < ncol; c++) {
+            %(adtype)s red_acc_i = %(identity)s;
+            for (int t = top - 1; t >= 0; t--) {
+                %(adtype)s& red_other_i = stack_v[t][c];
+                %(combine_acc)s
+            }
+            dst[c] = red_acc_i;
+        }
+    }
+    """ % locals()
+    if openmp:
+        minsize = openmp_minsize()
+        n_threads = """
+        #ifdef _OPENMP
+        if (n_red * n_keep >= %(minsize)d)
+            n_threads = omp_get_max_threads();
+        #endif
+        """ % locals()
+        parallel_tiles = ("#pragma omp parallel for if(n_threads > 1) "
+                          "num_threads(n_threads) schedule(static)")
+        parallel_threads = ("#pragma omp parallel for num_threads(n_threads)"
+                            " schedule(static)")
+    else:
+        n_threads = parallel_tiles = parallel_threads = ""
+    return """
+    {
+        %(in_ptrs)s
+        %(adtype)s* res_ptr = (%(adtype)s*) PyArray_DATA(%(aname)s);
+        npy_intp n_keep = %(n_keep)s;
+        npy_intp n_red = %(n_red)s;
+        int n_threads = 1;
+        %(n_threads)s
+        npy_intp n_tiles = (n_keep + %(cols)d - 1) / %(cols)d;
+        if (n_tiles >= n_threads) {
+            %(parallel_tiles)s
+            for (npy_intp tile = 0; tile < n_tiles; tile++) {
+                npy_intp jb = tile * %(cols)d;
+                npy_intp ncol = n_keep - jb < %(cols)d ? n_keep - jb : %(cols)d;
+                npy_intp i0 = 0;
+                npy_intp i1 = n_red;
+                %(adtype)s* dst = res_ptr + jb;
+                %(tile)s
+            }
+        } else {
+            // Few results: split the reduced elements between the
+            // threads, on block boundaries.
+            std::vector<%(adtype)s> partial(n_threads * n_keep);
+            npy_intp per = (n_red + n_threads - 1) / n_threads;
+            per = (per + %(block)d - 1) / %(block)d * %(block)d;
+            %(parallel_threads)s
+            for (int th = 0; th < n_threads; th++) {
+                npy_intp i0 = th * per < n_red ? th * per : n_red;
+                npy_intp i1 = i0 + per < n_red ? i0 + per : n_red;
+                for (npy_intp jb = 0; jb < n_keep; jb += %(cols)d) {
+                    npy_intp ncol = n_keep - jb < %(cols)d ? n_keep - jb : %(cols)d;
+                    %(adtype)s* dst = &partial[th * n_keep + jb];
+                    %(tile)s
+                }
+            }
+            // Combine the results of the threads pairwise.
+            for (int step = 1; step < n_threads; step *= 2) {
+                for (int th = 0; th + step < n_threads; th += 2 * step) {
+                    for (npy_intp j = 0; j < n_keep; j++) {
+                        %(adtype)s& red_acc_i = partial[th * n_keep + j];
+                        %(adtype)s& red_other_i = partial[(th + step) * n_keep + j];
+                        %(combine_acc)s
+                    }
+                }
+            }
+            for (npy_intp j = 0; j < n_keep; j++) {
+                res_ptr[j] = partial[j];
+            }
+        }
+    }
+    """ % locals()
@@ -8,10 +8,10 @@ import numpy as np
 
 import theano
 from theano import Op, Apply
-from theano.gof import EnumList
+from theano.gof import EnumList, OpenMPOp
 import theano.tensor as T
-from theano.gradient import grad_not_implemented
 from theano.gradient import grad_undefined
+from theano.tensor import elemwise_cgen as cgen
 
 
 class Images2Neibs(Op):
@@ -35,7 +35,9 @@ class Images2Neibs(Op):
             Same as valid, but will ignore the borders if the shape(s)
             of the input is not a multiple of the pooling factor(s).
         - 'wrap_centered' :
-            ?? TODO comment
+            Neighbourhoods centered on the pixels (neib_step apart), that
+            wrap around the image borders. Requires odd neighbourhood
+            shapes that are not bigger than the images.
 
     """
 
@@ -115,55 +117,8 @@ class Images2Neibs(Op):
     def grad(self, inp, grads):
         x, neib_shape, neib_step = inp
         gz, = grads
-
-        if self.mode in ['valid', 'ignore_borders']:
-            if (neib_shape is neib_step or
-                neib_shape == neib_step or
-                # Theano Constant == do not compare the data
-                # the equals function do that.
-                (hasattr(neib_shape, "equals") and
-                 neib_shape.equals(neib_step))):
-                return [neibs2images(gz, neib_shape, x.shape, mode=self.mode),
-                        grad_undefined(self, 1, neib_shape),
-                        grad_undefined(self, 2, neib_step)]
-
-        if self.mode in ['valid']:
-            # Iterate over neighborhood positions, summing contributions.
-            def pos2map(pidx, pgz, prior_result, neib_shape, neib_step):
-                '''
-                Helper function that adds gradient contribution from a single
-                neighborhood position i,j.
-                pidx = Index of position within neighborhood.
-                pgz  = Gradient of shape (batch_size*num_channels*neibs)
-                prior_result  = Shape (batch_size, num_channnels, rows, cols)
-                neib_shape = Number of rows, cols in a neighborhood.
-                neib_step  = Step sizes from image2neibs.
-                '''
-                nrows, ncols = neib_shape
-                rstep, cstep = neib_step
-                batch_size, num_channels, rows, cols = prior_result.shape
-                i = pidx // ncols
-                j = pidx - (i * ncols)
-                # This position does not touch some img pixels in valid mode.
-                result_indices = prior_result[:, :,
-                                              i:(rows - nrows + i + 1):rstep,
-                                              j:(cols - ncols + j + 1):cstep]
-                newshape = (batch_size, num_channels) + \
-                           ((rows - nrows) // rstep + 1,) + \
-                           ((cols - ncols) // cstep + 1,)
-                return T.inc_subtensor(result_indices, pgz.reshape(newshape))
-            indices = T.arange(neib_shape[0] * neib_shape[1])
-            pgzs = gz.dimshuffle((1, 0))
-            result, _ = theano.scan(fn=pos2map,
-                                    sequences=[indices, pgzs],
-                                    outputs_info=T.zeros(x.shape),
-                                    non_sequences=[neib_shape, neib_step])
-            grad_input = result[-1]
-            return [grad_input,
-                    grad_undefined(self, 1, neib_shape),
-                    grad_undefined(self, 2, neib_step)]
-
-        return [grad_not_implemented(self, 0, x),
+        return [neibs2images(gz, neib_shape, x.shape, mode=self.mode,
+                             neib_step=neib_step),
                 grad_undefined(self, 1, neib_shape),
                 grad_undefined(self, 2, neib_step)]
 
@@ -617,6 +572,335 @@ class Images2Neibs(Op):
                    fail=sub['fail'], mode=sub['params'])
 
 
+class Neibs2Images(OpenMPOp):
+    """
+    Sums the rows of a matrix of neighbourhoods into the images they were
+    extracted from.
+
+    This is the transpose of :class:`Images2Neibs`, with the same `mode`:
+    each element of `neibs` is added to the pixel of the images that
+    `Images2Neibs` would have copied there. The pixels covered by several
+    neighbourhoods receive the sum of their values, and the ones that are
+    not covered are 0. When the neighbourhoods are disjoint, this
+    reconstructs the images. It is used as the gradient of
+    `Images2Neibs` and by :func:`neibs2images`.
+
+    The C code processes the images of the different (batch, stack) pairs
+    in parallel with OpenMP.
+
+    Parameters
+    ----------
+    mode : {'valid', 'half', 'full', 'ignore_borders', 'wrap_centered'}
+        See :class:`Images2Neibs`.
+
+    """
+
+    __props__ = ("mode",)
+    BORDER_MODE = Images2Neibs.BORDER_MODE
+    params_type = BORDER_MODE
+
+    def get_params(self, node):
+        return self.mode
+
+    def __init__(self, mode='valid', openmp=None):
+        implemented_modes = self.BORDER_MODE.get_aliases()
+        if mode not in implemented_modes:
+            raise NotImplementedError("Only modes %s have been implemented for %s"
+                                      % (', '.join(implemented_modes), type(self).__name__))
+        self.mode = mode
+        super(Neibs2Images, self).__init__(openmp=openmp)
+
+    def __str__(self):
+        return self.__class__.__name__ + "{%s}" % self.mode
+
+    def make_node(self, neibs, neib_shape, neib_step, original_shape):
+        """
+        Parameters
+        ----------
+        neibs : matrix
+            The neighbourhoods, like the output of :class:`Images2Neibs`.
+        neib_shape
+            (r,c), the shape of the neighbourhoods.
+        neib_step
+            (dr,dc), the steps between the neighbourhoods.
+        original_shape
+            The shape of the 4d output.
+
+        """
+        neibs = T.as_tensor_variable(neibs)
+        neib_shape = T.as_tensor_variable(neib_shape)
+        neib_step = T.as_tensor_variable(neib_step)
+        original_shape = T.as_tensor_variable(original_shape)
+
+        assert neibs.ndim == 2
+        assert neib_shape.ndim == 1
+        assert neib_step.ndim == 1
+        assert original_shape.ndim == 1
+        if original_shape.dtype not in T.integer_dtypes:
+            raise TypeError("original_shape must be an integer vector")
+
+        return Apply(self, [neibs, neib_shape, neib_step, original_shape],
+                     [T.tensor4(dtype=neibs.type.dtype)])
+
+    def grad(self, inp, grads):
+        neibs, neib_shape, neib_step, original_shape = inp
+        gz, = grads
+        return [Images2Neibs(self.mode)(gz, neib_shape, neib_step),
+                grad_undefined(self, 1, neib_shape),
+                grad_undefined(self, 2, neib_step),
+                grad_undefined(self, 3, original_shape)]
+
+    def infer_shape(self, node, input_shape):
+        original_shape = node.inputs[3]
+        return [tuple(original_shape[i] for i in range(4))]
+
+    def perform(self, node, inp, out_, params):
+        neibs, neib_shape, neib_step, original_shape = inp
+        z, = out_
+        if len(original_shape) != 4:
+            raise ValueError(
+                "Neibs2Images: original_shape must have 4 elements. Got " +
+                str(original_shape))
+        c, d = neib_shape
+        step_x, step_y = neib_step
+        nb_batch, nb_stack, height, width = original_shape
+        mode = self.mode
+        if step_x <= 0 or step_y <= 0:
+            raise ValueError(
+                "neib_step wrong step ; values <= 0. Got " + str(neib_step))
+        if c <= 0 or d <= 0:
+            raise ValueError(
+                "neib_shape values <=0. Got " + str(neib_shape))
+
+        if mode == "wrap_centered":
+            ok = (c % 2 == 1 and d % 2 == 1 and height >= c and width >= d)
+            grid_c = -(-height // step_x)
+            grid_d = -(-width // step_y)
+        elif mode == "valid":
+            ok = (height >= c and (height - c) % step_x == 0 and
+                  width >= d and (width - d) % step_y == 0)
+            grid_c = 1 + (height - c) // step_x
+            grid_d = 1 + (width - d) // step_y
+        elif mode == "ignore_borders":
+            ok = True
+            grid_c = max(0, 1 + (height - c) // step_x)
+            grid_d = max(0, 1 + (width - d) // step_y)
+        elif mode == "half":
+            ok = (height >= c and (height - c % 2) % step_x == 0 and
+                  width >= d and (width - d % 2) % step_y == 0)
+            grid_c = 1 + (height - c % 2) // step_x
+            grid_d = 1 + (width - d % 2) // step_y
+        elif mode == "full":
+            ok = (height >= c and (height + c - 2) % step_x == 0 and
+                  width >= d and (width + d - 2) % step_y == 0)
+            grid_c = 1 + (height + c - 2) // step_x
+            grid_d = 1 + (width + d - 2) // step_y
+        else:
+            raise TypeError("Neibs2Images: unknow mode '%s'" % mode)
+        n_planes = nb_batch * nb_stack
+        if (not ok or
+                neibs.shape != (grid_c * grid_d * n_planes, c * d)):
+            raise ValueError(
+                "Neibs2Images: neibs.shape=%s not consistent with"
+                " neib_shape=%s, neib_step=%s, original_shape=%s and"
+                " mode %s" % (neibs.shape, neib_shape, neib_step,
+                              original_shape, mode))
+
+        out = np.zeros((n_planes, height, width), dtype=node.outputs[0].dtype)
+        if mode in ("wrap_centered", "half"):
+            shift_x, shift_y = c // 2, d // 2
+        elif mode == "full":
+            shift_x, shift_y = c - 1, d - 1
+        else:
+            shift_x = shift_y = 0
+        patches = neibs.reshape(n_planes, grid_c, grid_d, c, d)
+        for a in range(grid_c):
+            rows = np.arange(c) + a * step_x - shift_x
+            if mode == "wrap_centered":
+                rows[rows < 0] += height
+                rows[rows >= height] -= height
+            keep_i = (rows >= 0) & (rows < height)
+            for b in range(grid_d):
+                cols = np.arange(d) + b * step_y - shift_y
+                if mode == "wrap_centered":
+                    cols[cols < 0] += width
+                    cols[cols >= width] -= width
+                keep_j = (cols >= 0) & (cols < width)
+                # The pixels of a neighbourhood are distinct.
+                out[:, rows[keep_i, None], cols[None, keep_j]] += \
+                    patches[:, a, b][:, keep_i][:, :, keep_j]
+        z[0] = out.reshape(original_shape)
+
+    def c_code_cache_version(self):
+        return (1, self.openmp, cgen.openmp_minsize())
+
+    def c_code(self, node, name, inp, out, sub):
+        neibs, neib_shape, neib_step, original_shape = inp
+        z, = out
+        fail = sub['fail']
+        mode = sub['params']
+        if self.openmp:
+            omp = ("#pragma omp parallel for schedule(static) "
+                   "if (n_planes > 1 && n_planes * height * width >= %d)" %
+                   cgen.openmp_minsize())
+        else:
+            omp = ""
+        return """
+        {
+        if (PyArray_NDIM(%(neib_shape)s) != 1 ||
+                PyArray_DIMS(%(neib_shape)s)[0] != 2 ||
+                PyArray_NDIM(%(neib_step)s) != 1 ||
+                PyArray_DIMS(%(neib_step)s)[0] != 2) {
+            PyErr_Format(PyExc_TypeError,
+                         "neib_shape and neib_step must contain 2 elements");
+            %(fail)s;
+        }
+        if (PyArray_NDIM(%(original_shape)s) != 1 ||
+                PyArray_DIMS(%(original_shape)s)[0] != 4) {
+            PyErr_Format(PyExc_ValueError,
+                         "Neibs2Images: original_shape must have 4 elements");
+            %(fail)s;
+        }
+
+        // (c,d) = neib_shape
+        const npy_intp c = (npy_intp) *(dtype_%(neib_shape)s*) PyArray_GETPTR1(%(neib_shape)s, 0);
+        const npy_intp d = (npy_intp) *(dtype_%(neib_shape)s*) PyArray_GETPTR1(%(neib_shape)s, 1);
+        // (step_x,step_y) = neib_step
+        const npy_intp step_x = (npy_intp) *(dtype_%(neib_step)s*) PyArray_GETPTR1(%(neib_step)s, 0);
+        const npy_intp step_y = (npy_intp) *(dtype_%(neib_step)s*) PyArray_GETPTR1(%(neib_step)s, 1);
+        npy_intp dims[4];
+        for (int i = 0; i < 4; i++)
+            dims[i] = (npy_intp) *(dtype_%(original_shape)s*) PyArray_GETPTR1(%(original_shape)s, i);
+        const npy_intp n_planes = dims[0] * dims[1];
+        const npy_intp height = dims[2];
+        const npy_intp width = dims[3];
+
+        if (step_x <= 0 || step_y <= 0) {
+            PyErr_Format(PyExc_ValueError,
+                         "neib_step wrong step ; values <= 0. Got %%lld %%lld.",
+                         (long long) step_x, (long long) step_y);
+            %(fail)s;
+        }
+        if (c <= 0 || d <= 0) {
+            PyErr_Format(PyExc_ValueError,
+                         "neib_shape values <= 0. Got %%lld %%lld.",
+                         (long long)c, (long long)d);
+            %(fail)s;
+        }
+        if (dims[0] < 0 || dims[1] < 0 || height < 0 || width < 0) {
+            PyErr_Format(PyExc_ValueError,
+                         "Neibs2Images: negative original_shape");
+            %(fail)s;
+        }
+
+        npy_intp grid_c = 0, grid_d = 0;
+        npy_intp shift_x = 0, shift_y = 0;
+        bool ok = true;
+        if (%(mode)s == MODE_WRAP_CENTERED) {
+            ok = c %% 2 == 1 && d %% 2 == 1 && height >= c && width >= d;
+            grid_c = (height + step_x - 1) / step_x;
+            grid_d = (width + step_y - 1) / step_y;
+            shift_x = c / 2;
+            shift_y = d / 2;
+        } else if (%(mode)s == MODE_VALID) {
+            ok = (height >= c && (height - c) %% step_x == 0 &&
+                  width >= d && (width - d) %% step_y == 0);
+            grid_c = 1 + (height - c) / step_x;
+            grid_d = 1 + (width - d) / step_y;
+        } else if (%(mode)s == MODE_IGNORE_BORDERS) {
+            grid_c = height >= c ? 1 + (height - c) / step_x : 0;
+            grid_d = width >= d ? 1 + (width - d) / step_y : 0;
+        } else if (%(mode)s == MODE_HALF) {
+            ok = (height >= c && (height - c %% 2) %% step_x == 0 &&
+                  width >= d && (width - d %% 2) %% step_y == 0);
+            grid_c = 1 + (height - c %% 2) / step_x;
+            grid_d = 1 + (width - d %% 2) / step_y;
+            shift_x = c / 2;
+            shift_y = d / 2;
+        } else if (%(mode)s == MODE_FULL) {
+            ok = (height >= c && (height + c - 2) %% step_x == 0 &&
+                  width >= d && (width + d - 2) %% step_y == 0);
+            grid_c = 1 + (height + c - 2) / step_x;
+            grid_d = 1 + (width + d - 2) / step_y;
+            shift_x = c - 1;
+            shift_y = d - 1;
+        } else {
+            PyErr_Format(PyExc_TypeError,
+                         "Neibs2Images: unknow mode %%d", %(mode)s);
+            %(fail)s;
+        }
+        if (!ok ||
+                PyArray_DIMS(%(neibs)s)[0] != grid_c * grid_d * n_planes ||
+                PyArray_DIMS(%(neibs)s)[1] != c * d) {
+            PyErr_Format(PyExc_ValueError,
+                         "Neibs2Images: neibs.shape=(%%lld, %%lld) not"
+                         " consistent with neib_shape=(%%lld, %%lld),"
+                         " neib_step=(%%lld, %%lld) and"
+                         " original_shape=(%%lld, %%lld, %%lld, %%lld)",
+                         (long long)PyArray_DIMS(%(neibs)s)[0],
+                         (long long)PyArray_DIMS(%(neibs)s)[1],
+                         (long long)c, (long long)d,
+                         (long long)step_x, (long long)step_y,
+                         (long long)dims[0], (long long)dims[1],
+                         (long long)height, (long long)width);
+            %(fail)s;
+        }
+
+        if (NULL == %(z)s || !PyArray_IS_C_CONTIGUOUS(%(z)s) ||
+                !PyArray_CompareLists(PyArray_DIMS(%(z)s), dims, 4)) {
+            Py_XDECREF(%(z)s);
+            %(z)s = (PyArrayObject*) PyArray_EMPTY(
+                4, dims, PyArray_TYPE(%(neibs)s), 0);
+            if (!%(z)s) {
+                PyErr_SetString(PyExc_MemoryError, "failed to alloc z output");
+                %(fail)s;
+            }
+        }
+
+        const npy_intp neibs_s0 = PyArray_STRIDES(%(neibs)s)[0];
+        const npy_intp neibs_s1 = PyArray_STRIDES(%(neibs)s)[1];
+        const char* neibs_data = PyArray_BYTES(%(neibs)s);
+        dtype_%(z)s* z_data = (dtype_%(z)s*) PyArray_DATA(%(z)s);
+        const bool wrap = (%(mode)s == MODE_WRAP_CENTERED);
+        // Each image is only written by the thread that processes it.
+        %(omp)s
+        for (npy_intp p = 0; p < n_planes; p++) {
+            dtype_%(z)s* plane = z_data + p * height * width;
+            std::fill(plane, plane + height * width, (dtype_%(z)s) 0);
+            for (npy_intp a = 0; a < grid_c; a++) {
+                for (npy_intp b = 0; b < grid_d; b++) {
+                    const npy_intp z_row = b + grid_d * (a + grid_c * p);
+                    const char* row = neibs_data + z_row * neibs_s0;
+                    for (npy_intp i = 0; i < c; i++) {
+                        npy_intp y = i + a * step_x - shift_x;
+                        if (wrap) {
+                            if (y < 0) y += height;
+                            else if (y >= height) y -= height;
+                        }
+                        if (y < 0 || y >= height)
+                            continue;
+                        for (npy_intp j = 0; j < d; j++) {
+                            npy_intp x = j + b * step_y - shift_y;
+                            if (wrap) {
+                                if (x < 0) x += width;
+                                else if (x >= width) x -= width;
+                            }
+                            if (x < 0 || x >= width)
+                                continue;
+                            plane[y * width + x] += *(const dtype_%(z)s*)(
+                                row + (j + d * i) * neibs_s1);
+                        }
+                    }
+                }
+            }
+        }
+        }
+        """ % locals()
+
+    def c_headers(self):
+        return ['<algorithm>'] + super(Neibs2Images, self).c_headers()
+
+
 def images2neibs(ten4, neib_shape, neib_step=None, mode='valid'):
     """
     Function :func:`images2neibs <theano.tensor.nnet.neighbours.images2neibs>`
@@ -714,7 +998,8 @@ def images2neibs(ten4, neib_shape, neib_step=None, mode='valid'):
     return Images2Neibs(mode)(ten4, neib_shape, neib_step)
 
 
-def neibs2images(neibs, neib_shape, original_shape, mode='valid'):
+def neibs2images(neibs, neib_shape, original_shape, mode='valid',
+                 neib_step=None):
     """
     Function :func:`neibs2images <theano.sandbox.neighbours.neibs2images>`
     performs the inverse operation of
@@ -733,6 +1018,13 @@ def neibs2images(neibs, neib_shape, original_shape, mode='valid'):
     original_shape
         Original shape of the 4d tensor given to
         :func:`images2neibs <theano.sandbox.neigbours.neibs2images>`
+    mode
+        `mode` that was used in
+        :func:`images2neibs <theano.sandbox.neigbours.neibs2images>`.
+    neib_step
+        `neib_step` that was used in
+        :func:`images2neibs <theano.sandbox.neigbours.neibs2images>`.
+        Defaults to `neib_shape`.
 
     Returns
     -------
@@ -743,13 +1035,11 @@ def neibs2images(neibs, neib_shape, original_shape, mode='valid'):
 
     Notes
     -----
-    Currently, the function doesn't support tensors created with
-    `neib_step` different from default value. This means that it may be
-    impossible to compute the gradient of a variable gained by
-    :func:`images2neibs <theano.sandbox.neigbours.neibs2images>` w.r.t.
-    its inputs in this case, because it uses
-    :func:`images2neibs <theano.sandbox.neigbours.neibs2images>` for
-    gradient computation.
+    When the neighbourhoods overlap (`neib_step` smaller than `neib_shape`,
+    or the modes 'half', 'full' and 'wrap_centered'), the contributions of
+    all the neighbourhoods that contain a pixel are summed, and the pixels
+    that are not in any neighbourhood are 0. To average them instead,
+    divide by the result of this function applied to `T.ones_like(neibs)`.
 
     Examples
     --------
@@ -770,7 +1060,30 @@ def neibs2images(neibs, neib_shape, original_shape, mode='valid'):
     neibs = T.as_tensor_variable(neibs)
     neib_shape = T.as_tensor_variable(neib_shape)
     original_shape = T.as_tensor_variable(original_shape)
+    if neib_step is None:
+        neib_step = neib_shape
+    else:
+        neib_step = T.as_tensor_variable(neib_step)
+
+    if mode in ['valid', 'ignore_borders'] and (
+            neib_shape is neib_step or
+            # Theano Constant == do not compare the data
+            # the equals function do that.
+            (hasattr(neib_shape, "equals") and
+             neib_shape.equals(neib_step))):
+        # Neibs2Images has no GPU implementation, but this graph can be
+        # moved to the GPU.
+        return _neibs2images_disjoint(neibs, neib_shape, original_shape,
+                                      mode)
+    return Neibs2Images(mode)(neibs, neib_shape, neib_step, original_shape)
+
+
+def _neibs2images_disjoint(neibs, neib_shape, original_shape, mode):
+    """
+    neibs2images for disjoint neighbourhoods in the modes 'valid' and
+    'ignore_borders', with reshapes and Images2Neibs.
 
+    """
     new_neib_shape = T.stack([original_shape[-1] // neib_shape[1],
                               neib_shape[1]])
     output_2d = images2neibs(neibs.dimshuffle('x', 'x', 0, 1),
@@ -793,11 +1106,7 @@ def neibs2images(neibs, neib_shape, original_shape, mode='valid'):
             pad_shape = list(output_4d.shape)
             pad_shape[d] = original_shape[d] - valid_shape[d]
             output_4d = T.concatenate([output_4d, T.zeros(pad_shape)], axis=d)
-    elif mode == 'valid':
-        # TODO: we do not implement all mode with this code.
-        # Add a check for the good cases.
-        output_4d = output_2d.reshape(original_shape, ndim=4)
     else:
-        raise NotImplementedError("neibs2images do not support mode=%s" % mode)
+        output_4d = output_2d.reshape(original_shape, ndim=4)
 
     return output_4d
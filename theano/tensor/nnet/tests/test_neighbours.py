@@ -5,7 +5,8 @@ import unittest
 import theano
 from theano import shared, function
 import theano.tensor as T
-from theano.tensor.nnet.neighbours import images2neibs, neibs2images, Images2Neibs
+from theano.tensor.nnet.neighbours import (images2neibs, neibs2images,
+                                           Images2Neibs, Neibs2Images)
 
 from theano.tests import unittest_tools
 
@@ -322,37 +323,52 @@ class T_Images2Neibs(unittest_tools.InferShapeTester):
             f()
 
     def test_grad_wrap_centered(self):
-        # It is not implemented for now. So test that we raise an error.
         shape = (2, 3, 6, 6)
         images_val = np.random.rand(*shape).astype('float32')
 
         def fn(images):
             return images2neibs(images, (3, 3), mode='wrap_centered')
 
-        self.assertRaises(TypeError, unittest_tools.verify_grad,
-                          fn, [images_val], mode=self.mode)
+        unittest_tools.verify_grad(fn, [images_val], mode=self.mode,
+                                   eps=0.1)
+
+        def fn(images):
+            return images2neibs(images, (3, 3), (2, 2), mode='wrap_centered')
+
+        unittest_tools.verify_grad(fn, [images_val], mode=self.mode,
+                                   eps=0.1)
 
     def test_grad_half(self):
-        # It is not implemented for now. So test that we raise an error.
-        shape = (2, 3, 6, 6)
+        shape = (2, 3, 7, 7)
         images_val = np.random.rand(*shape).astype('float32')
 
         def fn(images):
             return images2neibs(images, (3, 3), mode='half')
 
-        self.assertRaises(TypeError, unittest_tools.verify_grad,
-                          fn, [images_val], mode=self.mode)
+        unittest_tools.verify_grad(fn, [images_val], mode=self.mode,
+                                   eps=0.1)
+
+        def fn(images):
+            return images2neibs(images, (3, 3), (2, 2), mode='half')
+
+        unittest_tools.verify_grad(fn, [images_val], mode=self.mode,
+                                   eps=0.1)
 
     def test_grad_full(self):
-        # It is not implemented for now. So test that we raise an error.
-        shape = (2, 3, 6, 6)
+        shape = (2, 3, 5, 5)
         images_val = np.random.rand(*shape).astype('float32')
 
         def fn(images):
             return images2neibs(images, (3, 3), mode='full')
 
-        self.assertRaises(TypeError, unittest_tools.verify_grad,
-                          fn, [images_val], mode=self.mode)
+        unittest_tools.verify_grad(fn, [images_val], mode=self.mode,
+                                   eps=0.1)
+
+        def fn(images):
+            return images2neibs(images, (3, 3), (2, 2), mode='full')
+
+        unittest_tools.verify_grad(fn, [images_val], mode=self.mode,
+                                   eps=0.1)
 
     def test_grad_valid(self):
         shape = (2, 3, 6, 6)
@@ -397,6 +413,59 @@ class T_Images2Neibs(unittest_tools.InferShapeTester):
         unittest_tools.verify_grad(fn, [neibs_val], mode=self.mode,
                                    eps=0.1)
 
+    def test_neibs2images_adjoint(self):
+        # neibs2images is the transpose of images2neibs:
+        # <images2neibs(x), y> == <x, neibs2images(y)>
+        x = T.dtensor4()
+        y = T.dmatrix()
+        rng = np.random.RandomState(unittest_tools.fetch_seed())
+        for shape, pshape, step, mode in [
+                ((2, 3, 6, 6), (2, 2), (2, 2), 'valid'),
+                ((2, 3, 6, 7), (2, 3), (1, 2), 'valid'),
+                ((2, 3, 7, 5), (2, 2), (2, 1), 'ignore_borders'),
+                ((1, 3, 5, 5), (3, 3), (3, 3), 'ignore_borders'),
+                ((2, 3, 7, 7), (3, 3), (2, 2), 'half'),
+                ((2, 3, 7, 5), (2, 3), (1, 1), 'half'),
+                ((2, 3, 5, 5), (3, 3), (2, 2), 'full'),
+                ((2, 3, 5, 4), (2, 3), (1, 1), 'full'),
+                ((2, 3, 5, 7), (3, 3), (2, 3), 'wrap_centered'),
+                ((2, 3, 3, 3), (3, 3), (1, 1), 'wrap_centered')]:
+            f = function([x], images2neibs(x, pshape, step, mode=mode),
+                         mode=self.mode)
+            g = function([y], neibs2images(y, pshape, shape, mode=mode,
+                                           neib_step=step),
+                         mode=self.mode)
+            # The disjoint neighbourhoods of 'valid' and 'ignore_borders'
+            # use a graph that can be moved to the GPU.
+            disjoint = (pshape == step and
+                        mode in ('valid', 'ignore_borders'))
+            assert disjoint != any([isinstance(node.op, Neibs2Images)
+                                    for node in g.maker.fgraph.toposort()])
+            x_val = rng.rand(*shape)
+            neibs = f(x_val)
+            y_val = rng.rand(*neibs.shape)
+            images = g(y_val)
+            assert images.shape == shape
+            unittest_tools.assert_allclose((neibs * y_val).sum(),
+                                           (x_val * images).sum())
+
+            # Each pixel gets one contribution per neighbourhood that
+            # contains it.
+            counts = g(np.ones_like(neibs))
+            if mode in ('half', 'full'):
+                assert counts.sum() < neibs.size
+            else:
+                assert counts.sum() == neibs.size
+
+    def test_neibs2images_bad_shape(self):
+        neibs = T.dmatrix()
+        f = function([neibs], neibs2images(neibs, (2, 2), (1, 2, 4, 4),
+                                           neib_step=(1, 1)),
+                     mode=self.mode)
+        f(np.ones((18, 4)))
+        self.assertRaises(ValueError, f, np.ones((8, 4)))
+        self.assertRaises(ValueError, f, np.ones((18, 2)))
+
     def test_neibs_valid_with_inconsistent_borders(self):
         shape = (2, 3, 5, 5)
         images = T.dtensor4()
@@ -568,5 +637,20 @@ class T_Images2Neibs(unittest_tools.InferShapeTester):
             [x], [images2neibs(x, neib_shape=(2, 3), mode='full')],
             [images], Images2Neibs)
 
+        neibs = T.fmatrix()
+        for shape, mode in [((10, 4, 6, 4), 'valid'),
+                            ((10, 4, 7, 5), 'ignore_borders'),
+                            ((10, 4, 6, 4), 'half'),
+                            ((10, 4, 6, 4), 'full'),
+                            ((10, 4, 5, 7), 'wrap_centered')]:
+            images = np.ones(shape).astype('float32')
+            neibs_val = function(
+                [x], images2neibs(x, (3, 3), (1, 1), mode=mode),
+                mode=self.mode)(images)
+            self._compile_and_check(
+                [neibs], [neibs2images(neibs, (3, 3), shape, mode=mode,
+                                       neib_step=(1, 1))],
+                [neibs_val], Neibs2Images)
+
 if __name__ == '__main__':
     unittest.main()
@@ -2211,7 +2211,7 @@ def local_alloc_unary(node):
 
 @register_canonicalize
 @register_specialize
-@gof.local_optimizer([T.Elemwise])
+@gof.local_optimizer([(T.Elemwise, scalar.Cast)])
 def local_cast_cast(node):
     """cast(cast(x, dtype1), dtype2)
 
@@ -3947,7 +3947,7 @@ def local_sumsqr2dot(node):
 @register_stabilize
 @register_specialize
 @register_canonicalize
-@gof.local_optimizer([T.Elemwise])
+@gof.local_optimizer([(T.Elemwise, theano.scalar.basic.Sub)])
 def local_expm1(node):
     """
     This optimization detects exp(a)-1 and converts this to expm1(a).
@@ -3975,7 +3975,7 @@ def local_expm1(node):
 @register_useless('local_remove_switch_const_cond')
 @register_canonicalize('fast_compile', 'local_remove_switch_const_cond')
 @register_specialize
-@gof.local_optimizer([T.Elemwise])
+@gof.local_optimizer([(T.Elemwise, scalar.basic.Switch)])
 def local_useless_switch(node):
     """
     This optimization makes the following changes in the graph:
@@ -5151,7 +5151,7 @@ def local_sum_prod_mul_by_scalar(node):
 
 
 @register_specialize
-@gof.local_optimizer([T.Elemwise])
+@gof.local_optimizer([(T.Elemwise, scalar.Sub)])
 def local_elemwise_sub_zeros(node):
     """
     Elemwise{sub}(X,X) -> zeros_like(X)
@@ -7113,13 +7113,8 @@ def local_elemwise_fusion_op(OP, max_input_fct=lambda node: 32,
 
         # TODO: Related: Support composites with multiple outputs
 
-        # TODO: Use Composite to combine Elemwise and Reduce
-        # operations.  We have to loop over the data anyway... might
-        # as well sum it up while we're at it (this can be trickier
-        # than i'm making it seound here. The data-traversal should be
-        # done contiguously, and the summing-up might not be easy or
-        # worthwhile if the summation axis doesn't line up with a
-        # contiguous dimension)
+        # The Composite built here is folded into the reduction of its
+        # output, if any, by local_careduce_fusion.
 
         if type(node.op) is not OP:
             return False
@@ -7441,6 +7436,54 @@ def local_add_mul_fusion(node):
                 return output2
         return [output]
 
+
+def local_careduce_fusion(node):
+    """Fuse an Elemwise into the reduction of its output.
+
+    ``sum((x - y) ** 2)`` is computed by a `FusedCAReduce` that applies
+    the scalar op of the Elemwise (usually a Composite built by the
+    elemwise fusion) in the inner loop of the reduction, without
+    allocating the output of the Elemwise.
+
+    """
+    if (type(node.op) not in (T.elemwise.CAReduce, T.elemwise.CAReduceDtype,
+                              T.Sum, T.elemwise.Prod) or
+            not hasattr(node.op.scalar_op, 'identity')):
+        return False
+    inp, = node.inputs
+    out, = node.outputs
+    if (not inp.owner or
+            not isinstance(inp.owner.op, Elemwise) or
+            len(inp.owner.outputs) != 1 or
+            # Do not compute the Elemwise twice.
+            len(inp.clients) != 1 or
+            inp.ndim == 0 or node.op.axis == ()):
+        return False
+    acc_dtype = getattr(node.op, 'acc_dtype', None) or out.dtype
+    if 'float16' in (inp.dtype, acc_dtype, out.dtype):
+        return False
+    axis = node.op.axis
+    if axis is None:
+        axis = list(range(inp.ndim))
+    if (node.op.openmp and
+            len(set(i.broadcastable for i in inp.owner.inputs)) > 1 and
+            (list(axis) == list(range(len(axis))) or
+             list(axis) == list(range(inp.ndim - len(axis), inp.ndim)))):
+        # The CAReduce is parallel, but the FusedCAReduce can only be
+        # when its inputs are not broadcasted.
+        return False
+
+    fused = T.elemwise.FusedCAReduce(inp.owner.op.scalar_op,
+                                     node.op.scalar_op,
+                                     axis=node.op.axis,
+                                     dtype=out.dtype,
+                                     acc_dtype=acc_dtype,
+                                     openmp=node.op.openmp)
+    new_out = fused(*inp.owner.inputs)
+    assert new_out.type == out.type
+    copy_stack_trace(out, new_out)
+    return [new_out]
+
 if config.tensor.local_elemwise_fusion:
     _logger.debug("enabling optimization fusion elemwise in fast_run")
     # Must be after gpu(48.5) and before AddDestroyHandler(49.5)
@@ -7451,10 +7494,13 @@ if config.tensor.local_elemwise_fusion:
     fuse_seqopt.register('composite_elemwise_fusion',
                          FusionOptimizer(local_elemwise_fusion),
                          1, 'fast_run', 'fusion')
+    fuse_seqopt.register('local_careduce_fusion',
+                         FusionOptimizer(local_careduce_fusion),
+                         2, 'fast_run', 'fusion')
     compile.optdb.register('elemwise_fusion',
                            fuse_seqopt, 49,
                            'fast_run', 'fusion', 'local_elemwise_fusion',
-                           'FusionOptimizer')
+                           'FusionOptimizer', budget_priority=1)
 else:
     _logger.debug("not enabling optimization fusion elemwise in fast_run")
     compile.optdb.register('elemwise_fusion',
@@ -7464,7 +7510,7 @@ else:
 
 
 @register_canonicalize
-@gof.local_optimizer([Elemwise])
+@gof.local_optimizer([(Elemwise, scalar.Composite)])
 def local_useless_composite(node):
     """For elemwise Composite that have multiple outputs, remove the
     outputs that are not used.
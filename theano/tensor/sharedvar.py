@@ -1,8 +1,9 @@
 from __future__ import absolute_import, print_function, division
+import mmap
 import traceback
 
 import numpy as np
-from six import integer_types
+from six import integer_types, string_types
 
 import theano.tensor.basic
 from theano.tensor.basic import TensorType, _tensor_py_operators
@@ -21,7 +22,14 @@ def load_shared_variable(val):
 
 # _tensor_py_operators is first to have its version of __{gt,ge,lt,le}__
 class TensorSharedVariable(_tensor_py_operators, SharedVariable):
-    pass
+
+    def get_value(self, borrow=False, return_internal_type=False):
+        value = self.container.value
+        if not borrow and isinstance(value, np.memmap):
+            # A deep copy would be a np.memmap that maps no file.
+            return np.array(value)
+        return super(TensorSharedVariable, self).get_value(
+            borrow=borrow, return_internal_type=return_internal_type)
 
 
 @shared_constructor
@@ -57,6 +65,54 @@ def tensor_constructor(value, name=None, strict=False, allow_downcast=None,
                                 allow_downcast=allow_downcast)
 
 
+@shared_constructor
+def memmap_constructor(value, name=None, strict=False, allow_downcast=None,
+                       borrow=False, broadcastable=None, target='cpu'):
+    """
+    SharedVariable Constructor for TensorType, from a file mapped in memory.
+
+    `value` is a `numpy.memmap` or the path of a .npy file. The value is
+    mapped read-only, unless a memmap is borrowed, so that the processes
+    using the same file share its pages in the page cache instead of each
+    holding a copy.
+
+    Notes
+    -----
+    With ``borrow=True``, a memmap is used as is, and the functions updating
+    the variable can write in the file if it is mapped writeable (mode
+    'r+' or 'w+'). Otherwise its file is mapped again read-only, which does
+    not copy it either, and the updates replace the value instead of
+    writing in the file.
+    ``get_value(borrow=True)`` returns the memmap, ``get_value()`` a copy in
+    a regular ndarray, and :func:`theano.misc.pkl_utils.dump` saves a
+    reference to the file instead of its content.
+
+    """
+    if target != 'cpu':
+        raise TypeError('not for cpu')
+
+    if isinstance(value, string_types):
+        if not value.endswith('.npy'):
+            raise TypeError()
+        value = np.load(value, mmap_mode='r')
+    elif not (isinstance(value, np.memmap) and
+              isinstance(value.base, mmap.mmap)):
+        raise TypeError()
+    elif not borrow:
+        value = np.memmap(value.filename, dtype=value.dtype, mode='r',
+                          offset=value.offset, shape=value.shape,
+                          order='C' if value.flags.c_contiguous else 'F')
+
+    if broadcastable is None:
+        broadcastable = (False,) * len(value.shape)
+    type = TensorType(value.dtype, broadcastable=broadcastable)
+    return TensorSharedVariable(type=type,
+                                value=value,
+                                name=name,
+                                strict=strict,
+                                allow_downcast=allow_downcast)
+
+
 # TensorSharedVariable brings in the tensor operators, is not ideal, but works
 # as long as we dont do purely scalar-scalar operations
 # _tensor_py_operators is first to have its version of __{gt,ge,lt,le}__
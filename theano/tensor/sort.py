@@ -1,22 +1,225 @@
 from __future__ import absolute_import, print_function, division
 import numpy as np
+from six import integer_types
+
 import theano
+from theano import gof
+from theano.gof import OpenMPOp
+from theano.gof.opt import copy_stack_trace
+from theano.gradient import DisconnectedType
 from theano.tensor.basic import mul, arange
+from theano.tensor import elemwise_cgen as cgen
+from theano.tensor.opt import register_specialize
+from theano.tensor.subtensor import Subtensor, get_idx_list
+
+
+# Code used by the C implementations of SortOp, ArgSortOp and TopKOp.
+_sort_support_code = """
+#ifndef THEANO_SORT_SUPPORT_CODE
+#define THEANO_SORT_SUPPORT_CODE
+// NaN are sorted last, as in numpy.
+template<typename T>
+static inline bool theano_sort_lt(T a, T b)
+{
+    return a < b || (b != b && a == a);
+}
+
+template<typename T>
+struct theano_sort_less
+{
+    bool operator()(T a, T b) const
+    {
+        return theano_sort_lt(a, b);
+    }
+};
+
+// Compare the indices of the values v, the ties are ordered by index.
+template<typename T>
+struct theano_sort_index_less
+{
+    const T* v;
+    theano_sort_index_less(const T* v) : v(v) {}
+    bool operator()(npy_intp a, npy_intp b) const
+    {
+        if (theano_sort_lt(v[a], v[b]))
+            return true;
+        if (theano_sort_lt(v[b], v[a]))
+            return false;
+        return a < b;
+    }
+};
+
+// kind is 0 for quicksort, 1 for mergesort and 2 for heapsort.
+template<typename It, typename Less>
+static void theano_sort_range(It first, It last, Less less, int kind)
+{
+    if (kind == 1) {
+        std::stable_sort(first, last, less);
+    } else if (kind == 2) {
+        std::make_heap(first, last, less);
+        std::sort_heap(first, last, less);
+    } else {
+        std::sort(first, last, less);
+    }
+}
+
+// Partially sort the indices order[0:n] of the values v, so that the
+// indices of the k largest (or smallest) values are at the end (or at the
+// beginning), in increasing order of their values if sorted.
+template<typename T>
+static void theano_topk_order(const T* v, npy_intp* order, npy_intp n,
+                              npy_intp k, bool largest, bool sorted)
+{
+    theano_sort_index_less<T> less(v);
+    npy_intp* first = largest ? order + n - k : order;
+    npy_intp* last = first + k;
+    std::nth_element(order, largest ? first : last - 1, order + n, less);
+    if (sorted)
+        std::sort(first, last, less);
+}
+#endif
+"""
+
+_sort_kinds = {'quicksort': 0, 'mergesort': 1, 'heapsort': 2}
+
+
+def _c_check_dtype(op, dtype):
+    if dtype == 'float16' or dtype.startswith('complex'):
+        raise gof.utils.MethodNotDefined(
+            "%s has no C code for %s" % (op.__class__.__name__, dtype))
+
+
+def _c_alloc(out, nd, dims, typenum, fail):
+    """
+    Return C code allocating `out` with the shape `dims`, unless it already
+    has that shape.
+
+    """
+    return """
+    if (!%(out)s || PyArray_NDIM(%(out)s) != %(nd)s ||
+            !PyArray_CompareLists(PyArray_DIMS(%(out)s), %(dims)s, %(nd)s)) {
+        Py_XDECREF(%(out)s);
+        %(out)s = (PyArrayObject*)PyArray_EMPTY(%(nd)s, %(dims)s,
+                                                %(typenum)s, 0);
+        if (!%(out)s) {
+            %(fail)s
+        }
+    }
+    """ % locals()
+
+
+def _c_line_loop(x, outputs, ctype, body, openmp):
+    """
+    Return C code running `body` on each line of `x` along the dimension
+    `axis`, in parallel over the lines if `openmp`.
 
+    The `outputs` have the shape of `x`, except in dimension `axis`. In
+    `body`, the `n` values of the line of `x` are copied in `vals`,
+    `order` holds 0..n-1, and `<output>_p` points to the line of each
+    output, whose elements are `<output>_s` bytes apart.
 
-class SortOp(theano.Op):
+    """
+    decl = init = offsets = ""
+    for o in outputs:
+        decl += """
+        char* %(o)s_data = PyArray_BYTES(%(o)s);
+        const npy_intp* %(o)s_strides = PyArray_STRIDES(%(o)s);
+        const npy_intp %(o)s_s = %(o)s_strides[axis];
+        """ % dict(o=o)
+        init += "char* %(o)s_p = %(o)s_data;\n" % dict(o=o)
+        offsets += "%(o)s_p += c * %(o)s_strides[d];\n" % dict(o=o)
+    if openmp:
+        omp_parallel = ("#pragma omp parallel if (n_lines > 1 && "
+                        "n_lines * n >= %d)" % cgen.openmp_minsize())
+        omp_for = "#pragma omp for schedule(static)"
+    else:
+        omp_parallel = omp_for = ""
+    return """
+    {
+        const int nd = PyArray_NDIM(%(x)s);
+        const npy_intp* x_dims = PyArray_DIMS(%(x)s);
+        const npy_intp* x_strides = PyArray_STRIDES(%(x)s);
+        const char* x_data = PyArray_BYTES(%(x)s);
+        const npy_intp n = x_dims[axis];
+        const npy_intp x_s = x_strides[axis];
+        const npy_intp n_lines = n ? PyArray_SIZE(%(x)s) / n : 0;
+        %(decl)s
+        %(omp_parallel)s
+        {
+            std::vector<%(ctype)s> vals(n);
+            std::vector<npy_intp> order(n);
+            %(omp_for)s
+            for (npy_intp line = 0; line < n_lines; ++line) {
+                const char* x_p = x_data;
+                %(init)s
+                npy_intp rem = line;
+                for (int d = nd - 1; d >= 0; --d) {
+                    if (d == axis)
+                        continue;
+                    const npy_intp c = rem %% x_dims[d];
+                    rem /= x_dims[d];
+                    x_p += c * x_strides[d];
+                    %(offsets)s
+                }
+                for (npy_intp j = 0; j < n; ++j) {
+                    vals[j] = *(const %(ctype)s*)(x_p + j * x_s);
+                    order[j] = j;
+                }
+                %(body)s
+            }
+        }
+    }
+    """ % locals()
+
+
+def _c_sort_axis(op, x, axis, axis_dtype, fail):
+    """
+    Return C code reading the runtime `axis` of SortOp and ArgSortOp in
+    the C variable `axis`.
+
+    """
+    name = op.__class__.__name__
+    return """
+    int axis = (int)((%(axis_dtype)s*)PyArray_DATA(%(axis)s))[0];
+    if (axis < 0)
+        axis += PyArray_NDIM(%(x)s);
+    if (axis < 0 || axis >= PyArray_NDIM(%(x)s)) {
+        PyErr_Format(PyExc_ValueError,
+                     "%(name)s: axis %%d is out of bounds for an array of "
+                     "dimension %%d", axis, PyArray_NDIM(%(x)s));
+        %(fail)s
+    }
+    """ % locals()
+
+
+class SortOp(OpenMPOp):
     """
     This class is a wrapper for numpy sort function.
 
+    Its C code sorts the lines of the input in parallel over the other
+    dimensions. If `inplace`, the input is sorted in place.
+
     """
 
-    __props__ = ("kind", "order")
+    __props__ = ("kind", "order", "inplace")
 
-    def __init__(self, kind, order=None):
+    def __init__(self, kind, order=None, inplace=False, openmp=None):
         self.kind = kind
         self.order = order
+        self.inplace = inplace
+        if self.inplace:
+            self.destroy_map = {0: [0]}
+        super(SortOp, self).__init__(openmp=openmp)
+
+    def __setstate__(self, d):
+        super(SortOp, self).__setstate__(d)
+        if not hasattr(self, "inplace"):
+            self.inplace = False
 
     def __str__(self):
+        if self.inplace:
+            return self.__class__.__name__ + "{%s, %s, inplace}" % (
+                self.kind, str(self.order))
         return self.__class__.__name__ + "{%s, %s}" % (self.kind,
                                                        str(self.order))
 
@@ -30,7 +233,57 @@ class SortOp(theano.Op):
         a = inputs[0]
         axis = inputs[1]
         z = output_storage[0]
-        z[0] = np.sort(a, axis, self.kind, self.order)
+        if self.inplace:
+            a.sort(axis, self.kind, self.order)
+            z[0] = a
+        else:
+            z[0] = np.sort(a, axis, self.kind, self.order)
+
+    def c_support_code(self):
+        return _sort_support_code
+
+    def c_headers(self):
+        return ['<algorithm>', '<vector>'] + super(SortOp, self).c_headers()
+
+    def c_code(self, node, name, inp, out, sub):
+        x, axis = inp
+        z, = out
+        if self.order or self.kind not in _sort_kinds:
+            raise gof.utils.MethodNotDefined()
+        _c_check_dtype(self, node.inputs[0].dtype)
+        if (not isinstance(node.inputs[1].type, theano.tensor.TensorType) or
+                node.inputs[1].ndim != 0):
+            raise gof.utils.MethodNotDefined()
+        ctype, typenum = node.inputs[0].type.dtype_specs()[1:]
+        fail = sub['fail']
+        get_axis = _c_sort_axis(self, x, axis,
+                                node.inputs[1].type.dtype_specs()[1], fail)
+        if self.inplace:
+            alloc = """
+            Py_XDECREF(%(z)s);
+            %(z)s = %(x)s;
+            Py_INCREF(%(z)s);
+            """ % locals()
+        else:
+            alloc = _c_alloc(z, "PyArray_NDIM(%s)" % x,
+                             "PyArray_DIMS(%s)" % x, typenum, fail)
+        body = """
+        theano_sort_range(vals.begin(), vals.end(),
+                          theano_sort_less<%(ctype)s>(), %(kind)d);
+        for (npy_intp j = 0; j < n; ++j)
+            *(%(ctype)s*)(%(z)s_p + j * %(z)s_s) = vals[j];
+        """ % dict(ctype=ctype, z=z, kind=_sort_kinds[self.kind])
+        loop = _c_line_loop(x, [z], ctype, body, self.openmp)
+        return """
+        {
+        %(get_axis)s
+        %(alloc)s
+        %(loop)s
+        }
+        """ % locals()
+
+    def c_code_cache_version(self):
+        return (1, self.openmp, cgen.openmp_minsize())
 
     def infer_shape(self, node, inputs_shapes):
         if (isinstance(node.inputs[1], theano.Constant) and
@@ -131,17 +384,21 @@ def sort(a, axis=-1, kind='quicksort', order=None):
     return SortOp(kind, order)(a, axis)
 
 
-class ArgSortOp(theano.Op):
+class ArgSortOp(OpenMPOp):
     """
     This class is a wrapper for numpy argsort function.
 
+    Its C code sorts the lines of the input in parallel over the other
+    dimensions. The indices of equal values are in increasing order.
+
     """
 
     __props__ = ("kind", "order")
 
-    def __init__(self, kind, order=None):
+    def __init__(self, kind, order=None, openmp=None):
         self.kind = kind
         self.order = order
+        super(ArgSortOp, self).__init__(openmp=openmp)
 
     def __str__(self):
         return (self.__class__.__name__ +
@@ -161,6 +418,49 @@ class ArgSortOp(theano.Op):
         z[0] = theano._asarray(np.argsort(a, axis, self.kind, self.order),
                                dtype=node.outputs[0].dtype)
 
+    def c_support_code(self):
+        return _sort_support_code
+
+    def c_headers(self):
+        return (['<algorithm>', '<vector>'] +
+                super(ArgSortOp, self).c_headers())
+
+    def c_code(self, node, name, inp, out, sub):
+        x, axis = inp
+        z, = out
+        if self.order or self.kind not in _sort_kinds:
+            raise gof.utils.MethodNotDefined()
+        _c_check_dtype(self, node.inputs[0].dtype)
+        if (not isinstance(node.inputs[1].type, theano.tensor.TensorType) or
+                node.inputs[1].ndim != 0):
+            raise gof.utils.MethodNotDefined()
+        ctype = node.inputs[0].type.dtype_specs()[1]
+        zctype, typenum = node.outputs[0].type.dtype_specs()[1:]
+        fail = sub['fail']
+        get_axis = _c_sort_axis(self, x, axis,
+                                node.inputs[1].type.dtype_specs()[1], fail)
+        alloc = _c_alloc(z, "PyArray_NDIM(%s)" % x, "PyArray_DIMS(%s)" % x,
+                         typenum, fail)
+        body = """
+        theano_sort_range(order.begin(), order.end(),
+                          theano_sort_index_less<%(ctype)s>(&vals[0]),
+                          %(kind)d);
+        for (npy_intp j = 0; j < n; ++j)
+            *(%(zctype)s*)(%(z)s_p + j * %(z)s_s) = order[j];
+        """ % dict(ctype=ctype, zctype=zctype, z=z,
+                   kind=_sort_kinds[self.kind])
+        loop = _c_line_loop(x, [z], ctype, body, self.openmp)
+        return """
+        {
+        %(get_axis)s
+        %(alloc)s
+        %(loop)s
+        }
+        """ % locals()
+
+    def c_code_cache_version(self):
+        return (1, self.openmp, cgen.openmp_minsize())
+
     def infer_shape(self, node, inputs_shapes):
         if (isinstance(node.inputs[1], theano.Constant) and
                 node.inputs[1].data is None):
@@ -206,3 +506,356 @@ def argsort(a, axis=-1, kind='quicksort', order=None):
         a = a.flatten()
         axis = 0
     return ArgSortOp(kind, order)(a, axis)
+
+
+@gof.local_optimizer([SortOp], inplace=True)
+def local_inplace_sort(node):
+    if isinstance(node.op, SortOp) and not node.op.inplace:
+        new_op = SortOp(node.op.kind, node.op.order, inplace=True,
+                        openmp=node.op.openmp)
+        new_out = new_op(*node.inputs)
+        copy_stack_trace(node.outputs, new_out)
+        return [new_out]
+    return False
+
+
+theano.compile.optdb.register(
+    'local_inplace_sort',
+    gof.TopoOptimizer(local_inplace_sort,
+                      failure_callback=gof.TopoOptimizer.warn_inplace),
+    60, 'fast_run', 'inplace')
+
+
+class TopKOp(OpenMPOp):
+    """
+    Selects the `kth` largest elements along an axis, or the `-kth`
+    smallest ones if `kth` is negative.
+
+    The C code selects the elements of each line with a partial sort
+    (``std::nth_element``), in parallel over the other dimensions.
+
+    Parameters
+    ----------
+    axis : int
+        The axis along which the elements are selected.
+    sorted : bool
+        If True, the selected elements are in increasing order, as in
+        ``np.sort(x, axis)[..., -kth:]``, with the ties ordered by index.
+        Otherwise, their order is unspecified.
+    idx_dtype : str
+        The integer dtype of the indices.
+    return_values, return_indices : bool
+        Whether the node has an output for the values and an output for
+        the indices of the selected elements, in that order.
+
+    """
+
+    __props__ = ("axis", "sorted", "idx_dtype", "return_values",
+                 "return_indices")
+
+    def __init__(self, axis=-1, sorted=True, idx_dtype='int64',
+                 return_values=True, return_indices=True, openmp=None):
+        if not isinstance(axis, integer_types):
+            raise TypeError(
+                '"axis" parameter must be integer, got "%s"' % type(axis))
+        if idx_dtype not in theano.tensor.integer_dtypes:
+            raise TypeError(
+                '"idx_dtype" parameter must be an integer dtype, got "%s"' %
+                idx_dtype)
+        if not (return_values or return_indices):
+            raise ValueError(
+                "Neither return_values nor return_indices is True, this "
+                "isn't allowed")
+        self.axis = axis
+        self.sorted = sorted
+        self.idx_dtype = idx_dtype
+        self.return_values = return_values
+        self.return_indices = return_indices
+        super(TopKOp, self).__init__(openmp=openmp)
+
+    def __str__(self):
+        return "%s{axis=%d, sorted=%s}" % (self.__class__.__name__,
+                                           self.axis, self.sorted)
+
+    def make_node(self, inp, kth):
+        inp = theano.tensor.as_tensor_variable(inp)
+        ndim = inp.ndim
+        if ndim == 0:
+            raise ValueError('Cannot take scalar as input')
+        if not -ndim <= self.axis < ndim:
+            raise IndexError(
+                '"axis" parameter out of range,'
+                ' expected integer within [%d, %d]' % (-ndim, ndim - 1))
+        kth = theano.tensor.as_tensor_variable(kth)
+        if kth.ndim != 0 or kth.dtype not in theano.tensor.integer_dtypes:
+            raise TypeError('"kth" must be an integer scalar, got %s' % kth)
+        bcast = list(inp.broadcastable)
+        bcast[self.axis % ndim] = False
+        outs = []
+        if self.return_values:
+            outs.append(inp.type.clone(broadcastable=bcast)())
+        if self.return_indices:
+            outs.append(theano.tensor.TensorType(
+                dtype=self.idx_dtype, broadcastable=bcast)())
+        return theano.Apply(self, [inp, kth], outs)
+
+    def perform(self, node, inputs, output_storage):
+        x, k = inputs
+        k = int(k)
+        axis = self.axis % x.ndim
+        n = x.shape[axis]
+        if abs(k) > n:
+            raise ValueError("TopKOp: |kth| is %d, but the size of the "
+                             "axis is %d" % (abs(k), n))
+        # Select along the last axis of a 2d view of the lines.
+        xl = np.swapaxes(x, axis, -1)
+        shape = xl.shape[:-1] + (abs(k),)
+        x2 = xl.reshape(int(np.prod(xl.shape[:-1])), n)
+        # A stable sort orders the ties by index, like the C code.
+        # np.argpartition would break them arbitrarily.
+        order = np.argsort(x2, axis=1, kind='mergesort')
+        idx = order[:, n - k:] if k > 0 else order[:, :-k]
+        rows = np.arange(x2.shape[0])[:, None]
+        outs = []
+        if self.return_values:
+            outs.append(x2[rows, idx])
+        if self.return_indices:
+            outs.append(idx.astype(self.idx_dtype))
+        for z, o in zip(output_storage, outs):
+            z[0] = np.ascontiguousarray(
+                np.swapaxes(o.reshape(shape), axis, -1))
+
+    def infer_shape(self, node, inp_shapes):
+        shp = list(inp_shapes[0])
+        shp[self.axis % len(shp)] = theano.tensor.abs_(node.inputs[1])
+        return [tuple(shp)] * len(node.outputs)
+
+    def L_op(self, inputs, outputs, out_grads):
+        x, k = inputs
+        k_grad = theano.gradient.grad_undefined(
+            self, 1, k,
+            "The gradient of TopKOp is not defined with respect to kth")
+        if (not self.return_values or
+                isinstance(out_grads[0].type, DisconnectedType)):
+            return [x.zeros_like(), k_grad]
+        if self.return_indices:
+            idx = outputs[1]
+        else:
+            idx = TopKOp(self.axis, self.sorted, self.idx_dtype,
+                         return_values=False, openmp=self.openmp)(x, k)
+        # Scatter the gradient of the values to their indices.
+        axis = self.axis % x.ndim
+        indices = []
+        for i in range(x.ndim):
+            if i == axis:
+                indices.append(idx)
+            else:
+                index_shape = [1] * x.ndim
+                index_shape[i] = idx.shape[i]
+                indices.append(arange(idx.shape[i]).reshape(index_shape))
+        x_grad = theano.tensor.inc_subtensor(
+            x.zeros_like(out_grads[0].dtype)[tuple(indices)], out_grads[0])
+        return [x_grad, k_grad]
+
+    def c_support_code(self):
+        return _sort_support_code
+
+    def c_headers(self):
+        return (['<algorithm>', '<vector>'] +
+                super(TopKOp, self).c_headers())
+
+    def c_code(self, node, name, inp, out, sub):
+        x, kth = inp
+        _c_check_dtype(self, node.inputs[0].dtype)
+        fail = sub['fail']
+        ndim = node.inputs[0].ndim
+        axis = self.axis % ndim
+        ctype = node.inputs[0].type.dtype_specs()[1]
+        kdtype = node.inputs[1].type.dtype_specs()[1]
+        sorted = int(bool(self.sorted))
+        alloc = ""
+        copy = ""
+        outs = list(out)
+        if self.return_values:
+            zv = outs.pop(0)
+            alloc += _c_alloc(zv, ndim, "dims",
+                              node.inputs[0].type.dtype_specs()[2], fail)
+            copy += """
+            *(%(ctype)s*)(%(zv)s_p + j * %(zv)s_s) = vals[i];
+            """ % locals()
+        if self.return_indices:
+            zi = outs.pop(0)
+            ictype, itypenum = theano.tensor.TensorType(
+                self.idx_dtype, ()).dtype_specs()[1:]
+            alloc += _c_alloc(zi, ndim, "dims", itypenum, fail)
+            copy += """
+            *(%(ictype)s*)(%(zi)s_p + j * %(zi)s_s) = i;
+            """ % locals()
+        body = """
+        theano_topk_order(&vals[0], &order[0], n, k, largest, %(sorted)s);
+        const npy_intp start = largest ? n - k : 0;
+        for (npy_intp j = 0; j < k; ++j) {
+            const npy_intp i = order[start + j];
+            %(copy)s
+        }
+        """ % locals()
+        loop = _c_line_loop(x, list(out), ctype, body, self.openmp)
+        return """
+        {
+        const int axis = %(axis)s;
+        npy_intp k = (npy_intp)((%(kdtype)s*)PyArray_DATA(%(kth)s))[0];
+        const bool largest = k > 0;
+        if (k < 0)
+            k = -k;
+        if (k > PyArray_DIMS(%(x)s)[axis]) {
+            PyErr_Format(PyExc_ValueError,
+                         "TopKOp: |kth| is %%lld, but the size of the axis "
+                         "is %%lld", (long long)k,
+                         (long long)PyArray_DIMS(%(x)s)[axis]);
+            %(fail)s
+        }
+        npy_intp dims[%(ndim)s];
+        for (int d = 0; d < %(ndim)s; ++d)
+            dims[d] = PyArray_DIMS(%(x)s)[d];
+        dims[axis] = k;
+        %(alloc)s
+        if (k > 0) {
+            %(loop)s
+        }
+        }
+        """ % locals()
+
+    def c_code_cache_version(self):
+        return (1, self.openmp, cgen.openmp_minsize())
+
+
+def topk(x, kth, axis=-1, sorted=True, idx_dtype='int64'):
+    """
+    Returns the `kth` largest elements of `x` along `axis`.
+
+    Parameters
+    ----------
+    x : Tensor
+        The input.
+    kth : integer scalar
+        The number of elements to select. If negative, the `-kth`
+        smallest elements are selected.
+    axis : int or None
+        The axis along which the elements are selected. If None, `x` is
+        flattened first.
+    sorted : bool
+        If True, the elements are in increasing order, so that
+        ``topk(x, k)`` is ``sort(x)[..., -k:]`` and ``topk(x, -k)`` is
+        ``sort(x)[..., :k]``. Otherwise, their order is unspecified.
+    idx_dtype : str
+        The dtype of the indices computed along the way.
+
+    Returns
+    -------
+    Tensor
+        The selected elements, with the shape of `x` except along `axis`,
+        where the size is ``abs(kth)``.
+
+    """
+    if axis is None:
+        x = theano.tensor.flatten(x)
+        axis = 0
+    return TopKOp(axis=axis, sorted=sorted, idx_dtype=idx_dtype,
+                  return_indices=False)(x, kth)
+
+
+def argtopk(x, kth, axis=-1, sorted=True, idx_dtype='int64'):
+    """
+    Returns the indices of the `kth` largest elements of `x` along `axis`.
+
+    See `topk` for the parameters. The indices of equal elements are in
+    increasing order if `sorted`.
+
+    """
+    if axis is None:
+        x = theano.tensor.flatten(x)
+        axis = 0
+    return TopKOp(axis=axis, sorted=sorted, idx_dtype=idx_dtype,
+                  return_values=False)(x, kth)
+
+
+def topk_and_argtopk(x, kth, axis=-1, sorted=True, idx_dtype='int64'):
+    """
+    Returns the results of `topk` and `argtopk` computed together.
+
+    """
+    if axis is None:
+        x = theano.tensor.flatten(x)
+        axis = 0
+    return TopKOp(axis=axis, sorted=sorted, idx_dtype=idx_dtype)(x, kth)
+
+
+def _as_int_constant(v):
+    # The int value of a slice entry, or False if it is not constant.
+    if v is None or isinstance(v, integer_types):
+        return v
+    try:
+        return int(theano.tensor.get_scalar_constant_value(v))
+    except theano.tensor.NotScalarConstantError:
+        return False
+
+
+@register_specialize
+@gof.local_optimizer([Subtensor])
+def local_sort_subtensor_topk(node):
+    """
+    sort(x, axis)[..., -k:] -> topk(x, k, axis)
+    argsort(x, axis)[..., -k:] -> argtopk(x, k, axis)
+
+    Also for the first `k` elements, with ``[..., :k]`` and ``-k``.
+
+    """
+    if not isinstance(node.op, Subtensor):
+        return False
+    s = node.inputs[0]
+    if (not s.owner or
+            not isinstance(s.owner.op, (SortOp, ArgSortOp)) or
+            s.owner.op.order or
+            len(s.clients) != 1):
+        return False
+    x, axis = s.owner.inputs
+    try:
+        axis = int(theano.tensor.get_scalar_constant_value(axis))
+    except theano.tensor.NotScalarConstantError:
+        return False
+    if not -x.ndim <= axis < x.ndim:
+        return False
+    axis %= x.ndim
+
+    idx_list = list(get_idx_list(node.inputs, node.op.idx_list))
+    idx_list += [slice(None)] * (x.ndim - len(idx_list))
+    for i, entry in enumerate(idx_list):
+        if not isinstance(entry, slice):
+            return False
+        if i != axis and entry != slice(None):
+            return False
+    start, stop, step = [_as_int_constant(v)
+                         for v in (idx_list[axis].start,
+                                   idx_list[axis].stop,
+                                   idx_list[axis].step)]
+    if step is not None:
+        return False
+    if isinstance(start, integer_types) and start < 0 and stop is None:
+        kth = -start
+        sign = 1
+    elif start is None and isinstance(stop, integer_types) and stop > 0:
+        kth = stop
+        sign = -1
+    else:
+        return False
+    # The slice stops at the bounds of the axis.
+    kth = sign * theano.tensor.minimum(kth, x.shape[axis])
+
+    if isinstance(s.owner.op, SortOp):
+        out = TopKOp(axis=axis, return_indices=False)(x, kth)
+    else:
+        out = TopKOp(axis=axis, idx_dtype=s.dtype,
+                     return_values=False)(x, kth)
+    out = theano.tensor.patternbroadcast(out, node.outputs[0].broadcastable)
+    copy_stack_trace(node.outputs[0], out)
+    return [out]
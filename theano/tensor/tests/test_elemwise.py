@@ -17,7 +17,7 @@ from theano import tensor
 from theano.tensor import TensorType, as_tensor_variable
 from theano.compile.mode import get_default_mode, Mode
 from theano.tensor.elemwise import (CAReduce, Elemwise, DimShuffle,
-                                    Prod, ProdWithoutZeros)
+                                    FusedCAReduce, Prod, ProdWithoutZeros)
 from theano.tests import unittest_tools
 from theano.tests.unittest_tools import attr
 
@@ -316,6 +316,31 @@ class test_Broadcast(unittest.TestCase):
             zv = xv + yv
             assert (f(xv, yv) == zv).all()
 
+    def test_contiguous_paths(self):
+        # Rows and columns broadcasted on contiguous operands, and
+        # operands transposed compared to the others.
+        if not theano.config.cxx:
+            raise SkipTest("G++ not available, so we need to skip this test.")
+        for linker, op, t, rval in zip(self.linkers, [self.op, self.cop],
+                                       [self.type, self.ctype],
+                                       [self.rand_val, self.rand_cval]):
+            for xsh, ysh, transpose in [((37, 45), (1, 45), False),
+                                        ((37, 45), (37, 1), False),
+                                        ((4, 37, 45), (1, 37, 45), False),
+                                        ((4, 37, 45), (4, 1, 1), False),
+                                        ((37, 45), (45, 37), True),
+                                        ((3, 100), (100, 3), True)]:
+                x = t(theano.config.floatX, [n == 1 for n in xsh])('x')
+                y = t(theano.config.floatX, [n == 1 for n in ysh])('y')
+                yt = y.T if transpose else y
+                e = op(scalar.mul)(x, op(scalar.exp)(yt))
+                f = linker().accept(FunctionGraph([x, y],
+                                                  [e])).make_function()
+                xv = rval(xsh)
+                yv = rval(ysh)
+                zv = xv * np.exp(yv.T if transpose else yv)
+                unittest_tools.assert_allclose(f(xv, yv), zv)
+
     def test_same_inputs(self):
         if not theano.config.cxx:
             raise SkipTest("G++ not available, so we need to skip this test.")
@@ -599,6 +624,72 @@ class test_CAReduce(unittest_tools.InferShapeTester):
                                     warn=0 not in xsh)
 
 
+def test_careduce_parallel():
+    # Reductions over the leading or trailing axes of contiguous
+    # inputs, shared between threads and summed pairwise.
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    rng = np.random.RandomState(unittest_tools.fetch_seed())
+    with theano.configparser.change_flags(openmp_elemwise_minsize=10):
+        for openmp in [False, True]:
+            for xsh, axis in [((300, 7), (0,)),
+                              ((300, 7), (1,)),
+                              ((3, 700), (1,)),
+                              ((5, 4, 300), (1, 2)),
+                              ((300, 4, 5), (0, 1)),
+                              ((1000,), None)]:
+                x = TensorType(theano.config.floatX, [False] * len(xsh))('x')
+                for scalar_op, np_op in [(scalar.add, np.sum),
+                                         (scalar.maximum, np.max)]:
+                    op = CAReduce(scalar_op, axis=axis, openmp=openmp)
+                    f = theano.function([x], op(x),
+                                        mode=Mode(linker='c'))
+                    xv = np.asarray(rng.rand(*xsh),
+                                    dtype=theano.config.floatX)
+                    unittest_tools.assert_allclose(f(xv),
+                                                   np_op(xv, axis=axis))
+
+    # Pairwise summation keeps float32 sums accurate.
+    x = TensorType('float32', [False])('x')
+    f = theano.function([x], CAReduce(scalar.add)(x),
+                        mode=Mode(linker='c'))
+    xv = np.ones(10 ** 6, dtype='float32') * np.float32(0.1)
+    assert abs(f(xv) - 1e5) < 1
+
+
+def test_fused_careduce_parallel():
+    # The fused reductions over the leading or trailing axes use the
+    # parallel reduction of CAReduce.
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    rng = np.random.RandomState(unittest_tools.fetch_seed())
+    sa = scalar.float64('a')
+    sb = scalar.float64('b')
+    sqr_diff = scalar.Composite([sa, sb], [scalar.sqr(sa - sb)])
+    with theano.configparser.change_flags(openmp_elemwise_minsize=10):
+        for openmp in [False, True]:
+            for xsh, axis in [((300, 7), (0,)),
+                              ((300, 7), (1,)),
+                              ((3, 700), (1,)),
+                              ((5, 4, 300), (1, 2)),
+                              ((300, 4, 5), (0, 1)),
+                              ((1000,), None)]:
+                x = TensorType('float64', [False] * len(xsh))('x')
+                y = TensorType('float64', [False] * len(xsh))('y')
+                op = FusedCAReduce(sqr_diff, scalar.add, axis=axis,
+                                   openmp=openmp)
+                f = theano.function([x, y], op(x, y),
+                                    mode=Mode(linker='c'))
+                xv = rng.rand(*xsh)
+                yv = rng.rand(*xsh)
+                unittest_tools.assert_allclose(
+                    f(xv, yv), ((xv - yv) ** 2).sum(axis=axis))
+                # Non-contiguous inputs use the serial loop.
+                xv = rng.rand(*(xsh[:-1] + (2 * xsh[-1],)))[..., ::2]
+                unittest_tools.assert_allclose(
+                    f(xv, yv), ((xv - yv) ** 2).sum(axis=axis))
+
+
 class test_Prod(unittest.TestCase):
     def setUp(self):
         unittest_tools.seed_rng()
@@ -1366,6 +1366,47 @@ class TestCompositeCodegen(unittest.TestCase):
         utt.assert_allclose(f([[1.]]), [[0.]])
 
 
+def test_local_careduce_fusion():
+    if not config.tensor.local_elemwise_fusion:
+        raise SkipTest("The elemwise fusion is disabled")
+    FusedCAReduce = theano.tensor.elemwise.FusedCAReduce
+    x = T.matrix('x')
+    y = T.matrix('y')
+    r = T.row('r')
+    rng = np.random.RandomState(utt.fetch_seed())
+    xv = rng.rand(4, 5).astype(config.floatX)
+    yv = rng.rand(4, 5).astype(config.floatX)
+    rv = rng.rand(1, 5).astype(config.floatX)
+    for openmp, linker in [(False, 'py'), (False, 'cvm'), (True, 'cvm')]:
+        mode = theano.compile.Mode(linker=linker, optimizer='fast_run')
+        for axis in [None, 0, 1, (0, 1)]:
+            with theano.configparser.change_flags(openmp=openmp):
+                cases = [(T.sqr(x - y).sum(axis=axis),
+                          ((xv - yv) ** 2).sum(axis=axis), True),
+                         # The parallel CAReduce is kept when the fused
+                         # reduction could not be parallel.
+                         (T.exp(x + r).prod(axis=axis),
+                          np.exp(xv + rv).prod(axis=axis), not openmp),
+                         (T.neq(x, y).sum(axis=axis),
+                          (xv != yv).sum(axis=axis), True)]
+            for out, ref, fused in cases:
+                f = function([x, y, r], out, mode=mode,
+                             on_unused_input='ignore')
+                topo = f.maker.fgraph.toposort()
+                assert fused == any(isinstance(n.op, FusedCAReduce)
+                                    for n in topo)
+                assert fused != any(isinstance(n.op, T.Elemwise)
+                                    for n in topo)
+                assert f(xv, yv, rv).dtype == out.dtype
+                utt.assert_allclose(f(xv, yv, rv), ref)
+
+    # The Elemwise is not computed twice.
+    d = T.sqr(x - y)
+    f = function([x, y], [d, d.sum()], mode='FAST_RUN')
+    topo = f.maker.fgraph.toposort()
+    assert not any(isinstance(n.op, FusedCAReduce) for n in topo)
+
+
 def test_log1p():
     m = theano.config.mode
     if m == 'FAST_COMPILE':
@@ -1,5 +1,8 @@
 from __future__ import absolute_import, print_function, division
+import os
+import shutil
 import six
+import tempfile
 
 import numpy as np
 import unittest
@@ -604,3 +607,30 @@ def test_scalar_shared_options():
     # Simple test to make sure we do not loose that fonctionality.
     theano.shared(value=0., name='lk', borrow=True)
     theano.shared(value=np.float32(0.), name='lk', borrow=True)
+
+
+def test_memmap_shared():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, 'value.npy')
+        np.save(filename, np.arange(6, dtype=theano.config.floatX))
+        for value in [filename, np.load(filename, mmap_mode='r+')]:
+            x = theano.shared(value, name='x')
+            assert isinstance(x, theano.tensor.sharedvar.TensorSharedVariable)
+            # The value stays mapped read-only, without a copy.
+            mapped = x.get_value(borrow=True)
+            assert isinstance(mapped, np.memmap)
+            assert mapped.filename == os.path.abspath(filename)
+            assert not mapped.flags.writeable
+            assert type(x.get_value()) is np.ndarray
+
+            # An update replaces the value instead of writing in the file.
+            f = theano.function([], x * 2, updates=[(x, x + 1)])
+            utt.assert_allclose(f(), np.arange(6) * 2)
+            utt.assert_allclose(x.get_value(), np.arange(6) + 1)
+            utt.assert_allclose(np.load(filename), np.arange(6))
+            del mapped, x, f
+        assert theano.shared(np.arange(3)).get_value(
+            borrow=True).__class__ is np.ndarray
+    finally:
+        shutil.rmtree(tmpdir)
@@ -9,6 +9,7 @@ from theano import tensor
 
 from theano.tensor.sort import sort, SortOp
 from theano.tensor.sort import argsort, ArgSortOp
+from theano.tensor.sort import topk, argtopk, topk_and_argtopk, TopKOp
 
 
 class test_sort(unittest.TestCase):
@@ -132,6 +133,101 @@ class test_sort(unittest.TestCase):
         data = np.random.rand(2, 3, 4, 2).astype(theano.config.floatX)
         utt.verify_grad(lambda x: sort(x, 3), [data])
 
+    def test_c_code(self):
+        # NaN are sorted last and the ties of argsort are in index order.
+        mode = theano.compile.get_mode('FAST_RUN')
+        a = tensor.dmatrix()
+        axis = tensor.lscalar()
+        f = theano.function([a, axis], [sort(a + 1, axis),
+                                        argsort(a, axis, 'mergesort')],
+                            mode=mode)
+        if theano.config.cxx:
+            sort_node = [n for n in f.maker.fgraph.toposort()
+                         if isinstance(n.op, SortOp)][0]
+            assert sort_node.op.inplace
+        val = self.rng.randint(0, 4, (5, 7)).astype('float64')
+        val[1, 2] = val[3, 4] = np.nan
+        for axis_val in 0, 1, -1:
+            s, i = f(val, axis_val)
+            np.testing.assert_array_equal(s, np.sort(val + 1, axis_val))
+            assert np.all(i == np.argsort(val, axis_val, kind='mergesort'))
+        # The input is not modified.
+        assert np.isnan(val[1, 2])
+
+
+class TestTopK(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.RandomState(seed=utt.fetch_seed())
+        self.mode = theano.compile.get_mode('FAST_RUN')
+
+    def test_topk(self):
+        x = tensor.tensor3()
+        k = tensor.lscalar()
+        val = self.rng.randint(0, 5, (4, 6, 5)).astype(theano.config.floatX)
+        for axis in 0, 1, -1:
+            for sorted in True, False:
+                v, i = topk_and_argtopk(x, k, axis=axis, sorted=sorted)
+                fs = [theano.function([x, k], [v, i], mode=self.mode),
+                      theano.function([x, k], [v, i],
+                                      mode=theano.compile.Mode(
+                                          linker='py', optimizer=None))]
+                for f in fs:
+                    for k_val in 1, 3, -2, 0:
+                        gv, gi = f(val, k_val)
+                        ref = np.argsort(val, axis, kind='mergesort')
+                        if k_val >= 0:
+                            ref = np.take(ref, np.arange(
+                                val.shape[axis] - k_val, val.shape[axis]),
+                                axis)
+                        else:
+                            ref = np.take(ref, np.arange(-k_val), axis)
+                        ref_v = np.sort(val, axis)
+                        ref_v = np.take(ref_v, np.arange(
+                            val.shape[axis] - abs(k_val), val.shape[axis]
+                        ) if k_val >= 0 else np.arange(-k_val), axis)
+                        assert gi.dtype == 'int64'
+                        assert gv.shape == ref_v.shape
+                        if sorted:
+                            assert np.all(gi == ref)
+                        else:
+                            # The selected indices of ties may differ.
+                            gv = np.sort(gv, axis)
+                        utt.assert_allclose(gv, ref_v)
+                    self.assertRaises(ValueError, f, val, 7)
+
+    def test_functions(self):
+        x = tensor.matrix()
+        val = self.rng.rand(3, 4).astype(theano.config.floatX)
+        f = theano.function([x], [topk(x, 2), argtopk(x, -1, axis=0),
+                                  topk(x, 3, axis=None)], mode=self.mode)
+        v, i, vn = f(val)
+        utt.assert_allclose(v, np.sort(val)[:, -2:])
+        assert np.all(i == np.argsort(val, axis=0)[:1])
+        utt.assert_allclose(vn, np.sort(val, None)[-3:])
+        self.assertRaises(ValueError, TopKOp, return_values=False,
+                          return_indices=False)
+
+    def test_grad(self):
+        val = self.rng.rand(3, 5).astype(theano.config.floatX)
+        utt.verify_grad(lambda x: topk(x, 2), [val])
+        utt.verify_grad(lambda x: topk(x, -3, axis=0), [val])
+        utt.verify_grad(lambda x: topk_and_argtopk(x, 4)[0], [val])
+
+    def test_sort_subtensor(self):
+        x = tensor.matrix()
+        val = self.rng.rand(3, 5).astype(theano.config.floatX)
+        for out, ref in [(argsort(x)[:, -2:], np.argsort(val)[:, -2:]),
+                         (argsort(x)[:, :3], np.argsort(val)[:, :3]),
+                         (argsort(x, 0)[-7:], np.argsort(val, 0)[-7:]),
+                         (sort(x)[:, -2:], np.sort(val)[:, -2:])]:
+            f = theano.function([x], out, mode=self.mode)
+            topo = f.maker.fgraph.toposort()
+            assert any(isinstance(n.op, TopKOp) for n in topo)
+            assert not any(isinstance(n.op, (SortOp, ArgSortOp))
+                           for n in topo)
+            utt.assert_allclose(f(val), ref)
+
 
 class TensorInferShapeTester(utt.InferShapeTester):
     def test_sort(self):
@@ -147,6 +243,15 @@ class TensorInferShapeTester(utt.InferShapeTester):
                 [np.random.randn(10, 40).astype(theano.config.floatX)],
                 SortOp)
 
+    def test_topk(self):
+        x = tensor.matrix()
+        k = tensor.lscalar()
+        self._compile_and_check(
+                [x, k],
+                topk_and_argtopk(x, k),
+                [np.random.randn(10, 40).astype(theano.config.floatX), -3],
+                TopKOp)
+
 
 def test_argsort():
     # Set up
@@ -614,6 +614,48 @@ def test_subgraph_grad():
         assert(np.sum(np.abs(true_grad - pgrad)) < 0.00001)
 
 
+def test_grad_checkpoints():
+    # Tests that recomputing the forward graph in the backward pass gives
+    # the same gradients, for each way to choose the checkpoints.
+    rng = np.random.RandomState(utt.fetch_seed())
+    x = theano.tensor.matrix('x')
+    ws = [theano.shared(rng.randn(4, 4).astype(config.floatX))
+          for i in range(6)]
+    hs = [x]
+    for w in ws:
+        hs.append(theano.tensor.tanh(theano.tensor.dot(hs[-1], w)))
+    cost = theano.tensor.sqr(hs[-1]).sum()
+    wrt = [x, hs[3]] + ws
+
+    x_val = rng.randn(3, 4).astype(config.floatX)
+    true_grads = theano.function([x], theano.grad(cost, wrt))(x_val)
+    for checkpoints in ['sqrt', [hs[2], hs[4]], 100]:
+        grads = theano.grad(cost, wrt, checkpoints=checkpoints)
+        apply_nodes = gof.graph.io_toposort([x], grads)
+        assert any(isinstance(node.op, theano.OpFromGraph)
+                   for node in apply_nodes)
+        for true_grad, g in zip(true_grads,
+                                theano.function([x], grads)(x_val)):
+            utt.assert_allclose(true_grad, g)
+
+    # consider_constant blocks the gradient between two segments.
+    # The first weights are then disconnected from the cost.
+    true_grads = theano.function([x], theano.grad(
+        cost, ws, consider_constant=[hs[3]],
+        disconnected_inputs='ignore'))(x_val)
+    grads = theano.grad(cost, ws, consider_constant=[hs[3]],
+                        disconnected_inputs='ignore', checkpoints='sqrt')
+    for true_grad, g in zip(true_grads, theano.function([x], grads)(x_val)):
+        utt.assert_allclose(true_grad, g)
+
+    try:
+        theano.grad(cost, ws, checkpoints='all')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Invalid checkpoints did not raise")
+
+
 class TestConsiderConstant(unittest.TestCase):
 
     def setUp(self):